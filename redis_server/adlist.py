@@ -60,17 +60,13 @@ def listCreate() -> rList:
     return rList()
 
 def listRelease(l: rList):
-    del rList
-    # current = l.head
-    # length = l.len
-    # while length:
-    #     length -= 1
-    #     next_ = current.next
-    #     if l.free:
-    #         l.free(current.value)
-    #     zfree(current)
-    #     current = next_
-    # zfree(l)
+    current = l.head
+    while current:
+        if l.free:
+            l.free(current.value)
+        current = current.next
+    l.head = l.tail = None
+    l.len = 0
 
 def listAddNodeHead(l: rList, value) -> rList:
     """把value插入到rList.head之前"""
@@ -1,15 +1,11 @@
 import typing
-from typing import List, Callable, Optional as Opt, Tuple, Union
+from typing import List, Callable, Optional as Opt, Tuple, Dict
 import select
-import time
-import socket
-from datetime import datetime, timedelta
-from collections import namedtuple
-from .csix import cstr, timeval
-from .ae_api import (
-    aeApiCreate, aeApiFree, aeApiAddEvent, aeApiDelEvent, aeApiPoll, aeApiName,
-    aeApiResize,
-)
+import heapq
+from types import ModuleType
+from .csix import timeval
+from .clock import getMonotonicUs
+from .ae_api import aeApiLoad
 
 if typing.TYPE_CHECKING:
     from .redis import RedisClient
@@ -40,6 +36,8 @@ AE_DONT_WAIT = 4
 
 # 决定时间事件是否要持续执行的 flag
 AE_NOMORE = -1
+# 已删除的时间事件的 id
+AE_DELETED_EVENT_ID = -1
 
 class aeFileEvent:
     def __init__(self):
@@ -51,61 +49,79 @@ class aeFileEvent:
 class aeTimeEvent:
     def __init__(self):
         self.id: int = 0
-        self.when_sec: int = None
-        self.when_ms: int = None
+        # 到期时间, 单调时钟的毫秒数, 不受系统时间修改的影响
+        self.when: int = 0
         self.timeProc = None
         self.finalizerProc = None
         self.clientData = None
-        self.next: Opt['aeTimeEvent'] = None
-
-class aeFiredEvent:
-    def __init__(self):
-        self.fd: int = 0
-        self.mask: int = 0
 
 class aeEventLoop:
     def __init__(self):
         self.maxfd: int = 0
         self.setsize: int = 0
         self.timeEventNextId: int = 0
-        self.setsize: int = 0
-        self.lastTime: datetime = None
         self.events: List[aeFileEvent] = None
-        self.fired: List[aeFiredEvent] = None
-        self.timeEventHead: Opt[aeTimeEvent] = None
+        # 已就绪的文件事件, 每个元素为 (fd, mask), 由 aeApiPoll 填充
+        # 只包含真正就绪的 fd, 长度和活跃连接数成正比, 和已连接的数量无关
+        self.fired: List[Tuple[int, int]] = None
+        # 时间事件的最小堆, 元素为 (when, id, aeTimeEvent), 堆顶是最近到期的事件
+        self.timeEventHeap: List[Tuple[int, int, aeTimeEvent]] = None
+        # id -> 未删除的时间事件
+        self.timeEvents: Dict[int, aeTimeEvent] = None
+        # 堆中已被删除但还没有弹出的事件数量
+        self.timeEventDeleted: int = 0
         self.stop: int = 0
+        # 多路复用后端模块, 见 ae_api.aeApiLoad
+        self.api: ModuleType = None
         self.apidata = None
         self.beforesleep: Opt[Callable[[aeEventLoop], None]] = None
-
-def aeCreateEventLoop(setsize: int) -> aeEventLoop:
+        # 从 poll 返回后, 处理事件之前调用
+        self.aftersleep: Opt[Callable[[aeEventLoop], None]] = None
+        # AE_DONT_WAIT: 还有工作要做, poll 不阻塞, 见 aeSetDontWait
+        self.flags: int = 0
+        # 事件循环利用率: 执行事件的时间和阻塞在 aeApiPoll 中的时间, 以微秒为单位
+        self.cycles: int = 0
+        self.busy_us: int = 0
+        self.poll_us: int = 0
+        # 上一次从 aeApiPoll 返回之前连续执行的时间
+        self.last_busy_us: int = 0
+        self.poll_end_us: int = 0
+
+def aeCreateEventLoop(setsize: int, backend: str = '') -> aeEventLoop:
     eventLoop = aeEventLoop()
+    eventLoop.api = aeApiLoad(backend)
     eventLoop.events = [aeFileEvent() for _ in range(setsize)]
-    eventLoop.fired = [aeFiredEvent() for _ in range(setsize)]
+    eventLoop.fired = []
     eventLoop.setsize = setsize
-    eventLoop.lastTime = datetime.now()
-    eventLoop.timeEventHead = None
+    eventLoop.timeEventHeap = []
+    eventLoop.timeEvents = {}
+    eventLoop.timeEventDeleted = 0
     eventLoop.timeEventNextId = 0
     eventLoop.stop = 0
     eventLoop.maxfd = -1
     eventLoop.beforesleep = None
-    aeApiCreate(eventLoop)
+    eventLoop.aftersleep = None
+    eventLoop.flags = 0
+    if eventLoop.api.aeApiCreate(eventLoop) == -1:
+        raise RuntimeError(AE_ERR)
     for i in range(setsize):
         eventLoop.events[i].mask = AE_NONE
     return eventLoop
 
 def aeDeleteEventLoop(eventLoop: aeEventLoop):
-    aeApiFree(eventLoop)
+    eventLoop.api.aeApiFree(eventLoop)
 
 def aeStop(eventLoop: aeEventLoop) -> None:
     eventLoop.stop = 1
 
 def aeCreateFileEvent(eventLoop: aeEventLoop, fd: int,
-                      mask: int, proc: Callable, clientData: Opt['RedisClient']) -> int:
+                      mask: int, proc: Callable, clientData) -> int:
+    # clientData 会原样传给 proc: 客户端的读写事件是 RedisClient, 监听事件是监听的 socket
     if fd >= eventLoop.setsize:
         raise RuntimeError(AE_ERR)
 
     fe = eventLoop.events[fd]
-    if aeApiAddEvent(eventLoop, fd, mask) == -1:
+    if eventLoop.api.aeApiAddEvent(eventLoop, fd, mask) == -1:
         return AE_ERR
 
     fe.mask |= mask
@@ -132,7 +148,7 @@ def aeDeleteFileEvent(eventLoop: aeEventLoop, fd: int, mask: int) -> None:
             if eventLoop.events[j].mask != AE_NONE:
                 break
         eventLoop.maxfd = j
-    aeApiDelEvent(eventLoop, fd, mask)
+    eventLoop.api.aeApiDelEvent(eventLoop, fd, mask)
 
 def aeGetFileEvents(eventLoop: aeEventLoop, fd: int) -> int:
     if fd >= eventLoop.setsize:
@@ -141,67 +157,78 @@ def aeGetFileEvents(eventLoop: aeEventLoop, fd: int) -> int:
 
 def aeCreateTimeEvent(eventLoop: aeEventLoop, milliseconds: int,
                       proc: Callable, clientData, finalizerProc: Opt[Callable]) -> int:
-    ident = eventLoop.timeEventNextId + 1
+    ident = eventLoop.timeEventNextId
+    eventLoop.timeEventNextId += 1
     te = aeTimeEvent()
     te.id = ident
-    te.when_sec, te.when_ms = aeAddMillisecondsToNow(milliseconds)
+    te.when = aeGetMonotonicMs() + milliseconds
     te.timeProc = proc
     te.finalizerProc = finalizerProc
     te.clientData = clientData
-    te.next = eventLoop.timeEventHead
-    eventLoop.timeEventHead = te
+    heapq.heappush(eventLoop.timeEventHeap, (te.when, ident, te))
+    eventLoop.timeEvents[ident] = te
     return ident
 
-def aeDeleteTimeEvent(eventLoop: aeEventLoop, ident: int):
-    te = eventLoop.timeEventHead
-    prev = None
-    while te:
-        if te.id == ident:
-            if prev == None:
-                eventLoop.timeEventHead = te.next
-            else:
-                assert prev
-                prev.next = te.next
-            if te.finalizerProc:
-                te.finalizerProc(eventLoop, te.clientData)
-            return AE_OK
-        prev = te
-        te = te.next
-    return AE_ERR
+def aeDeleteTimeEvent(eventLoop: aeEventLoop, ident: int) -> int:
+    te = eventLoop.timeEvents.pop(ident, None)
+    if te is None:
+        return AE_ERR
+    # 惰性删除: 只做标记, 等它到达堆顶时再弹出
+    te.id = AE_DELETED_EVENT_ID
+    eventLoop.timeEventDeleted += 1
+    if te.finalizerProc:
+        te.finalizerProc(eventLoop, te.clientData)
+    aeCompactTimeEvents(eventLoop)
+    return AE_OK
 
 def processTimeEvents(eventLoop: aeEventLoop) -> int:
     processed = 0
-    now = datetime.now()
-
-    # 防止系统时间修改导致事件混乱
-    if now < eventLoop.lastTime:
-        te = eventLoop.timeEventHead
-        while te:
-            te.when_sec = 0
-            te = te.next
-    eventLoop.lastTime = now
-
-    te = eventLoop.timeEventHead
+    heap = eventLoop.timeEventHeap
     maxId = eventLoop.timeEventNextId - 1
-    while te:
+    now = aeGetMonotonicMs()
+    # 重新调度的事件和本轮新建的事件在处理结束后才放回堆中,
+    # 保证每个事件在一次调用中最多只执行一次
+    pending = []
+    while heap and heap[0][0] <= now:
+        entry = heapq.heappop(heap)
+        te = entry[2]
+        if te.id == AE_DELETED_EVENT_ID:
+            eventLoop.timeEventDeleted -= 1
+            continue
         if te.id > maxId:
-            te = te.next
+            pending.append(entry)
             continue
-        now_sec, now_ms = aeGetTime()
-        if now_sec > te.when_sec or (now_sec == te.when_ms and now_ms >= te.when_ms):
-            ident = te.id
-            retval = te.timeProc(eventLoop, ident, te.clientData)
-            processed += 1
-            if retval != AE_NOMORE:
-                te.when_sec, te.when_ms = aeAddMillisecondsToNow(retval)
-            else:
-                aeDeleteTimeEvent(eventLoop, ident)
-            te = eventLoop.timeEventHead
+        ident = te.id
+        retval = te.timeProc(eventLoop, ident, te.clientData)
+        processed += 1
+        if te.id == AE_DELETED_EVENT_ID:
+            # 事件在处理器中删除了自己, 它已经不在堆中了
+            eventLoop.timeEventDeleted -= 1
+        elif retval != AE_NOMORE:
+            te.when = aeGetMonotonicMs() + retval
+            pending.append((te.when, ident, te))
         else:
-            te = te.next
+            del eventLoop.timeEvents[ident]
+            te.id = AE_DELETED_EVENT_ID
+            if te.finalizerProc:
+                te.finalizerProc(eventLoop, te.clientData)
+    for entry in pending:
+        heapq.heappush(heap, entry)
     return processed
 
 
+def aeProcessFileEvent(eventLoop: aeEventLoop, fd: int, mask: int) -> None:
+    """调用 fd 上已就绪的事件处理器, 由 aeProcessEvents 和外部驱动的后端共用"""
+    fe = eventLoop.events[fd]
+    rfired = 0
+    # 读事件处理器可能已经删除了这个 fd 的事件, 所以每次都要检查 fe.mask
+    if fe.mask & mask & AE_READABLE:
+        rfired = 1
+        fe.rfileProc(eventLoop, fd, fe.clientData, mask)
+    if fe.mask & mask & AE_WRITABLE:
+        if not rfired or (fe.wfileProc != fe.rfileProc):
+            fe.wfileProc(eventLoop, fd, fe.clientData, mask)
+
 def aeProcessEvents(eventLoop: aeEventLoop, flags: int):
     processed = 0
     numevents = 0
@@ -209,44 +236,42 @@ def aeProcessEvents(eventLoop: aeEventLoop, flags: int):
     if (not (flags & AE_TIME_EVENTS)) and (not (flags & AE_FILE_EVENTS)):
         return 0
 
-    tv = None
+    # 没有文件事件时, 只有需要阻塞等待时间事件才调用 poll
     if eventLoop.maxfd != -1 or ((flags & AE_TIME_EVENTS) and not(flags & AE_DONT_WAIT)):
+        tv: Opt[timeval] = None
         shortest = None
         if (flags & AE_TIME_EVENTS) and not(flags & AE_DONT_WAIT):
             shortest = aeSearchNearestTimer(eventLoop)
         if shortest:
-            now_sec, now_ms = aeGetTime()
             tv = timeval()
-            tv.tv_sec = shortest.when_sec - now_sec
-            if shortest.when_ms < now_ms:
-                tv.tv_usec = (shortest.when_ms + 1000 - now_ms) * 1000
-                tv.tv_sec -= 1
-            else:
-                tv.tv_usec = (shortest.when_ms - now_ms) * 1000
-            if tv.tv_sec < 0:
-                tv.tv_sec = 0
-            if tv.tv_usec < 0:
-                tv.tv_usec = 0
+            ms = shortest.when - aeGetMonotonicMs()
+            if ms > 0:
+                tv.tv_sec = ms // 1000
+                tv.tv_usec = (ms % 1000) * 1000
         else:
+            # 设置了 AE_DONT_WAIT 时立即返回, 否则一直阻塞直到有文件事件
             if flags & AE_DONT_WAIT:
-                assert tv
-                tv.tv_sec = tv.tv_usec = 0
+                tv = timeval()
             else:
                 tv = None
-    # Poll, 直到最近的时间时间发生, 如果没有时间事件, 则一直阻塞
-    numevents = aeApiPoll(eventLoop, tv)
-    for j in range(numevents):
-        fe = eventLoop.events[eventLoop.fired[j].fd]
-        mask = eventLoop.fired[j].mask
-        fd = eventLoop.fired[j].fd
-        rfired = 0
-        if fe.mask & mask & AE_READABLE:
-            rfired = 1
-            fe.rfileProc(eventLoop, fd, fe.clientData, mask)
-        if fe.mask & mask & AE_WRITABLE:
-            if not rfired or (fe.wfileProc != fe.rfileProc):
-                fe.wfileProc(eventLoop, fd, fe.clientData, mask)
-        processed += 1
+        if eventLoop.flags & AE_DONT_WAIT:
+            tv = timeval()
+        # Poll, 直到最近的时间时间发生, 如果没有时间事件, 则一直阻塞
+        poll_start = getMonotonicUs()
+        numevents = eventLoop.api.aeApiPoll(eventLoop, tv)
+        poll_end = getMonotonicUs()
+        # 两次 poll 之间的时间都在执行事件, 包括 beforesleep
+        if eventLoop.poll_end_us:
+            eventLoop.last_busy_us = poll_start - eventLoop.poll_end_us
+            eventLoop.busy_us += eventLoop.last_busy_us
+        eventLoop.poll_us += poll_end - poll_start
+        eventLoop.poll_end_us = poll_end
+        eventLoop.cycles += 1
+        if eventLoop.aftersleep:
+            eventLoop.aftersleep(eventLoop)
+        for fd, mask in eventLoop.fired:
+            aeProcessFileEvent(eventLoop, fd, mask)
+        processed += numevents
     if flags & AE_TIME_EVENTS:
         processed += processTimeEvents(eventLoop)
     return processed
@@ -294,12 +319,22 @@ def aeMain(eventLoop: aeEventLoop) -> None:
             eventLoop.beforesleep(eventLoop)
         aeProcessEvents(eventLoop, AE_ALL_EVENTS)
 
-def aeGetApiName() -> str:
-    return aeApiName()
+def aeGetApiName(eventLoop: aeEventLoop) -> str:
+    return eventLoop.api.aeApiName()
 
 def aeSetBeforeSleepProc(eventLoop: aeEventLoop, beforesleep: Callable[[aeEventLoop], None]) -> None:
     eventLoop.beforesleep = beforesleep
 
+def aeSetAfterSleepProc(eventLoop: aeEventLoop, aftersleep: Callable[[aeEventLoop], None]) -> None:
+    eventLoop.aftersleep = aftersleep
+
+def aeSetDontWait(eventLoop: aeEventLoop, noWait: int) -> None:
+    """noWait 为真时, 下一次 poll 不阻塞, 用于 beforesleep 中还有没做完的工作"""
+    if noWait:
+        eventLoop.flags |= AE_DONT_WAIT
+    else:
+        eventLoop.flags &= ~AE_DONT_WAIT
+
 def aeGetSetSize(eventLoop: aeEventLoop) -> int:
     return eventLoop.setsize
 
@@ -308,10 +343,9 @@ def aeResizeSetSize(eventLoop: aeEventLoop, setsize: int) -> int:
         return AE_OK
     if eventLoop.maxfd >= setsize:
         return AE_ERR
-    if aeApiResize(eventLoop, setsize) == -1:
+    if eventLoop.api.aeApiResize(eventLoop, setsize) == -1:
         return AE_ERR
     eventLoop.events = [aeFileEvent() for _ in range(setsize)]
-    eventLoop.fired = [aeFiredEvent() for _ in range(setsize)]
     eventLoop.setsize = setsize
     for i in range(eventLoop.maxfd+1, setsize):
         eventLoop.events[i].mask = AE_NONE
@@ -319,26 +353,24 @@ def aeResizeSetSize(eventLoop: aeEventLoop, setsize: int) -> int:
 
 ### private functions ###
 
-def aeAddMillisecondsToNow(milliseconds):
-    cur_sec, cur_ms = aeGetTime()
-    when_sec = cur_sec + milliseconds // 1000
-    when_ms = cur_ms + milliseconds % 1000
-    if when_ms >= 1000:
-        when_sec += 1
-        when_ms -= 1000
-    return when_sec, when_ms
-
-def aeGetTime() -> Tuple[int, int]:
-    now = datetime.now()
-    return int(now.timestamp()), now.microsecond // 1000
+def aeGetMonotonicMs() -> int:
+    return getMonotonicUs() // 1000
 
 def aeSearchNearestTimer(eventLoop: aeEventLoop) -> Opt[aeTimeEvent]:
-    te = eventLoop.timeEventHead
-    nearest = None
-    while te:
-        if not nearest or (te.when_sec < nearest.when_sec or
-            (te.when_sec == nearest.when_sec and te.when_ms < nearest.when_ms)):
-            nearest = te
-        te = te.next
-    return nearest
+    heap = eventLoop.timeEventHeap
+    while heap and heap[0][2].id == AE_DELETED_EVENT_ID:
+        heapq.heappop(heap)
+        eventLoop.timeEventDeleted -= 1
+    return heap[0][2] if heap else None
+
+def aeCompactTimeEvents(eventLoop: aeEventLoop) -> None:
+    """堆中已删除的事件超过一半时重建堆, 避免大量取消的定时器占用内存"""
+    heap = eventLoop.timeEventHeap
+    if eventLoop.timeEventDeleted < 64 or eventLoop.timeEventDeleted * 2 < len(heap):
+        return
+    size = len(heap)
+    heap[:] = [entry for entry in heap if entry[2].id != AE_DELETED_EVENT_ID]
+    heapq.heapify(heap)
+    # processTimeEvents 执行期间, 等待放回堆中的事件也可能被删除, 它们仍然要计数
+    eventLoop.timeEventDeleted -= size - len(heap)
 ### end private functions ###
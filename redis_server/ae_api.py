@@ -1,2 +1,29 @@
-from .ae_select import *
-# TODO(ruan.lj@foxmail.com): add epoll and poll support.
+import importlib
+from types import ModuleType
+from typing import List
+from .config import HAVE_EPOLL, HAVE_POLL
+
+# 可用的 I/O 多路复用后端, 按性能从高到低排列
+# 启动时默认选择第一个可用的后端, 也可以通过 ae-backend 配置项指定
+aeApiBackends: List[str] = []
+if HAVE_EPOLL:
+    aeApiBackends.append('epoll')
+if HAVE_POLL:
+    aeApiBackends.append('poll')
+aeApiBackends.append('select')
+
+# 由外部事件循环驱动的后端, 不参与自动选择, 也不能用 aeMain 运行
+# asyncio: 见 ae_asyncio.aeAsyncioMain
+aeApiHostedBackends: List[str] = ['asyncio']
+
+def aeApiLoad(name: str = '') -> ModuleType:
+    """按名字载入多路复用后端, name 为空时选择当前平台上最好的后端
+
+    每个后端模块都实现了相同的接口:
+    aeApiCreate/aeApiFree/aeApiAddEvent/aeApiDelEvent/aeApiPoll/aeApiName/aeApiResize
+    """
+    if not name:
+        name = aeApiBackends[0]
+    if name not in aeApiBackends and name not in aeApiHostedBackends:
+        raise ValueError('Unsupported multiplexing backend: %r' % name)
+    return importlib.import_module('.ae_' + name, __package__)
@@ -0,0 +1,145 @@
+import asyncio
+import typing
+from typing import Optional as Opt, Dict
+from .ae import (
+    AE_NONE, AE_READABLE, AE_WRITABLE, AE_DONT_WAIT, aeProcessFileEvent, processTimeEvents,
+    aeSearchNearestTimer, aeGetMonotonicMs,
+)
+
+if typing.TYPE_CHECKING:
+    from .ae import aeEventLoop
+    from .csix import timeval
+
+# 由 asyncio 事件循环驱动的后端
+# 文件事件通过 loop.add_reader/add_writer 注册, 由 asyncio 负责 poll.
+# 每一轮 asyncio 回调中, 第一个就绪的事件会调用 aftersleep, 并通过 call_soon
+# 安排一次 tick: 处理到期的时间事件, 调用 beforesleep, 然后重新设置最近的定时器.
+# 这样 beforesleep 每轮只执行一次, 和 aeMain 的行为一致.
+
+class aeApiState:
+    def __init__(self):
+        self.loop: asyncio.AbstractEventLoop = None
+        # fd -> 已注册到 asyncio 的事件 mask
+        self.masks: Dict[int, int] = {}
+        # 已经安排了 tick, 还没有执行
+        self.pending: bool = False
+        self.timer: Opt[asyncio.TimerHandle] = None
+        # aeStop 之后由 tick 设置结果, aeAsyncioMain 等待它
+        self.done: Opt[asyncio.Future] = None
+
+### public api ###
+
+def aeApiCreate(eventLoop: 'aeEventLoop') -> int:
+    state = aeApiState()
+    try:
+        state.loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # 只能在 asyncio 事件循环中创建
+        return -1
+    eventLoop.apidata = state
+    return 0
+
+def aeApiResize(eventLoop: 'aeEventLoop', setsize: int) -> int:
+    return 0
+
+def aeApiFree(eventLoop: 'aeEventLoop') -> None:
+    state: aeApiState = eventLoop.apidata
+    for fd, mask in state.masks.items():
+        if mask & AE_READABLE:
+            state.loop.remove_reader(fd)
+        if mask & AE_WRITABLE:
+            state.loop.remove_writer(fd)
+    state.masks.clear()
+    if state.timer:
+        state.timer.cancel()
+        state.timer = None
+
+def aeApiAddEvent(eventLoop: 'aeEventLoop', fd: int, mask: int) -> int:
+    state: aeApiState = eventLoop.apidata
+    oldmask = state.masks.get(fd, AE_NONE)
+    try:
+        if mask & AE_READABLE and not oldmask & AE_READABLE:
+            state.loop.add_reader(fd, _aeAsyncioFileEvent, eventLoop, fd, AE_READABLE)
+        if mask & AE_WRITABLE and not oldmask & AE_WRITABLE:
+            state.loop.add_writer(fd, _aeAsyncioFileEvent, eventLoop, fd, AE_WRITABLE)
+    except (OSError, ValueError):
+        return -1
+    state.masks[fd] = oldmask | mask
+    return 0
+
+def aeApiDelEvent(eventLoop: 'aeEventLoop', fd: int, delmask: int) -> None:
+    state: aeApiState = eventLoop.apidata
+    oldmask = state.masks.get(fd, AE_NONE)
+    if delmask & oldmask & AE_READABLE:
+        state.loop.remove_reader(fd)
+    if delmask & oldmask & AE_WRITABLE:
+        state.loop.remove_writer(fd)
+    mask = oldmask & (~delmask)
+    if mask != AE_NONE:
+        state.masks[fd] = mask
+    else:
+        state.masks.pop(fd, None)
+
+def aeApiPoll(eventLoop: 'aeEventLoop', tvp: Opt['timeval']) -> int:
+    raise RuntimeError('the asyncio backend is driven by aeAsyncioMain, not aeMain')
+
+def aeApiName() -> str:
+    return "asyncio"
+
+async def aeAsyncioMain(eventLoop: 'aeEventLoop') -> None:
+    """在当前 asyncio 事件循环中运行 eventLoop, 直到 aeStop 或者任务被取消"""
+    state: aeApiState = eventLoop.apidata
+    eventLoop.stop = 0
+    state.done = state.loop.create_future()
+    _aeAsyncioWakeUp(eventLoop)
+    try:
+        await state.done
+    finally:
+        if state.timer:
+            state.timer.cancel()
+            state.timer = None
+        state.done = None
+
+### private functions ###
+
+def _aeAsyncioWakeUp(eventLoop: 'aeEventLoop') -> None:
+    state: aeApiState = eventLoop.apidata
+    if state.pending:
+        return
+    state.pending = True
+    if eventLoop.aftersleep:
+        eventLoop.aftersleep(eventLoop)
+    state.loop.call_soon(_aeAsyncioTick, eventLoop)
+
+def _aeAsyncioFileEvent(eventLoop: 'aeEventLoop', fd: int, mask: int) -> None:
+    _aeAsyncioWakeUp(eventLoop)
+    aeProcessFileEvent(eventLoop, fd, mask)
+
+def _aeAsyncioTimer(eventLoop: 'aeEventLoop') -> None:
+    state: aeApiState = eventLoop.apidata
+    state.timer = None
+    _aeAsyncioWakeUp(eventLoop)
+
+def _aeAsyncioTick(eventLoop: 'aeEventLoop') -> None:
+    state: aeApiState = eventLoop.apidata
+    state.pending = False
+    processTimeEvents(eventLoop)
+    if eventLoop.stop:
+        if state.done and not state.done.done():
+            state.done.set_result(None)
+        return
+    if eventLoop.beforesleep:
+        eventLoop.beforesleep(eventLoop)
+    if state.timer:
+        state.timer.cancel()
+        state.timer = None
+    if eventLoop.flags & AE_DONT_WAIT:
+        # 还有没做完的工作, asyncio 处理完就绪的 I/O 之后马上再 tick 一次
+        _aeAsyncioWakeUp(eventLoop)
+        return
+    shortest = aeSearchNearestTimer(eventLoop)
+    if shortest:
+        delay = max(shortest.when - aeGetMonotonicMs(), 0) / 1000
+        state.timer = state.loop.call_later(delay, _aeAsyncioTimer, eventLoop)
+
+### end private functions ###
@@ -0,0 +1,97 @@
+import select
+import typing
+from typing import Optional as Opt, Dict
+from .ae import AE_NONE, AE_READABLE, AE_WRITABLE
+
+if typing.TYPE_CHECKING:
+    from .ae import aeEventLoop
+    from .csix import timeval
+
+class aeApiState:
+    def __init__(self):
+        self.epfd: select.epoll = None
+        # fd -> 已注册到 epoll 的事件 mask
+        self.masks: Dict[int, int] = {}
+
+### public api ###
+
+def aeApiCreate(eventLoop: 'aeEventLoop') -> int:
+    state = aeApiState()
+    try:
+        state.epfd = select.epoll(eventLoop.setsize)
+    except OSError:
+        return -1
+    eventLoop.apidata = state
+    return 0
+
+def aeApiResize(eventLoop: 'aeEventLoop', setsize: int) -> int:
+    return 0
+
+def aeApiFree(eventLoop: 'aeEventLoop') -> None:
+    state: aeApiState = eventLoop.apidata
+    state.epfd.close()
+    state.masks.clear()
+
+def aeApiAddEvent(eventLoop: 'aeEventLoop', fd: int, mask: int) -> int:
+    state: aeApiState = eventLoop.apidata
+    oldmask = state.masks.get(fd, AE_NONE)
+    mask |= oldmask
+    events = 0
+    if mask & AE_READABLE:
+        events |= select.EPOLLIN
+    if mask & AE_WRITABLE:
+        events |= select.EPOLLOUT
+    try:
+        # 如果 fd 没有关联任何事件, 那么这是一个 ADD 操作, 否则是一个 MOD 操作
+        if oldmask == AE_NONE:
+            state.epfd.register(fd, events)
+        else:
+            state.epfd.modify(fd, events)
+    except OSError:
+        return -1
+    state.masks[fd] = mask
+    return 0
+
+def aeApiDelEvent(eventLoop: 'aeEventLoop', fd: int, delmask: int) -> None:
+    state: aeApiState = eventLoop.apidata
+    oldmask = state.masks.get(fd, AE_NONE)
+    if oldmask == AE_NONE:
+        return
+    mask = oldmask & (~delmask)
+    try:
+        if mask != AE_NONE:
+            events = 0
+            if mask & AE_READABLE:
+                events |= select.EPOLLIN
+            if mask & AE_WRITABLE:
+                events |= select.EPOLLOUT
+            state.epfd.modify(fd, events)
+        else:
+            state.epfd.unregister(fd)
+    except OSError:
+        # fd 已经被关闭, 内核会自动把它从 epoll 中移除
+        pass
+    if mask != AE_NONE:
+        state.masks[fd] = mask
+    else:
+        del state.masks[fd]
+
+def aeApiPoll(eventLoop: 'aeEventLoop', tvp: Opt['timeval']) -> int:
+    state: aeApiState = eventLoop.apidata
+    timeout = -1 if tvp is None else tvp.tv_sec + tvp.tv_usec / 1000000
+    fired = eventLoop.fired
+    fired.clear()
+    for fd, events in state.epfd.poll(timeout):
+        mask = 0
+        if events & select.EPOLLIN:
+            mask |= AE_READABLE
+        if events & select.EPOLLOUT:
+            mask |= AE_WRITABLE
+        if events & (select.EPOLLERR|select.EPOLLHUP):
+            mask |= AE_READABLE|AE_WRITABLE
+        if mask:
+            fired.append((fd, mask))
+    return len(fired)
+
+def aeApiName() -> str:
+    return "epoll"
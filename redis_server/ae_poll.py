@@ -0,0 +1,81 @@
+import select
+import typing
+from typing import Optional as Opt, Dict
+from .ae import AE_NONE, AE_READABLE, AE_WRITABLE
+
+if typing.TYPE_CHECKING:
+    from .ae import aeEventLoop
+    from .csix import timeval
+
+class aeApiState:
+    def __init__(self):
+        self.pollfd: select.poll = None
+        # fd -> 已注册到 poll 的事件 mask
+        self.masks: Dict[int, int] = {}
+
+def _aeApiPollEvents(mask: int) -> int:
+    events = 0
+    if mask & AE_READABLE:
+        events |= select.POLLIN
+    if mask & AE_WRITABLE:
+        events |= select.POLLOUT
+    return events
+
+### public api ###
+
+def aeApiCreate(eventLoop: 'aeEventLoop') -> int:
+    state = aeApiState()
+    state.pollfd = select.poll()
+    eventLoop.apidata = state
+    return 0
+
+def aeApiResize(eventLoop: 'aeEventLoop', setsize: int) -> int:
+    return 0
+
+def aeApiFree(eventLoop: 'aeEventLoop') -> None:
+    state: aeApiState = eventLoop.apidata
+    state.masks.clear()
+
+def aeApiAddEvent(eventLoop: 'aeEventLoop', fd: int, mask: int) -> int:
+    state: aeApiState = eventLoop.apidata
+    mask |= state.masks.get(fd, AE_NONE)
+    try:
+        # 重复 register 同一个 fd 会修改它关联的事件
+        state.pollfd.register(fd, _aeApiPollEvents(mask))
+    except OSError:
+        return -1
+    state.masks[fd] = mask
+    return 0
+
+def aeApiDelEvent(eventLoop: 'aeEventLoop', fd: int, delmask: int) -> None:
+    state: aeApiState = eventLoop.apidata
+    oldmask = state.masks.get(fd, AE_NONE)
+    if oldmask == AE_NONE:
+        return
+    mask = oldmask & (~delmask)
+    if mask != AE_NONE:
+        state.pollfd.modify(fd, _aeApiPollEvents(mask))
+        state.masks[fd] = mask
+    else:
+        state.pollfd.unregister(fd)
+        del state.masks[fd]
+
+def aeApiPoll(eventLoop: 'aeEventLoop', tvp: Opt['timeval']) -> int:
+    state: aeApiState = eventLoop.apidata
+    timeout = None if tvp is None else tvp.tv_sec * 1000 + tvp.tv_usec / 1000
+    fired = eventLoop.fired
+    fired.clear()
+    for fd, events in state.pollfd.poll(timeout):
+        mask = 0
+        if events & select.POLLIN:
+            mask |= AE_READABLE
+        if events & select.POLLOUT:
+            mask |= AE_WRITABLE
+        if events & (select.POLLERR|select.POLLHUP|select.POLLNVAL):
+            mask |= AE_READABLE|AE_WRITABLE
+        if mask:
+            fired.append((fd, mask))
+    return len(fired)
+
+def aeApiName() -> str:
+    return "poll"
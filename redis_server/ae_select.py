@@ -12,7 +12,7 @@ import logging
 import select
 import typing
 import socket
-from typing import Optional as Opt, List, Union, Set
+from typing import Optional as Opt, Set
 
 logger = logging.getLogger(__name__)
 
@@ -56,31 +56,26 @@ def aeApiDelEvent(eventLoop: 'aeEventLoop', fd: int, mask: int) -> None:
         state.wfds.remove(fd)
 
 def aeApiPoll(eventLoop: 'aeEventLoop', tvp: Opt['timeval']) -> int:
-    from itertools import chain
-    from .ae import AE_READABLE, AE_WRITABLE, AE_NONE
+    from .ae import AE_READABLE, AE_WRITABLE
 
-    assert tvp
-    numevents = 0
     state: aeApiState = eventLoop.apidata
+    fired = eventLoop.fired
+    fired.clear()
 
-    timeout = tvp.time
+    timeout = None if tvp is None else tvp.tv_sec + tvp.tv_usec / 1000000
     _rfds, _wfds, _ = select.select(state.rfds, state.wfds, [], timeout)
-    _rfds_set = set(_rfds)
+    # 只处理 select 返回的就绪 fd, 不再遍历 0 到 maxfd 的所有 fd
     _wfds_set = set(_wfds)
-    fd = 0
-    for fd in range(eventLoop.maxfd+1):
-        mask = 0
-        fe = eventLoop.events[fd]
-        if fe.mask == AE_NONE:
-            continue
-        if (fe.mask & AE_READABLE) and fd in _rfds_set:
-            mask |= AE_READABLE
-        if (fe.mask & AE_WRITABLE) and fd in _wfds_set:
-            mask |= AE_WRITABLE
-        eventLoop.fired[numevents].fd = fd
-        eventLoop.fired[numevents].mask = mask
-        numevents += 1
-    return numevents
+    for fd in _rfds:
+        if fd in _wfds_set:
+            fired.append((fd, AE_READABLE|AE_WRITABLE))
+            _wfds_set.discard(fd)
+        else:
+            fired.append((fd, AE_READABLE))
+    for fd in _wfds:
+        if fd in _wfds_set:
+            fired.append((fd, AE_WRITABLE))
+    return len(fired)
 
 
 def aeApiName() -> str:
@@ -3,7 +3,6 @@ import sys
 import socket
 from typing import NewType, Tuple, Optional as Opt, Union
 from .csix import *
-from .util import SocketCache
 
 Address = Tuple[str, int]
 
@@ -30,6 +29,14 @@ def anetSetReuseAddr(fd: socket.socket) -> None:
         fd.close()
         raise
 
+# 允许多个进程监听同一个端口, 由内核分配连接
+def anetSetReusePort(fd: socket.socket) -> None:
+    try:
+        fd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    except OSError:
+        fd.close()
+        raise
+
 def anetNonBlock(fd: socket.socket) -> None:
     try:
         fd.setblocking(False)
@@ -54,7 +61,6 @@ def anetTcpGenericConnect(addr: str, port: int, source_addr: Opt[str], flags: in
         except OSError:
             continue
         anetSetReuseAddr(s)
-        SocketCache.set(s)
         if flags & ANET_CONNECT_NONBLOCK:
             anetNonBlock(s)
         if source_addr:
@@ -92,7 +98,6 @@ def anetUnixGenericConnect(path: str, flags: int) -> socket.socket:
     if flags & ANET_CONNECT_NONBLOCK:
         anetNonBlock(s)
     s.connect(path)
-    SocketCache.set(s)
     return s
 
 def anetUnixConnect(path: str, flags: int) -> socket.socket:
@@ -127,20 +132,21 @@ def anetResolveIP(host: str) -> str:
 
 def anetV6Only(s: socket.socket) -> None:
     try:
-        s.setsockopt(socket.SOL_SOCKET, socket.IPPROTO_IPV6, 1)
+        s.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
     except OSError:
         s.close()
         raise
 
 def anetListen(s: socket.socket, host: str, port: Opt[int], backlog: int) -> None:
     try:
-        s.bind((host, port))
+        # unix socket 只需要路径
+        s.bind(host if port is None else (host, port))
         s.listen(backlog)
     except OSError:
         s.close()
         raise
 
-def _anetTcpServer(port: int, bindaddr: Opt[str], af: int, backlog: int) -> socket.socket:
+def _anetTcpServer(port: int, bindaddr: Opt[str], af: int, backlog: int, reuseport: int = 0) -> socket.socket:
     serverinfo = socket.getaddrinfo(bindaddr, port, af, socket.SOCK_STREAM, flags=socket.AI_PASSIVE)
     s = None
     for (family, type_, proto, _, sockaddr) in serverinfo:
@@ -151,23 +157,23 @@ def _anetTcpServer(port: int, bindaddr: Opt[str], af: int, backlog: int) -> sock
         if af == socket.AF_INET6:
             anetV6Only(s)
         anetSetReuseAddr(s)
+        if reuseport:
+            anetSetReusePort(s)
         anetListen(s, sockaddr[0], sockaddr[1], backlog)
-        SocketCache.set(s)
     if not s:
         raise AnetErr('start tcp server fail')
     return s
 
-def anetTcpServer(port: int, bindaddr: Opt[str], backlog: int) -> socket.socket:
-    return _anetTcpServer(port, bindaddr, socket.AF_INET, backlog)
+def anetTcpServer(port: int, bindaddr: Opt[str], backlog: int, reuseport: int = 0) -> socket.socket:
+    return _anetTcpServer(port, bindaddr, socket.AF_INET, backlog, reuseport)
 
-def anetTcp6Server(port: int, bindaddr: Opt[str], backlog: int) -> socket.socket:
-    return _anetTcpServer(port, bindaddr, socket.AF_INET6, backlog)
+def anetTcp6Server(port: int, bindaddr: Opt[str], backlog: int, reuseport: int = 0) -> socket.socket:
+    return _anetTcpServer(port, bindaddr, socket.AF_INET6, backlog, reuseport)
 
 def anetCreateSocket(domain: int) -> socket.socket:
     try:
         s = socket.socket(domain, socket.SOCK_STREAM)
         anetSetReuseAddr(s)
-        SocketCache.set(s)
         return s
     except OSError:
         s.close()
@@ -182,12 +188,10 @@ def anetUnixServer(path: str, perm: int, backlog: int) -> socket.socket:
 
 def anetTcpAccept(serversock: socket.socket) -> Tuple[socket.socket, Address]:
     sock, addr = serversock.accept()
-    SocketCache.set(sock)
     return sock, addr
 
 def anetUnixAccept(serversock: socket.socket) -> Tuple[socket.socket, str]:
     sock, addr = serversock.accept()
-    SocketCache.set(sock)
     return sock, addr
 
 def anetWrite(fd: socket.socket, buf: cstr) -> None:
@@ -0,0 +1,18 @@
+import time
+
+# 时钟服务
+# 热路径上不直接读取时间: 事件循环每次从 poll 返回时调用 updateCachedTime(server),
+# 把当前时间缓存在 server.unixtime / server.mstime / server.ustime 中.
+# 需要精确计时的地方(定时器, 命令耗时)使用单调时钟, 不受系统时间修改的影响.
+
+def ustime() -> int:
+    """UNIX 时间, 微秒"""
+    return time.time_ns() // 1000
+
+def mstime() -> int:
+    """UNIX 时间, 毫秒"""
+    return time.time_ns() // 1000000
+
+def getMonotonicUs() -> int:
+    """单调时钟, 微秒, 只能用来计算时间差"""
+    return time.monotonic_ns() // 1000
@@ -0,0 +1,217 @@
+import os
+import platform
+import typing
+from fnmatch import fnmatchcase
+from typing import List, Tuple
+from ..ae import aeGetApiName
+from ..adlist import listFirst, listNextNode, listNodeValue, listLength
+from ..config import REDIS_OK, REDIS_AOF_OFF, REDIS_SHARD_CLIENT
+from ..rdict import dictSize
+from ..robject import getLongLongFromObject
+from ..sds import sdslen
+from ..util import get_server, get_shared, zmalloc_used_memory, zmalloc_get_rss
+from ..histogram import hdrValueAtPercentile
+from ..networking import (
+    addReply, addReplyError, addReplyErrorObject, addReplyMultiBulkLen, addReplyBulkCString, addReplyBulkCBuffer,
+)
+
+if typing.TYPE_CHECKING:
+    from ..redis import RedisClient, RedisServer
+
+__all__ = [
+    'configCommand',
+    'genRedisInfoString',
+    'infoCommand',
+]
+
+# INFO latencystats 报告的百分位数
+INFO_LATENCY_PERCENTILES = (50.0, 99.0, 99.9)
+
+# 可以在运行时通过 CONFIG GET/SET 读写的整数参数: 参数名 -> (RedisServer 的属性, 最小值)
+configIntParams = {
+    'slowlog-log-slower-than': ('slowlog_log_slower_than', None),
+    'slowlog-max-len': ('slowlog_max_len', 0),
+    'latency-monitor-threshold': ('latency_monitor_threshold', 0),
+}
+
+
+def configGetCommand(c: 'RedisClient') -> None:
+    server = get_server()
+    pattern = c.argv[2].ptr.text.lower()
+    matches = [name for name in configIntParams if fnmatchcase(name, pattern)]
+    addReplyMultiBulkLen(c, 2*len(matches))
+    for name in matches:
+        addReplyBulkCString(c, name)
+        addReplyBulkCString(c, str(getattr(server, configIntParams[name][0])))
+
+def configSetCommand(c: 'RedisClient') -> None:
+    server = get_server()
+    name = c.argv[2].ptr.text.lower()
+    if name not in configIntParams:
+        addReplyError(c, "Unsupported CONFIG parameter: %s" % name)
+        return
+    attr, minimum = configIntParams[name]
+    status, value = getLongLongFromObject(c.argv[3])
+    if status != REDIS_OK or (minimum is not None and value < minimum):
+        addReplyError(c, "Invalid argument '%s' for CONFIG SET '%s'" % (c.argv[3].ptr.text, name))
+        return
+    setattr(server, attr, value)
+    # 每个 worker 是独立的进程, 其他 worker 也要修改. 从其他 worker 转发来的命令不再广播
+    if server.workers_num > 1 and not c.flags & REDIS_SHARD_CLIENT:
+        from ..shard import shardBroadcastCommand
+        failed = shardBroadcastCommand(c)
+        if failed:
+            addReplyError(c, "CONFIG SET not applied on unavailable workers: %s" % ", ".join(map(str, failed)))
+            return
+    addReply(c, get_shared().ok)
+
+def configCommand(c: 'RedisClient') -> None:
+    """CONFIG GET parameter / CONFIG SET parameter value"""
+    sub = c.argv[1].ptr
+    if c.argc == 3 and sub.lowereq('get'):
+        configGetCommand(c)
+    elif c.argc == 4 and sub.lowereq('set'):
+        configSetCommand(c)
+    else:
+        addReplyError(c, "CONFIG subcommand must be one of GET, SET")
+
+def bytesToHuman(n: int) -> str:
+    """把字节数转换成 1.50M 这样便于阅读的形式"""
+    for unit, size in (('G', 1 << 30), ('M', 1 << 20), ('K', 1 << 10)):
+        if n >= size:
+            return "%.2f%s" % (n / size, unit)
+    return "%dB" % n
+
+def getClientsMaxBuffers(server: 'RedisServer') -> Tuple[int, int]:
+    """所有客户端中最长的回复链表和最大的查询缓冲区"""
+    lol = bib = 0
+    ln = listFirst(server.clients)
+    while ln:
+        c = listNodeValue(ln)
+        ln = listNextNode(ln)
+        lol = max(lol, listLength(c.reply))
+        if c.querybuf is not None:
+            bib = max(bib, sdslen(c.querybuf))
+    return lol, bib
+
+def genRedisInfoString(section: str) -> str:
+    """生成 INFO 命令的回复
+
+    section 为 default 时包括除 commandstats 和 latencystats 以外的部分, 为 all 时包括所有部分.
+    """
+    from ..redis import __version__, getOperationsPerSecond
+    server = get_server()
+    allsections = section == 'all'
+    defsections = section == 'default'
+    lines: List[str] = []
+
+    def addSection(name: str, default: bool = True) -> bool:
+        if not (allsections or section == name or (defsections and default)):
+            return False
+        if lines:
+            lines.append("")
+        lines.append("# " + name.capitalize())
+        return True
+
+    if addSection('server'):
+        uptime = server.unixtime - server.stat_starttime
+        lines += [
+            "redis_version:%s" % __version__,
+            "redis_mode:standalone",
+            "os:%s %s %s" % (platform.system(), platform.release(), platform.machine()),
+            "arch_bits:%d" % server.arch_bits,
+            "multiplexing_api:%s" % aeGetApiName(server.el),
+            "python_version:%s" % platform.python_version(),
+            "process_id:%d" % os.getpid(),
+            "run_id:%s" % server.runid,
+            "tcp_port:%d" % server.port,
+            "uptime_in_seconds:%d" % uptime,
+            "uptime_in_days:%d" % (uptime // 86400),
+            "hz:%d" % server.hz,
+            "lru_clock:%d" % server.lruclock,
+            "config_file:%s" % server.configfile,
+            "io_threads:%d" % server.io_threads_num,
+            "worker_id:%d" % server.worker_id,
+            "workers:%d" % server.workers_num,
+        ]
+    if addSection('clients'):
+        lol, bib = getClientsMaxBuffers(server)
+        lines += [
+            "connected_clients:%d" % (listLength(server.clients) - len(server.slaves)),
+            "client_longest_output_list:%d" % lol,
+            "client_biggest_input_buf:%d" % bib,
+            "blocked_clients:%d" % server.bpop_blocked_clients,
+            "paused_reading_clients:%d" % server.paused_reading_clients,
+        ]
+    if addSection('memory'):
+        used = zmalloc_used_memory()
+        lines += [
+            "used_memory:%d" % used,
+            "used_memory_human:%s" % bytesToHuman(used),
+            "used_memory_rss:%d" % zmalloc_get_rss(),
+            "used_memory_peak:%d" % server.stat_peak_memory,
+            "used_memory_peak_human:%s" % bytesToHuman(server.stat_peak_memory),
+            "resp_cache_memory:%d" % server.resp_cache_memory,
+            "maxmemory:%d" % server.maxmemory,
+            "maxmemory_human:%s" % bytesToHuman(server.maxmemory),
+            "mem_allocator:pymalloc",
+        ]
+    if addSection('persistence'):
+        lines += [
+            "loading:%d" % server.loading,
+            "rdb_changes_since_last_save:%d" % server.dirty,
+            "rdb_bgsave_in_progress:%d" % (server.rdb_child_pid != -1),
+            "rdb_last_save_time:%d" % server.lastsave,
+            "rdb_last_bgsave_status:%s" % ("ok" if server.lastbgsave_status == REDIS_OK else "err"),
+            "aof_enabled:%d" % (server.aof_state != REDIS_AOF_OFF),
+            "aof_rewrite_in_progress:%d" % (server.aof_child_pid != -1),
+            "aof_last_write_status:%s" % ("ok" if server.aof_last_write_status == REDIS_OK else "err"),
+        ]
+    if addSection('stats'):
+        lines += [
+            "total_connections_received:%d" % server.stat_numconnections,
+            "total_commands_processed:%d" % server.stat_numcommands,
+            "instantaneous_ops_per_sec:%d" % getOperationsPerSecond(server),
+            "rejected_connections:%d" % server.stat_rejected_conn,
+            "expired_keys:%d" % server.stat_expiredkeys,
+            "evicted_keys:%d" % server.stat_evictedkeys,
+            "keyspace_hits:%d" % server.stat_keyspace_hits,
+            "keyspace_misses:%d" % server.stat_keyspace_misses,
+            "total_error_replies:%d" % server.stat_total_error_replies,
+            "resp_cache_hits:%d" % server.stat_resp_cache_hits,
+            "client_obuf_limit_disconnections:%d" % server.stat_client_obuf_limit_disconnections,
+            "client_budget_deferrals:%d" % server.stat_client_budget_deferrals,
+            "eventloop_cycles:%d" % server.el.cycles,
+            "eventloop_duration_sum:%d" % server.el.busy_us,
+            "eventloop_poll_duration_sum:%d" % server.el.poll_us,
+        ]
+    if addSection('commandstats', False):
+        for cmd in server.commands.values():
+            if not cmd.calls and not cmd.rejected_calls:
+                continue
+            lines.append("cmdstat_%s:calls=%d,usec=%d,usec_per_call=%.2f,rejected_calls=%d,failed_calls=%d" % (
+                cmd.name, cmd.calls, cmd.microseconds, cmd.microseconds / cmd.calls if cmd.calls else 0,
+                cmd.rejected_calls, cmd.failed_calls))
+    if addSection('latencystats', False):
+        for cmd in server.commands.values():
+            if not cmd.latency_histogram:
+                continue
+            lines.append("latency_percentiles_usec_%s:%s" % (cmd.name, ",".join(
+                "p%s=%.3f" % ("%g" % p, hdrValueAtPercentile(cmd.latency_histogram, p))
+                for p in INFO_LATENCY_PERCENTILES)))
+    if addSection('keyspace'):
+        for db in server.db:
+            keys = dictSize(db.dict)
+            if keys:
+                lines.append("db%d:keys=%d,expires=%d,avg_ttl=%d" % (
+                    db.id, keys, dictSize(db.expires), db.avg_ttl))
+    return "".join(line + "\r\n" for line in lines)
+
+def infoCommand(c: 'RedisClient') -> None:
+    """INFO [section]"""
+    if c.argc > 2:
+        addReplyErrorObject(c, get_shared().syntaxerr)
+        return
+    section = c.argv[1].ptr.text.lower() if c.argc == 2 else 'default'
+    info = genRedisInfoString(section).encode()
+    addReplyBulkCBuffer(c, info, len(info))
@@ -1,6 +1,11 @@
 from typing import List, Callable, Optional as Opt, Tuple, BinaryIO, Dict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from .options import *
 from .string import *
+from .admin import *
+from ..slowlog import slowlogCommand
+from ..latency import latencyCommand
+from ..histogram import hdrHistogram
 
 # __all__ = [
 # ]
@@ -28,6 +33,16 @@ class redisCommand(object):
     # calls 是命令被执行的总次数
     microseconds: int = 0
     calls: int = 0
+    # 命令的选项, 从第 optstart 个参数开始, 用 parseCommandOptions 解析
+    options: Opt[List[redisCommandOption]] = None
+    optstart: int = 0
+    # compileCommandOptions 根据 options 生成的查找表
+    opttable: Dict[bytes, redisCommandOption] = field(default_factory=dict)
+    # 执行前被拒绝的次数 (参数个数错误、未认证等) 和执行时回复了错误的次数
+    rejected_calls: int = 0
+    failed_calls: int = 0
+    # 命令执行时间的直方图, 第一次执行时创建
+    latency_histogram: Opt[hdrHistogram] = None
 
 
 def authCommand():
@@ -46,8 +61,8 @@ def watchCommand():
     pass
 
 redisCommandTable = [
-    redisCommand("get", getCommand, 2, "r", 0, None, 1, 1, 1, 0, 0),
-    redisCommand("set", setCommand, -3, "wm", 0, None, 1, 1, 1, 0, 0),
+    redisCommand("get", getCommand, 2, "rF", 0, None, 1, 1, 1, 0, 0),
+    redisCommand("set", setCommand, -3, "wm", 0, None, 1, 1, 1, 0, 0, setCommandOptions, 3),
     # redisCommand("setnx", setnxCommand, 3, "wm", 0, None, 1, 1, 1, 0, 0),
     # redisCommand("setex", setexCommand, 4, "wm", 0, None, 1, 1, 1, 0, 0),
     # redisCommand("psetex", psetexCommand, 4, "wm", 0, None, 1, 1, 1, 0, 0),
@@ -166,14 +181,14 @@ redisCommandTable = [
     # redisCommand("flushdb", flushdbCommand, 1, "w", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("flushall", flushallCommand, 1, "w", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("sort", sortCommand, -2, "wm", 0, sortGetKeys, 1, 1, 1, 0, 0),
-    # redisCommand("info", infoCommand, -1, "rlt", 0, None, 0, 0, 0, 0, 0),
+    redisCommand("info", infoCommand, -1, "rlt", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("monitor", monitorCommand, 1, "ars", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("ttl", ttlCommand, 2, "r", 0, None, 1, 1, 1, 0, 0),
     # redisCommand("pttl", pttlCommand, 2, "r", 0, None, 1, 1, 1, 0, 0), Ï
     # redisCommand("persist", persistCommand, 2, "w", 0, None, 1, 1, 1, 0, 0),
     # redisCommand("slaveof", slaveofCommand, 3, "ast", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("debug", debugCommand, -2, "as", 0, None, 0, 0, 0, 0, 0),
-    # redisCommand("config", configCommand, -2, "art", 0, None, 0, 0, 0, 0, 0),
+    redisCommand("config", configCommand, -2, "art", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("subscribe", subscribeCommand, -2, "rpslt", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("unsubscribe", unsubscribeCommand, -1, "rpslt", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("psubscribe", psubscribeCommand, -2, "rpslt", 0, None, 0, 0, 0, 0, 0),
@@ -194,7 +209,7 @@ redisCommandTable = [
     # redisCommand("client", clientCommand, -2, "ar", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("eval", evalCommand, -3, "s", 0, evalGetKeys, 0, 0, 0, 0, 0),
     # redisCommand("evalsha", evalShaCommand, -3, "s", 0, evalGetKeys, 0, 0, 0, 0, 0),
-    # redisCommand("slowlog", slowlogCommand, -2, "r", 0, None, 0, 0, 0, 0, 0),
+    redisCommand("slowlog", slowlogCommand, -2, "r", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("script", scriptCommand, -2, "ras", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("time", timeCommand, 1, "rR", 0, None, 0, 0, 0, 0, 0),
     # redisCommand("bitop", bitopCommand, -4, "wm", 0, None, 2, -1, 1, 0, 0),
@@ -206,4 +221,5 @@ redisCommandTable = [
     # redisCommand("pfcount", pfcountCommand, -2, "w", 0, None, 1, 1, 1, 0, 0),
     # redisCommand("pfmerge", pfmergeCommand, -2, "wm", 0, None, 1, -1, 1, 0, 0),
     # redisCommand("pfdebug", pfdebugCommand, -3, "w", 0, None, 0, 0, 0, 0, 0),
+    redisCommand("latency", latencyCommand, -2, "arslt", 0, None, 0, 0, 0, 0, 0),
 ]
@@ -0,0 +1,66 @@
+import typing
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional as Opt
+from ..robject import robj
+from ..util import get_shared
+from ..networking import addReplyErrorObject
+
+if typing.TYPE_CHECKING:
+    from ..redis import RedisClient
+    from .core import redisCommand
+
+__all__ = [
+    'redisCommandOption',
+    'compileCommandOptions',
+    'parseCommandOptions',
+]
+
+
+@dataclass
+class redisCommandOption(object):
+    # 选项名字, 不区分大小写
+    name: str = ''
+    # 选项出现时设置的 FLAG
+    flag: int = 0
+    # 选项后面是否跟着一个参数
+    arg: int = 0
+    # 不能和这个选项同时出现的 FLAG
+    conflicts: int = 0
+
+
+def compileCommandOptions(cmd: 'redisCommand') -> None:
+    """把 cmd.options 编译成以参数原始字节为键的表, 全小写和全大写的写法直接命中"""
+    cmd.opttable = {}
+    for opt in cmd.options or ():
+        name = opt.name.encode('utf8')
+        cmd.opttable[name.lower()] = opt
+        cmd.opttable[name.upper()] = opt
+
+def parseCommandOptions(c: 'RedisClient') -> Opt[Tuple[int, Dict[int, robj]]]:
+    """按照 c.cmd 的选项表一次解析完 c.argv[c.cmd.optstart:]
+
+    返回设置的 FLAG 和带参数的选项的参数 (以选项的 FLAG 为键), 语法错误时回复客户端并返回 None.
+    """
+    cmd = c.cmd
+    assert cmd
+    table = cmd.opttable
+    argv = c.argv
+    argc = len(argv)
+    flags = 0
+    args: Dict[int, robj] = {}
+    j = cmd.optstart
+    while j < argc:
+        a = argv[j].ptr
+        name = bytes(a.buf[:a.len])
+        opt = table.get(name)
+        if opt is None:
+            opt = table.get(name.lower())
+        if opt is None or flags & opt.conflicts or (opt.arg and j == argc-1):
+            addReplyErrorObject(c, get_shared().syntaxerr)
+            return None
+        flags |= opt.flag
+        if opt.arg:
+            j += 1
+            args[opt.flag] = argv[j]
+        j += 1
+    return flags, args
@@ -7,19 +7,30 @@ from ..db import lookupKeyReadOrReply, lookupKeyWrite, setKey, notifyKeyspaceEve
 from ..util import get_shared, get_server
 from ..config import *
 from ..robject import *
-from ..networking import addReply, addReplyBulk
-from ..csix import timeval
+from ..networking import addReply, addReplyBulk, addReplyErrorObject
+from .options import redisCommandOption, parseCommandOptions
 
 __all__ = [
     'getGenericCommand',
     'getCommand',
     'setGenericCommand',
     'setCommand',
+    'setCommandOptions',
 ]
 
 REDIS_SET_NO_FLAGS = 0
 REDIS_SET_NX = (1<<0)   #  /* Set if key not exists. */
 REDIS_SET_XX = (1<<1)   #  /* Set if key exists. */
+REDIS_SET_EX = (1<<2)   #  /* Set if time in seconds is given */
+REDIS_SET_PX = (1<<3)   #  /* Set if time in ms in given */
+
+# SET key value [NX|XX] [EX seconds|PX milliseconds]
+setCommandOptions = [
+    redisCommandOption('nx', REDIS_SET_NX, 0, REDIS_SET_XX),
+    redisCommandOption('xx', REDIS_SET_XX, 0, REDIS_SET_NX),
+    redisCommandOption('ex', REDIS_SET_EX, 1, REDIS_SET_PX),
+    redisCommandOption('px', REDIS_SET_PX, 1, REDIS_SET_EX),
+]
 
 
 def getGenericCommand(c: 'RedisClient') -> int:
@@ -29,7 +40,7 @@ def getGenericCommand(c: 'RedisClient') -> int:
         return REDIS_OK
     assert o
     if o.type != REDIS_STRING:
-        addReply(c, shared.wrongtypeerr)
+        addReplyErrorObject(c, shared.wrongtypeerr)
         return REDIS_ERR
     else:
         addReplyBulk(c, o)
@@ -61,7 +72,7 @@ def setGenericCommand(c: 'RedisClient', flags: int, key: robj, val: robj, expire
     server = get_server()
     server.dirty += 1
     if expire:
-        setExpire(c.db, key, timeval.from_datetime().mstime + milliseconds)
+        setExpire(c.db, key, server.mstime + milliseconds)
     notifyKeyspaceEvent(REDIS_NOTIFY_STRING, 'set', key, c.db.id)
     if expire:
         notifyKeyspaceEvent(REDIS_NOTIFY_GENERIC, 'set', key, c.db.id)
@@ -70,28 +81,15 @@ def setGenericCommand(c: 'RedisClient', flags: int, key: robj, val: robj, expire
 
 def setCommand(c: 'RedisClient'):
     unit = UNIT_SECONDS
-    flags = REDIS_SET_NO_FLAGS
     expire = None
-    j = 3
-    shared = get_shared()
-    while j < c.argc:
-        a = c.argv[j].ptr
-        ne = None if j == c.argc-1 else c.argv[j+1]
-        if a.buf.lower() == b'nx\0':
-            flags |= REDIS_SET_NX
-        elif a.buf.lower() == b'xx\0':
-            flags |= REDIS_SET_XX
-        elif a.buf.lower() == b'ex\0':
-            unit = UNIT_SECONDS
-            expire = ne
-            j += 1
-        elif a.buf.lower() == b'px\0':
-            unit = UNIT_MILLISECONDS
-            expire = ne
-            j += 1
-        else:
-            addReply(c, shared.syntaxerr)
-            return
-        j += 1
+    parsed = parseCommandOptions(c)
+    if parsed is None:
+        return
+    flags, args = parsed
+    if flags & REDIS_SET_EX:
+        expire = args[REDIS_SET_EX]
+    elif flags & REDIS_SET_PX:
+        unit = UNIT_MILLISECONDS
+        expire = args[REDIS_SET_PX]
     c.argv[2] = tryObjectEncoding(c.argv[2])
     setGenericCommand(c, flags, c.argv[1], c.argv[2], expire, unit, None, None)
@@ -1,5 +1,6 @@
 import os
 import sys
+import select as _select
 
 redis_fstat = os.fstat
 redis_stat = os.stat
@@ -18,12 +19,10 @@ if sys.platform == 'darwin':
 if sys.platform in ('darwin', 'linux'):
     HAVE_BACKTRACE = 1
 
-# TODO(ruan.lj@foxmail.com): only support select now.
-# # /* Test for polling API */
-# if sys.platform == 'linux':
-#     HAVE_EPOLL = 1
-# if sys.platform == 'darwin' or 'bsd' in sys.platform:
-#     HAVE_KQUEUE = 1
+# /* Test for polling API */
+# NOTE: macOS 上的 poll() 有缺陷, 不使用
+HAVE_EPOLL = int(hasattr(_select, 'epoll'))
+HAVE_POLL = int(hasattr(_select, 'poll') and sys.platform != 'darwin')
 
 
 # /* Define aof_fsync to fdatasync() in Linux and fsync() for all the rest */
@@ -123,9 +122,11 @@ REDIS_NOTIFY_ALL = (REDIS_NOTIFY_GENERIC | REDIS_NOTIFY_STRING | REDIS_NOTIFY_LI
 REDIS_MAX_QUERYBUF_LEN =  (1024*1024*1024)  # /* 1GB max query buffer. */
 REDIS_IOBUF_LEN =         (1024*16)     # /* Generic I/O buffer size */
 REDIS_REPLY_CHUNK_BYTES = (16*1024)     # /* 16k output buffer */
+REDIS_REPLY_ZEROCOPY_BYTES = (4*1024)   # 不小于这个长度的值不复制到回复缓冲区
 REDIS_INLINE_MAX_SIZE =   (1024*64)     # /* Max size of inline reads */
 REDIS_MBULK_BIG_ARG =     (1024*32)
 REDIS_LONGSTR_SIZE =      21            # /* Bytes needed for long -> str */
+REDIS_COMMAND_LOOKUP_CACHE_SIZE = 1024  # 命令名各种大小写写法的缓存上限
 
 # /* Slave replication state - from the point of view of the slave. */
 REDIS_REPL_NONE = 0     # /* No active replication */
@@ -140,6 +141,7 @@ REDIS_REPL_CONNECTED = 5    # /* Connected to master */
 REDIS_BLOCKED_NONE = 0   # /* Not blocked, no REDIS_BLOCKED flag set. */
 REDIS_BLOCKED_LIST = 1   # /* BLPOP & co. */
 REDIS_BLOCKED_WAIT = 2   # /* WAIT for synchronous replication. */
+REDIS_BLOCKED_SHARD = 3  # /* Waiting for the worker owning the keys. */
 
 # /* Client request types */
 REDIS_REQ_INLINE = 1
@@ -164,6 +166,11 @@ REDIS_FORCE_AOF = (1<<14)   #  /* Force AOF propagation of current cmd. */
 REDIS_FORCE_REPL = (1<<15)  # /* Force replication of current cmd. */
 REDIS_PRE_PSYNC = (1<<16)   #  /* Instance don't understand PSYNC. */
 REDIS_READONLY = (1<<17)    #   /* Cluster client is in read-only state. */
+REDIS_PENDING_READ = (1<<18)    # /* The client has pending reads and was put in the list of clients we can read from. */
+REDIS_PENDING_WRITE = (1<<19)   # /* Client has output to send but a write handler is yet not installed. */
+REDIS_PENDING_COMMAND = (1<<20)     # 用完了这一轮的命令配额, 剩下的命令在 clients_pending_commands 中排队
+REDIS_READ_PAUSED = (1<<21)     # 回复积压太多, 暂停读取客户端的命令
+REDIS_SHARD_CLIENT = (1<<22)    # 另一个 worker 用来转发命令的连接
 
 # /* Log levels */
 REDIS_DEBUG = 0
@@ -193,6 +200,7 @@ REDIS_CMD_LOADING = 512         # /* "l" flag */
 REDIS_CMD_STALE = 1024          # /* "t" flag */
 REDIS_CMD_SKIP_MONITOR = 2048       # /* "M" flag */
 REDIS_CMD_ASKING = 4096         # /* "k" flag */
+REDIS_CMD_FAST = 8192           # /* "F" flag */
 
 # /* Command call flags, see call() function */
 REDIS_CALL_NONE = 0
@@ -217,6 +225,8 @@ class ServerConfig:
     REDIS_CONFIGLINE_MAX =    1024
     REDIS_DBCRON_DBS_PER_CALL = 16
     REDIS_MAX_WRITE_PER_EVENT = (1024*64)
+    REDIS_IO_THREADS_MAX_NUM = 128
+    REDIS_WORKERS_MAX_NUM = 1024
     REDIS_SHARED_SELECT_CMDS = 10
     REDIS_SHARED_INTEGERS = 10000
     REDIS_SHARED_BULKHDR_LEN = 32
@@ -226,6 +236,7 @@ class ServerConfig:
     REDIS_AOF_REWRITE_ITEMS_PER_CMD = 64
     REDIS_SLOWLOG_LOG_SLOWER_THAN = 10000
     REDIS_SLOWLOG_MAX_LEN = 128
+    REDIS_DEFAULT_LATENCY_MONITOR_THRESHOLD = 0
     REDIS_MAX_CLIENTS = 10000
     REDIS_AUTHPASS_MAX_LEN = 512
     REDIS_DEFAULT_SLAVE_PRIORITY = 100
@@ -254,6 +265,10 @@ class ServerConfig:
     REDIS_DEFAULT_REPL_DISABLE_TCP_NODELAY = 0
     REDIS_DEFAULT_MAXMEMORY = 0
     REDIS_DEFAULT_MAXMEMORY_SAMPLES = 5
+    REDIS_DEFAULT_RESP_CACHE_MAX_MEMORY = (64*1024*1024)
+    REDIS_DEFAULT_CLIENT_COMMAND_BUDGET = 100
+    REDIS_DEFAULT_CLIENT_READ_PAUSE_HIGH = (1024*1024)
+    REDIS_DEFAULT_CLIENT_READ_PAUSE_LOW = (256*1024)
     REDIS_DEFAULT_AOF_FILENAME = "appendonly.aof"
     REDIS_DEFAULT_AOF_NO_FSYNC_ON_REWRITE = 0
     REDIS_DEFAULT_ACTIVE_REHASHING = 1
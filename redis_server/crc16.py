@@ -0,0 +1,31 @@
+from typing import List, Union
+
+# CRC16 implementation according to CCITT standards (XMODEM).
+#
+# Name                       : "XMODEM", also known as "ZMODEM", "CRC-16/ACORN"
+# Width                      : 16 bit
+# Poly                       : 1021 (That is actually x^16 + x^12 + x^5 + 1)
+# Initialization             : 0000
+# Reflect Input byte         : False
+# Reflect Output CRC         : False
+# Xor constant to output CRC : 0000
+# Output for "123456789"     : 31C3
+
+def _crc16Table() -> List[int]:
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xffff)
+    return table
+
+crc16tab = _crc16Table()
+
+def crc16(buf: Union[bytes, bytearray], length: int = -1) -> int:
+    if length < 0:
+        length = len(buf)
+    crc = 0
+    for i in range(length):
+        crc = ((crc << 8) & 0xffff) ^ crc16tab[((crc >> 8) ^ buf[i]) & 0x00ff]
+    return crc
@@ -2,14 +2,15 @@ import typing
 from typing import List, Callable, Optional as Opt, Tuple
 from .rdict import rDict, dictGenHashFunction, dictType
 from .sds import sds, sdslen, sdsdup
-from .csix import memcmp, timeval
-from .robject import redisObject, dictRedisObjectDestructor
+from .csix import memcmp
+from .robject import redisObject, dictRedisObjectDestructor, dropObjectRespCache
 from .config import *
 from .rdict import *
 from .util import get_server
 
 if typing.TYPE_CHECKING:
     from .redis import RedisClient
+    from .commands.core import redisCommand
 
 def dictSdsHash(key: sds) -> int:
     return dictGenHashFunction(key, sdslen(key))
@@ -124,6 +125,10 @@ def signalModifiedKey(db: RedisDB, key: redisObject):
 def dbDelete(db: RedisDB, key: redisObject) -> int:
     if dictSize(db.expires) > 0:
         dictDelete(db.expires, key.ptr)
+    de = dictFind(db.dict, key.ptr)
+    if de:
+        # 值对象可能还在回复链表中, 先释放缓存的回复
+        dropObjectRespCache(dictGetVal(de))
     if dictDelete(db.dict, key.ptr) == DICT_OK:
         return 1
     else:
@@ -136,7 +141,7 @@ def expireIfNeeded(db: RedisDB, key: redisObject) -> int:
         return 0
     if server.loading:
         return 0
-    now = timeval.from_datetime().mstime
+    now = server.mstime
     if now <= when:
         return 0
     server.stat_expiredkeys += 1
@@ -185,6 +190,7 @@ def dbAdd(db: RedisDB, key: redisObject, val: redisObject):
 def dbOverwrite(db: RedisDB, key: redisObject, val: redisObject):
     de = dictFind(db.dict, key.ptr)
     assert de != None
+    dropObjectRespCache(dictGetVal(de))
     dictReplace(db.dict, key.ptr, val)
 
 def removeExpire(db: RedisDB, key: redisObject) -> int:
@@ -207,3 +213,21 @@ def setKey(db: RedisDB, key: redisObject, val: redisObject):
     incrRefCount(val)
     removeExpire(db, key)
     signalModifiedKey(db, key)
+
+# /*-----------------------------------------------------------------------------
+#  * API to get key arguments from commands
+#  * ---------------------------------------------------------------------------*/
+
+def getKeysUsingCommandTable(cmd: 'redisCommand', argv: List[redisObject], argc: int) -> List[int]:
+    """根据命令表的 firstkey/lastkey/keystep 返回 argv 中键参数的下标"""
+    if cmd.firstkey == 0:
+        return []
+    last = cmd.lastkey
+    if last < 0:
+        last = argc + last
+    return list(range(cmd.firstkey, last+1, cmd.keystep))
+
+def getKeysFromCommand(cmd: 'redisCommand', argv: List[redisObject], argc: int) -> List[int]:
+    if cmd.getkeys_proc:
+        return cmd.getkeys_proc(cmd, argv, argc)
+    return getKeysUsingCommandTable(cmd, argv, argc)
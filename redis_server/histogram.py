@@ -0,0 +1,82 @@
+from array import array
+from typing import List, Tuple
+
+__all__ = [
+    'hdrHistogram',
+    'hdrCreate',
+    'hdrRecordValue',
+    'hdrValueAtPercentile',
+    'hdrLogBuckets',
+    'HDR_MAX_VALUE',
+]
+
+# 和 HdrHistogram 一样按对数分段, 每段再线性地分成 2^(HDR_SUB_BUCKET_BITS-1) 个桶,
+# 相对误差不超过 1/2^(HDR_SUB_BUCKET_BITS-1), 也就是大约两位有效数字
+HDR_SUB_BUCKET_BITS = 7
+HDR_SUB_BUCKET_COUNT = 1 << HDR_SUB_BUCKET_BITS
+HDR_SUB_BUCKET_HALF = HDR_SUB_BUCKET_COUNT >> 1
+# 能记录的最大值, 更大的值记为这个值. 以微秒为单位时大约是 18 分钟
+HDR_MAX_VALUE = (1 << 30) - 1
+
+
+def hdrBucketIndex(value: int) -> int:
+    if value < HDR_SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - HDR_SUB_BUCKET_BITS
+    return shift * HDR_SUB_BUCKET_HALF + (value >> shift)
+
+def hdrHighestEquivalentValue(index: int) -> int:
+    """桶中能表示的最大值"""
+    if index < HDR_SUB_BUCKET_COUNT:
+        return index
+    shift = index // HDR_SUB_BUCKET_HALF - 1
+    top = index - shift * HDR_SUB_BUCKET_HALF
+    return ((top + 1) << shift) - 1
+
+HDR_BUCKETS = hdrBucketIndex(HDR_MAX_VALUE) + 1
+
+
+class hdrHistogram:
+    __slots__ = ('counts', 'total_count')
+
+    def __init__(self):
+        # 每个桶的计数, 大小固定, 不随记录的数量增长
+        self.counts: array = array('Q', bytes(8 * HDR_BUCKETS))
+        self.total_count: int = 0
+
+
+def hdrCreate() -> hdrHistogram:
+    return hdrHistogram()
+
+def hdrRecordValue(h: hdrHistogram, value: int) -> None:
+    if value > HDR_MAX_VALUE:
+        value = HDR_MAX_VALUE
+    h.counts[hdrBucketIndex(value)] += 1
+    h.total_count += 1
+
+def hdrValueAtPercentile(h: hdrHistogram, percentile: float) -> int:
+    """至少 percentile% 的记录不大于返回值"""
+    target = max(1, int(percentile / 100 * h.total_count + 0.5))
+    total = 0
+    for i, count in enumerate(h.counts):
+        total += count
+        if total >= target:
+            return hdrHighestEquivalentValue(i)
+    return 0
+
+def hdrLogBuckets(h: hdrHistogram) -> List[Tuple[int, int]]:
+    """按 1, 2, 4, 8... 分段的累计计数, 只返回计数有变化的分段"""
+    res = []
+    cumulative = prev = 0
+    i = 0
+    bound = 1
+    while cumulative < h.total_count:
+        end = hdrBucketIndex(min(bound, HDR_MAX_VALUE))
+        while i <= end:
+            cumulative += h.counts[i]
+            i += 1
+        if cumulative != prev:
+            res.append((bound, cumulative))
+            prev = cumulative
+        bound <<= 1
+    return res
@@ -0,0 +1,234 @@
+import typing
+from typing import List, Dict, Optional as Opt
+from .clock import getMonotonicUs
+from .util import get_server
+from .histogram import hdrLogBuckets
+from .networking import (
+    addReplyError, addReplyLongLong, addReplyMultiBulkLen, addReplyBulkCString, addReplyBulkCBuffer,
+)
+
+if typing.TYPE_CHECKING:
+    from .redis import RedisClient, RedisServer
+    from .commands.core import redisCommand
+
+__all__ = [
+    'latencySample',
+    'latencyTimeSeries',
+    'latencyMonitorInit',
+    'latencyAddSample',
+    'latencyAddSampleIfNeeded',
+    'latencyStartMonitor',
+    'latencyEndMonitor',
+    'latencyResetEvent',
+    'latencyGcCallback',
+    'latencyFlushGcPause',
+    'latencyCommand',
+]
+
+# 每类事件保存的样本数量. 同一秒内的样本合并为一个, 所以至少能覆盖最近 160 秒
+LATENCY_TS_LEN = 160
+
+# 各类事件的建议, 用于 LATENCY DOCTOR
+latencyAdvices = {
+    'command': "Check your Slow Log to understand what are the commands you are running which are "
+               "too slow to execute. Please check http://redis.io/commands/slowlog for more information.",
+    'fast-command': "Commands that should run in constant time were slow. This usually means the process "
+                    "did not get CPU time, or was paused by the garbage collector (see the gc event).",
+    'event-loop': "A single iteration of the event loop kept the server busy for too long. Look at the other "
+                  "events reported here, and at large pipelines, to find which part of the iteration was slow.",
+    'server-cron': "serverCron took too long. Many connected clients make clientsCron more expensive, "
+                   "and a high 'hz' value runs it more often.",
+    'dict-rehash': "Incremental rehashing of the main dictionaries took longer than expected. You may disable "
+                   "it with 'activerehashing no' at the cost of using more memory while a dictionary grows.",
+    'gc': "The Python garbage collector paused the server. Many long lived container objects make the older "
+          "generations expensive to scan, consider calling gc.freeze() after loading the data set or raising "
+          "the thresholds with gc.set_threshold().",
+}
+
+
+class latencySample:
+    __slots__ = ('time', 'latency')
+
+    def __init__(self):
+        # 样本的 UNIX 时间, 为 0 表示还没有使用
+        self.time: int = 0
+        # 延迟, 以毫秒为单位
+        self.latency: int = 0
+
+
+class latencyTimeSeries:
+    """一类事件最近的样本, 环形缓冲区, 大小固定"""
+    __slots__ = ('idx', 'max', 'samples')
+
+    def __init__(self):
+        # 下一个样本写入的位置
+        self.idx: int = 0
+        # 记录过的最大延迟
+        self.max: int = 0
+        self.samples: List[latencySample] = [latencySample() for _ in range(LATENCY_TS_LEN)]
+
+
+def latencyMonitorInit(server: 'RedisServer') -> None:
+    server.latency_events = {}
+
+def latencyAddSample(event: str, latency: int) -> None:
+    server = get_server()
+    ts = server.latency_events.get(event)
+    if ts is None:
+        ts = server.latency_events[event] = latencyTimeSeries()
+    if latency > ts.max:
+        ts.max = latency
+    # 同一秒内的样本只保留最大的一个
+    prev = ts.samples[(ts.idx + LATENCY_TS_LEN - 1) % LATENCY_TS_LEN]
+    if prev.time == server.unixtime:
+        if latency > prev.latency:
+            prev.latency = latency
+        return
+    sample = ts.samples[ts.idx]
+    sample.time = server.unixtime
+    sample.latency = latency
+    ts.idx = (ts.idx + 1) % LATENCY_TS_LEN
+
+def latencyAddSampleIfNeeded(event: str, latency: int) -> None:
+    """延迟不小于 latency-monitor-threshold 毫秒时记录, 阈值为 0 时关闭"""
+    threshold = get_server().latency_monitor_threshold
+    if threshold and latency >= threshold:
+        latencyAddSample(event, latency)
+
+def latencyStartMonitor() -> int:
+    return getMonotonicUs() // 1000 if get_server().latency_monitor_threshold else 0
+
+def latencyEndMonitor(start: int) -> int:
+    """返回从 latencyStartMonitor 开始经过的毫秒数"""
+    return getMonotonicUs() // 1000 - start if start else 0
+
+def latencyResetEvent(event: Opt[str]) -> int:
+    """清除 event 的样本, event 为 None 时清除所有事件, 返回清除的事件数量"""
+    server = get_server()
+    if event is None:
+        count = len(server.latency_events)
+        server.latency_events.clear()
+        return count
+    return 1 if server.latency_events.pop(event, None) else 0
+
+# 垃圾回收开始的时间和还没有记录的最长停顿, 见 latencyGcCallback
+gcStartTime = 0
+gcPendingPause = 0
+
+def latencyGcCallback(phase: str, info: Dict[str, int]) -> None:
+    """注册到 gc.callbacks, 记下垃圾回收造成的最长停顿
+
+    任何分配内存的地方都可能触发垃圾回收, 包括遍历 server.latency_events 的时候和 I/O 线程中,
+    所以这里只记下停顿的时间, 由事件循环调用 latencyFlushGcPause 记为 gc 事件.
+    """
+    global gcStartTime, gcPendingPause
+    if phase == 'start':
+        gcStartTime = latencyStartMonitor()
+    else:
+        pause = latencyEndMonitor(gcStartTime)
+        if pause > gcPendingPause:
+            gcPendingPause = pause
+
+def latencyFlushGcPause() -> None:
+    """把上次调用以来最长的垃圾回收停顿记为 gc 事件"""
+    global gcPendingPause
+    if gcPendingPause:
+        pause, gcPendingPause = gcPendingPause, 0
+        latencyAddSampleIfNeeded("gc", pause)
+
+def latencyTimeSeriesSamples(ts: latencyTimeSeries) -> List[latencySample]:
+    """按时间顺序返回已经使用的样本"""
+    samples = ts.samples[ts.idx:] + ts.samples[:ts.idx]
+    return [s for s in samples if s.time]
+
+def createLatencyReport(server: 'RedisServer') -> str:
+    if not server.latency_monitor_threshold:
+        return ("I'm sorry, Dave, I can't do that. Latency monitoring is disabled in this Redis instance. "
+                "You may use \"CONFIG SET latency-monitor-threshold <milliseconds>.\" in order to enable it.\n")
+    if not server.latency_events:
+        report = ("Dave, no latency spike was observed during the lifetime of this Redis instance, "
+                  "not in the slightest bit. I honestly think you ought to sleep tonight.\n")
+    else:
+        report = "Dave, I have observed latency spikes in this Redis instance. You don't mind talking about it, do you Dave?\n\n"
+        for i, (event, ts) in enumerate(list(server.latency_events.items()), 1):
+            samples = latencyTimeSeriesSamples(ts)
+            latencies = [s.latency for s in samples]
+            avg = sum(latencies) / len(latencies)
+            # 平均绝对偏差
+            mad = sum(abs(l - avg) for l in latencies) / len(latencies)
+            period = (server.unixtime - samples[0].time) / len(samples)
+            report += ("%d. %s: %d latency spikes (average %dms, mean deviation %dms, period %.2f sec). "
+                       "Worst all time event %dms.\n" % (i, event, len(samples), avg, mad, period, ts.max))
+        advices = [latencyAdvices[e] for e in list(server.latency_events) if e in latencyAdvices]
+        if advices:
+            report += "\nI have a few advices for you:\n\n" + "".join("- %s\n" % a for a in advices)
+    # 事件循环的时间分为执行事件的时间和阻塞在 aeApiPoll 中的时间
+    el = server.el
+    total = el.busy_us + el.poll_us
+    if total:
+        report += ("\nEvent loop utilization: %.2f%% busy over %d cycles (%dms busy, %dms blocked in poll).\n" % (
+            100 * el.busy_us / total, el.cycles, el.busy_us // 1000, el.poll_us // 1000))
+    return report
+
+def latencyAddReplyHistogram(c: 'RedisClient', cmd: 'redisCommand') -> None:
+    """命令名 -> [calls, 次数, histogram_usec, [上界, 不大于上界的累计次数, ...]]"""
+    assert cmd.latency_histogram
+    buckets = hdrLogBuckets(cmd.latency_histogram)
+    addReplyBulkCString(c, cmd.name)
+    addReplyMultiBulkLen(c, 4)
+    addReplyBulkCString(c, "calls")
+    addReplyLongLong(c, cmd.latency_histogram.total_count)
+    addReplyBulkCString(c, "histogram_usec")
+    addReplyMultiBulkLen(c, 2*len(buckets))
+    for bound, count in buckets:
+        addReplyLongLong(c, bound)
+        addReplyLongLong(c, count)
+
+def latencyHistogramCommand(c: 'RedisClient') -> None:
+    """LATENCY HISTOGRAM [command ...], 不指定命令时返回所有执行过的命令"""
+    server = get_server()
+    if c.argc == 2:
+        cmds = list(server.commands.values())
+    else:
+        cmds = [server.commands.get(c.argv[j].ptr.text.lower()) for j in range(2, c.argc)]
+    # 同一个命令只返回一次, 不存在或者没有执行过的命令被忽略
+    found = {id(cmd): cmd for cmd in cmds if cmd and cmd.latency_histogram}
+    addReplyMultiBulkLen(c, 2*len(found))
+    for cmd in found.values():
+        latencyAddReplyHistogram(c, cmd)
+
+def latencyCommand(c: 'RedisClient') -> None:
+    """LATENCY LATEST / HISTORY event / RESET [event ...] / DOCTOR / HISTOGRAM [command ...]"""
+    server = get_server()
+    sub = c.argv[1].ptr
+    if c.argc == 2 and sub.lowereq('latest'):
+        # [事件, 最新样本的时间, 最新样本的延迟, 最大延迟]
+        events = list(server.latency_events.items())
+        addReplyMultiBulkLen(c, len(events))
+        for event, ts in events:
+            last = ts.samples[(ts.idx + LATENCY_TS_LEN - 1) % LATENCY_TS_LEN]
+            addReplyMultiBulkLen(c, 4)
+            addReplyBulkCString(c, event)
+            addReplyLongLong(c, last.time)
+            addReplyLongLong(c, last.latency)
+            addReplyLongLong(c, ts.max)
+    elif c.argc == 3 and sub.lowereq('history'):
+        history = server.latency_events.get(c.argv[2].ptr.text)
+        samples = latencyTimeSeriesSamples(history) if history else []
+        addReplyMultiBulkLen(c, len(samples))
+        for s in samples:
+            addReplyMultiBulkLen(c, 2)
+            addReplyLongLong(c, s.time)
+            addReplyLongLong(c, s.latency)
+    elif sub.lowereq('reset'):
+        if c.argc == 2:
+            addReplyLongLong(c, latencyResetEvent(None))
+        else:
+            addReplyLongLong(c, sum(latencyResetEvent(c.argv[j].ptr.text) for j in range(2, c.argc)))
+    elif c.argc == 2 and sub.lowereq('doctor'):
+        report = createLatencyReport(server).encode()
+        addReplyBulkCBuffer(c, report, len(report))
+    elif sub.lowereq('histogram'):
+        latencyHistogramCommand(c)
+    else:
+        addReplyError(c, "Unknown LATENCY subcommand or wrong # of args. Try LATEST, HISTORY, RESET, DOCTOR, HISTOGRAM.")
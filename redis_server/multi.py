@@ -5,6 +5,10 @@ if typing.TYPE_CHECKING:
 
 
 def initClientMultiState(c: 'RedisClient'):
+    from .redis import multiState
+    # 事务状态在第一次执行 MULTI 时才创建
+    if c.mstate is None:
+        c.mstate = multiState()
     # // 命令队列
     c.mstate.commands = []
     # // 命令计数
@@ -1,10 +1,12 @@
 import socket
 import errno
 import typing
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
+from typing import List, Union, Optional as Opt
 
-from .ae import aeDeleteFileEvent, aeEventLoop, aeCreateFileEvent, AE_WRITABLE, AE_ERR
-from .anet import anetTcpAccept
+from .ae import aeDeleteFileEvent, aeEventLoop, aeCreateFileEvent, AE_WRITABLE, AE_READABLE, AE_ERR
+from .anet import anetTcpAccept, anetUnixAccept
 from .robject import (
     redisObject, incrRefCount, equalStringObjects, createObject, createStringObject,
     decrRefCount, dupStringObject, sdsEncodedObject, getDecodedObject,
@@ -14,10 +16,13 @@ from .util import *
 from .config import *
 from .sds import (
     sdsempty, sdslen, sdsMakeRoomFor, sdsIncrLen, sdsrange, sdsnewlen, sdssplitargs, sds,
-    sdscatlen, sdsfree
+    sdscatlen, sdsfree, sdsAllocSize
 )
 from .csix import cstr, ULONG_MASK
-from .adlist import listDelNode, listFirst, listLength, listAddNodeTail, listNodeValue, listLast, rList, listNode
+from .rdict import dictSize
+from .adlist import (
+    listDelNode, listFirst, listLength, listAddNodeTail, listNodeValue, listLast, rList, listNode, listNextNode,
+)
 
 if typing.TYPE_CHECKING:
     from .redis import RedisClient
@@ -25,6 +30,15 @@ if typing.TYPE_CHECKING:
 logger = getLogger(__name__)
 
 MAX_ACCEPTS_PER_CALL = 1000
+# 一次 sendmsg 最多发送的缓冲区个数
+IOV_MAX = 1024
+# 回复链表每个节点(listNode 和 redisObject)额外占用的内存
+REPLY_LIST_ITEM_SIZE = 64
+
+# 共享的读缓冲区. querybuf 为空的客户端从这里借一个缓冲区读取数据, 数据处理完之后还回来,
+# 这样空闲的客户端只持有一个空的 querybuf. list 的 append 和 pop 是原子操作, I/O 线程中也可以使用
+READ_BUFFER_POOL_SIZE = 64
+readBufferPool: List[sds] = []
 
 def askingCommand():
     # NOTE: for cluster uasge
@@ -34,7 +48,10 @@ def clientsArePaused() -> int:
     server = get_server()
     if server.clients_paused and server.clients_pause_end_time < server.unixtime:
         server.clients_paused = 0
-        for c in server.clients:
+        ln = listFirst(server.clients)
+        while ln:
+            c = listNodeValue(ln)
+            ln = listNextNode(ln)
             if c.flags & REDIS_SLAVE:
                 continue
             server.unblocked_clients.append(c)
@@ -47,12 +64,18 @@ def freeClientArgv(c: 'RedisClient') -> None:
     c.argv = []
     c.cmd = None
 
-def setProtocolError(c: 'RedisClient', pos: int) -> None:
+def setProtocolError(c: 'RedisClient', err: str, pos: int) -> None:
     server = get_server()
     if server.verbosity >= REDIS_VERBOSE:
         logger.info("Protocol error from client: %s", c)
-    c.flags |= REDIS_CLOSE_AFTER_REPLY
-    sdsrange(c.querybuf, pos, -1)
+    if c.argv_queue or c.flags & (REDIS_BLOCKED|REDIS_PENDING_READ):
+        # 前面解析出的命令还没有执行或者还在等待回复, 它们都回复之后再回复错误.
+        # 在 I/O 线程中时也由主线程回复, 回复错误会修改服务器的统计数据
+        c.protoerr = err
+    else:
+        addReplyError(c, err)
+        c.flags |= REDIS_CLOSE_AFTER_REPLY
+    c.qb_pos = pos
 
 
 def resetClient(c: 'RedisClient') -> None:
@@ -72,9 +95,59 @@ def freeClientAsync(c: 'RedisClient') -> None:
     server = get_server()
     server.clients_to_close.append(c)
 
+def freeClientsInAsyncFreeQueue() -> None:
+    from .redis import freeClient
+    server = get_server()
+    while server.clients_to_close:
+        c = server.clients_to_close.pop(0)
+        c.flags &= ~REDIS_CLOSE_ASAP
+        freeClient(c)
+
+def getClientPeerId(c: 'RedisClient') -> str:
+    """客户端的地址, 格式为 ip:port, unix socket 的客户端是 path:0, 第一次调用时生成并缓存"""
+    if not c.peerid:
+        if not c.fd:
+            return '?:0'
+        try:
+            if c.fd.family == socket.AF_UNIX:
+                c.peerid = '%s:0' % c.fd.getsockname()
+            else:
+                ip, port = c.fd.getpeername()[:2]
+                c.peerid = ('[%s]:%d' if ':' in ip else '%s:%d') % (ip, port)
+        except OSError:
+            return '?:0'
+    return c.peerid
+
+def getClientOutputBufferMemoryUsage(c: 'RedisClient') -> int:
+    # 加上每个链表节点的开销, 和 Redis 一样只是估算
+    return c.reply_bytes + REPLY_LIST_ITEM_SIZE * listLength(c.reply)
+
+def getClientType(c: 'RedisClient') -> int:
+    if c.flags & REDIS_SLAVE and not (c.flags & REDIS_MONITOR):
+        return REDIS_CLIENT_LIMIT_CLASS_SLAVE
+    # 没有订阅过的客户端没有创建这两个结构
+    if ((c.pubsub_channels and dictSize(c.pubsub_channels)) or
+        (c.pubsub_patterns and listLength(c.pubsub_patterns))):
+        return REDIS_CLIENT_LIMIT_CLASS_PUBSUB
+    return REDIS_CLIENT_LIMIT_CLASS_NORMAL
+
 def checkClientOutputBufferLimits(c: 'RedisClient') -> int:
-    # TODO(rlj): something to do.
-    pass
+    """超过硬限制, 或者连续超过软限制 soft_limit_seconds 秒时返回 1"""
+    server = get_server()
+    used_mem = getClientOutputBufferMemoryUsage(c)
+    limits = server.client_obuf_limits[getClientType(c)]
+    hard = limits.hard_limit_bytes and used_mem >= limits.hard_limit_bytes
+    soft = limits.soft_limit_bytes and used_mem >= limits.soft_limit_bytes
+    if soft:
+        # 第一次超过软限制时开始计时
+        if c.obuf_soft_limit_reached_time == 0:
+            c.obuf_soft_limit_reached_time = server.unixtime
+            soft = 0
+        elif server.unixtime - c.obuf_soft_limit_reached_time <= limits.soft_limit_seconds:
+            soft = 0
+    else:
+        c.obuf_soft_limit_reached_time = 0
+    return 1 if soft or hard else 0
 
 def asyncCloseClientOnOutputBufferLimitReached(c: 'RedisClient') -> None:
     assert c.reply_bytes < ULONG_MASK - 1024 * 64
@@ -82,23 +155,36 @@ def asyncCloseClientOnOutputBufferLimitReached(c: 'RedisClient') -> None:
         return
     if checkClientOutputBufferLimits(c):
         freeClientAsync(c)
+        get_server().stat_client_obuf_limit_disconnections += 1
         logger.warning("Client %s scheduled to be closed ASAP for overcoming of output buffer limits.", c)
 
 def prepareClientToWrite(c: 'RedisClient') -> int:
-    server = get_server()
     if c.flags & REDIS_LUA_CLIENT:
         return REDIS_OK
     if (c.flags & REDIS_MASTER) and not(c.flags & REDIS_MASTER_FORCE_REPLY):
         return REDIS_ERR
     if not c.fd or c.fd.fileno() <= 0:
         return REDIS_ERR
-    if (c.bufpos == 0 and listLength(c.reply) == 0
-        and (c.replstate in (REDIS_REPL_NONE, REDIS_REPL_ONLINE))
-        and aeCreateFileEvent(server.el, c.fd.fileno(), AE_WRITABLE, sendReplyToClient, c) == AE_ERR
-        ):
+    # 即将被关闭的客户端(比如超过了输出缓冲区限制)不再接收回复
+    if c.flags & REDIS_CLOSE_ASAP:
         return REDIS_ERR
+    # 等待 I/O 线程读取的客户端由主线程在读取完成后处理
+    if not clientHasPendingReplies(c) and not (c.flags & REDIS_PENDING_READ):
+        clientInstallWriteHandler(c)
     return REDIS_OK
 
+def clientHasPendingReplies(c: 'RedisClient') -> int:
+    return c.bufpos or listLength(c.reply)
+
+def clientInstallWriteHandler(c: 'RedisClient') -> None:
+    # 不马上注册写事件, 而是放入 clients_pending_write, 在 beforeSleep 中直接写入,
+    # 只有套接字写不下时才注册写事件
+    server = get_server()
+    if (not (c.flags & REDIS_PENDING_WRITE)
+        and c.replstate in (REDIS_REPL_NONE, REDIS_REPL_ONLINE)):
+        c.flags |= REDIS_PENDING_WRITE
+        server.clients_pending_write.append(c)
+
 
 def dupLastObjectIfNeeded(reply: rList):
     assert listLength(reply) > 0
@@ -115,6 +201,23 @@ def getStringObjectSdsUsedMemory(o: redisObject) -> int:
     assert o.type == REDIS_STRING and isinstance(o.ptr, sds)
     return len(o.ptr.buf)
 
+def _replyListTailHasRoom(c: 'RedisClient', length: int) -> int:
+    """回复链表的尾节点能否再追加 length 字节"""
+    tail: redisObject = listNodeValue(listLast(c.reply))   # type: ignore
+    if (tail.ptr == None or tail.encoding != REDIS_ENCODING_RAW or
+        sdslen(tail.ptr) + length > REDIS_REPLY_CHUNK_BYTES):
+        return 0
+    # 引用了大的值对象的节点(还被数据库持有)不能追加, 否则 dupLastObjectIfNeeded 会复制整个值
+    return tail.refcount == 1 or sdslen(tail.ptr) < REDIS_REPLY_ZEROCOPY_BYTES
+
+def _catReplyListTail(c: 'RedisClient', s: Union[cstr, sds], length: int) -> None:
+    # 尾节点可能被复制, 也可能扩容, 追加前后重新计算它占用的内存
+    tail: redisObject = listNodeValue(listLast(c.reply))   # type: ignore
+    c.reply_bytes -= getStringObjectSdsUsedMemory(tail)
+    tail = dupLastObjectIfNeeded(c.reply)
+    sdscatlen(tail.ptr, s, length)
+    c.reply_bytes += getStringObjectSdsUsedMemory(tail)
+
 def _addReplySdsToList(c: 'RedisClient', s: sds) -> None:
     if c.flags & REDIS_CLOSE_AFTER_REPLY:
         sdsfree(s)
@@ -124,11 +227,8 @@ def _addReplySdsToList(c: 'RedisClient', s: sds) -> None:
         listAddNodeTail(c.reply, createObject(REDIS_STRING, s))
         c.reply_bytes += len(s.buf)
     else:
-        tail: redisObject = listNodeValue(listLast(c.reply))   # type: ignore
-        if (tail.ptr != None and tail.encoding == REDIS_ENCODING_RAW and
-            sdslen(tail.ptr) + sdslen(s) <= REDIS_REPLY_CHUNK_BYTES):
-            tail.ptr = dupLastObjectIfNeeded(c.reply).ptr
-            sdscatlen(tail.ptr, s, sdslen(s))
+        if _replyListTailHasRoom(c, sdslen(s)):
+            _catReplyListTail(c, s, sdslen(s))
         else:
             listAddNodeTail(c.reply, createObject(REDIS_STRING, s))
             c.reply_bytes += len(s.buf)
@@ -143,11 +243,8 @@ def _addReplyStringToList(c: 'RedisClient', s: cstr, length: int) -> None:
         listAddNodeTail(c.reply, o)
         c.reply_bytes += getStringObjectSdsUsedMemory(o)
     else:
-        tail: redisObject = listNodeValue(listLast(c.reply))   # type: ignore
-        if (tail.ptr != None and tail.encoding == REDIS_ENCODING_RAW and
-            sdslen(tail.ptr) + length <= REDIS_REPLY_CHUNK_BYTES):
-            tail.ptr = dupLastObjectIfNeeded(c.reply).ptr
-            sdscatlen(tail.ptr, s, length)
+        if _replyListTailHasRoom(c, length):
+            _catReplyListTail(c, s, length)
         else:
             o = createStringObject(s, length)
             listAddNodeTail(c.reply, o)
@@ -163,13 +260,9 @@ def _addReplyObjectToList(c: 'RedisClient', o: redisObject) -> None:
         listAddNodeTail(c.reply, o)
         c.reply_bytes += getStringObjectSdsUsedMemory(o)
     else:
-        tail = listNodeValue(listLast(c.reply))   # type: ignore
-        if (tail.ptr != None and tail.encoding == REDIS_ENCODING_RAW and
-            sdslen(tail.ptr) + sdslen(o.ptr) <= REDIS_REPLY_CHUNK_BYTES):
-            c.reply_bytes -= sdslen(tail.ptr)
-            tail.ptr = dupLastObjectIfNeeded(c.reply).ptr
-            sdscatlen(tail.ptr, o.ptr, sdslen(o.ptr))
-            c.reply_bytes += sdslen(tail.ptr)
+        # 大的值对象直接引用, 不复制到尾节点
+        if sdslen(o.ptr) < REDIS_REPLY_ZEROCOPY_BYTES and _replyListTailHasRoom(c, sdslen(o.ptr)):
+            _catReplyListTail(c, o.ptr, sdslen(o.ptr))
         else:
             incrRefCount(o)
             listAddNodeTail(c.reply, o)
@@ -196,7 +289,10 @@ def addReplyString(c: 'RedisClient', s: cstr, length: int) -> None:
 
 
 def addReplyErrorLength(c: 'RedisClient', s: cstr, length: int) -> None:
-    addReplyString(c, b"-ERR ", 5)
+    get_server().stat_total_error_replies += 1
+    # 以 '-' 开头时调用者已经给出了错误码, 例如 -CROSSSLOT
+    if not s.startswith(b"-"):
+        addReplyString(c, b"-ERR ", 5)
     addReplyString(c, s, length)
     addReplyString(c, b"\r\n", 2)
 
@@ -204,11 +300,18 @@ def addReplyError(c: 'RedisClient', err: str) -> None:
     msg = err.encode()
     addReplyErrorLength(c, msg, len(msg))
 
+def addReplyErrorObject(c: 'RedisClient', err: redisObject) -> None:
+    """回复共享的错误对象, 和 addReplyError 一样计入错误回复的数量"""
+    get_server().stat_total_error_replies += 1
+    addReply(c, err)
+
 def addReply(c: 'RedisClient', obj: redisObject) -> None:
     if prepareClientToWrite(c) != REDIS_OK:
         return
     if sdsEncodedObject(obj):
-        if _addReplyToBuffer(c, obj.ptr, sdslen(obj.ptr)) != REDIS_OK:
+        # 大的值作为引用放入回复链表, 直到发送完成都持有对象, 发送时直接使用它的缓冲区
+        if (sdslen(obj.ptr) >= REDIS_REPLY_ZEROCOPY_BYTES or
+            _addReplyToBuffer(c, obj.ptr, sdslen(obj.ptr)) != REDIS_OK):
             _addReplyObjectToList(c, obj)
     elif obj.encoding == REDIS_ENCODING_INT:
         if listLength(c.reply) == 0 and (len(c.buf) - c.bufpos) >= 32:
@@ -250,115 +353,166 @@ def addReplyBulkLen(c: 'RedisClient', obj: redisObject) -> None:
         addReplyLongLongWithPrefix(c, length, '$')
 
 def addReplyBulk(c: 'RedisClient', obj: redisObject) -> None:
+    if obj.resp is not None:
+        get_server().stat_resp_cache_hits += 1
+    else:
+        _cacheObjectResp(obj)
+    if obj.resp is not None:
+        addReplyString(c, obj.resp, len(obj.resp))
+        return
     shared = get_shared()
     addReplyBulkLen(c, obj)
     addReply(c, obj)
     addReply(c, shared.crlf)
 
+def addReplyBulkCBuffer(c: 'RedisClient', p: cstr, length: int) -> None:
+    addReplyLongLongWithPrefix(c, length, '$')
+    addReplyString(c, p, length)
+    addReply(c, get_shared().crlf)
+
+def addReplyBulkCString(c: 'RedisClient', s: Opt[str]) -> None:
+    if s is None:
+        addReply(c, get_shared().nullbulk)
+    else:
+        b = s.encode('utf8')
+        addReplyBulkCBuffer(c, b, len(b))
+
+def addReplyLongLong(c: 'RedisClient', ll: int) -> None:
+    shared = get_shared()
+    if ll == 0:
+        addReply(c, shared.czero)
+    elif ll == 1:
+        addReply(c, shared.cone)
+    else:
+        addReplyLongLongWithPrefix(c, ll, ':')
+
+def addReplyMultiBulkLen(c: 'RedisClient', length: int) -> None:
+    addReplyLongLongWithPrefix(c, length, '*')
+
+def _cacheObjectResp(obj: redisObject) -> None:
+    """第一次读取时生成 bulk 回复的完整编码, 大的值直接引用对象发送, 不缓存"""
+    server = get_server()
+    if sdsEncodedObject(obj):
+        if sdslen(obj.ptr) >= REDIS_REPLY_ZEROCOPY_BYTES:
+            return
+        value = obj.ptr.content
+    elif obj.encoding == REDIS_ENCODING_INT:
+        value = b'%d' % obj.ptr
+    else:
+        return
+    resp = b'$%d\r\n%s\r\n' % (len(value), value)
+    if server.resp_cache_memory + len(resp) > server.resp_cache_max_memory:
+        return
+    obj.resp = resp
+    server.resp_cache_memory += len(resp)
+
 def processInlineBuffer(c: 'RedisClient') -> int:
     server = get_server()
-    idx = c.querybuf.buf.find(b'\n')
-    if idx == -1 or idx == 0:   # buffer 不包含换行
-        if sdslen(c.querybuf) > REDIS_INLINE_MAX_SIZE:
-            addReplyError(c, "Protocol error: too big inline request")
-            setProtocolError(c, 0)
+    buf = c.querybuf.buf
+    qblen = sdslen(c.querybuf)
+    # buf 在 len 之后可能还有旧数据, 查找时不能越过 sdslen
+    idx = buf.find(b'\n', c.qb_pos, qblen)
+    if idx == -1:   # buffer 不包含换行
+        if qblen - c.qb_pos > REDIS_INLINE_MAX_SIZE:
+            setProtocolError(c, "Protocol error: too big inline request", c.qb_pos)
         return REDIS_ERR
-    newline = memoryview(c.querybuf.buf)[:idx]
-    if newline[-1] == b'\r':
-        newline = newline[:-1]
-    querylen = len(newline)
-    aux = sdsnewlen(c.querybuf.buf, querylen)
+    end = idx
+    if end > c.qb_pos and buf[end-1] == ord('\r'):
+        end -= 1
+    querylen = end - c.qb_pos
+    aux = sdsnewlen(memoryview(buf)[c.qb_pos:end], querylen)
     argv = sdssplitargs(aux)
-    if not argv:
-        addReplyError(c, "Protocol error: unbalanced quotes in request")
-        setProtocolError(c, 0)
+    if argv is None:
+        setProtocolError(c, "Protocol error: unbalanced quotes in request", c.qb_pos)
         return REDIS_ERR
     if querylen == 0 and c.flags & REDIS_SLAVE:
         c.repl_ack_time = server.unixtime
-    sdsrange(c.querybuf, querylen+2, -1)
+    c.qb_pos = idx + 1
     c.argv = [createObject(REDIS_STRING, i) for i in argv]
     return REDIS_OK
 
-def processMultibulkBuffer(c: 'RedisClient'):
+def processMultibulkBuffer(c: 'RedisClient') -> int:
+    """从 c.qb_pos 开始解析一个命令, 只移动 qb_pos, 由 processInputBuffer 统一丢弃解析过的数据"""
+    buf = c.querybuf.buf
+    qblen = sdslen(c.querybuf)
+    pos = c.qb_pos
     ll = 0
-    pos = 0
     if c.multibulklen == 0:
         assert c.argc == 0
-        assert c.querybuf[0:1] == b'*'
-        newline = c.querybuf[0:c.querybuf.buf.find(b'\r\n')]
-        if not newline:
-            if sdslen(c.querybuf) > REDIS_INLINE_MAX_SIZE:
-                addReplyError(c, "Protocol error: too big mbulk count string")
-                setProtocolError(c, 0)
+        assert buf[pos] == ord('*')
+        idx = buf.find(b'\r\n', pos, qblen)
+        if idx < 0:
+            if qblen - pos > REDIS_INLINE_MAX_SIZE:
+                setProtocolError(c, "Protocol error: too big mbulk count string", pos)
             return REDIS_ERR
-        ok, ll = string2ll(newline[1:], len(newline)-1)
+        ok, ll = string2ll(buf[pos+1:idx], idx-(pos+1))
         if not ok or ll > 1024 * 1024:
-            addReplyError(c, "Protocol error: invalid multibulk length")
-            setProtocolError(c, 0)
-        pos = len(newline) + 2
+            setProtocolError(c, "Protocol error: invalid multibulk length", pos)
+            return REDIS_ERR
+        pos = idx + 2
         if ll <= 0:
-            sdsrange(c.querybuf, pos, -1)
+            c.qb_pos = pos
             return REDIS_OK
         c.multibulklen = ll
     assert c.multibulklen > 0
     while c.multibulklen:
         if c.bulklen == -1:
-            newpos = c.querybuf.buf.find(b'\r\n', pos)
-            if newpos < 0:
-                if sdslen(c.querybuf) > REDIS_INLINE_MAX_SIZE:
-                    addReplyError(c, "Protocol error: too big bulk count string")
-                    setProtocolError(c, 0)
+            idx = buf.find(b'\r\n', pos, qblen)
+            if idx < 0:
+                if qblen - pos > REDIS_INLINE_MAX_SIZE:
+                    setProtocolError(c, "Protocol error: too big bulk count string", pos)
                     return REDIS_ERR
                 break
-            if c.querybuf[pos:pos+1] != b'$':
-                addReplyError(c, "Protocol error: expected '$', got %r" % c.querybuf[pos:pos+1])
-                setProtocolError(c, pos)
+            if buf[pos] != ord('$'):
+                setProtocolError(c, "Protocol error: expected '$', got '%c'" % buf[pos], pos)
                 return REDIS_ERR
-            ok, ll = string2ll(c.querybuf[pos+1:newpos], newpos-(pos+1))
+            ok, ll = string2ll(buf[pos+1:idx], idx-(pos+1))
             if not ok or ll < 0 or ll > 512*1024*1024:
-                addReplyError(c, "Protocol error: invalid bulk length")
-                setProtocolError(c, pos)
+                setProtocolError(c, "Protocol error: invalid bulk length", pos)
                 return REDIS_ERR
-            pos = newpos + 2
+            pos = idx + 2
             if ll >= REDIS_MBULK_BIG_ARG:
+                # 大参数从 querybuf 的开头开始读取, 读完后可以直接作为参数对象, 不需要复制
                 sdsrange(c.querybuf, pos, -1)
                 pos = 0
                 qblen = sdslen(c.querybuf)
                 if qblen < ll + 2:
                     c.querybuf = sdsMakeRoomFor(c.querybuf, ll+2-qblen)
+                buf = c.querybuf.buf
             c.bulklen = ll
-        if sdslen(c.querybuf)-pos < c.bulklen + 2:
+        if qblen - pos < c.bulklen + 2:
             break
+        if pos == 0 and c.bulklen >= REDIS_MBULK_BIG_ARG and qblen == c.bulklen+2:
+            c.argv.append(createObject(REDIS_STRING, c.querybuf))
+            sdsIncrLen(c.querybuf, -2)
+            c.querybuf = sdsempty()
+            c.querybuf = sdsMakeRoomFor(c.querybuf, c.bulklen+2)
+            buf = c.querybuf.buf
+            qblen = 0
         else:
-            if pos == 0 and c.bulklen >= REDIS_MBULK_BIG_ARG and sdslen(c.querybuf) == c.bulklen+2:
-                c.argv.append(createObject(REDIS_STRING, c.querybuf))
-                sdsIncrLen(c.querybuf, -2)
-                c.querybuf = sdsempty()
-                c.querybuf = sdsMakeRoomFor(c.querybuf, c.bulklen+2)
-                pos = 0
-            else:
-                c.argv.append(createStringObject(c.querybuf[pos:pos+c.bulklen], c.bulklen))
-                pos += c.bulklen+2
-            c.bulklen = -1
-            c.multibulklen -= 1
+            # 每个参数只复制一次
+            c.argv.append(createStringObject(memoryview(buf)[pos:pos+c.bulklen], c.bulklen))
+            pos += c.bulklen+2
+        c.bulklen = -1
+        c.multibulklen -= 1
 
-    if pos:
-        sdsrange(c.querybuf, pos, -1)
+    c.qb_pos = pos
     if c.multibulklen == 0:
         return REDIS_OK
     return REDIS_ERR
 
 def processInputBuffer(c: 'RedisClient') -> None:
     from .redis import processCommand
-    while sdslen(c.querybuf) > 0:
-        if (not (c.flags & REDIS_SLAVE) and clientsArePaused()):
-            return
+    while c.qb_pos < sdslen(c.querybuf):
+        # clientsArePaused 会修改服务器的状态, I/O 线程中不检查, 由主线程在执行命令前检查
+        if (not (c.flags & (REDIS_SLAVE|REDIS_PENDING_READ)) and clientsArePaused()):
+            break
         if c.flags & REDIS_BLOCKED:
-            return
-        if c.flags & REDIS_CLOSE_AFTER_REPLY:
-            return
+            break
+        if c.flags & REDIS_CLOSE_AFTER_REPLY or c.protoerr:
+            break
         if not c.reqtype:
-            if c.querybuf[0:1] == b'*':
+            if c.querybuf.buf[c.qb_pos] == ord('*'):
                 c.reqtype = REDIS_REQ_MULTIBULK
             else:
                 c.reqtype = REDIS_REQ_INLINE
@@ -373,17 +527,112 @@ def processInputBuffer(c: 'RedisClient') -> None:
         if c.argc == 0:
             resetClient(c)
         else:
-            if processCommand(c) == REDIS_OK:
-                resetClient(c)
+            # 先解析出所有完整的命令, 再一起执行.
+            # I/O 线程中只解析命令, 由主线程按顺序执行
+            c.argv_queue.append(c.argv)
+            c.argv = []
+            resetClient(c)
+    # 每次读取之后只移动一次剩下的数据
+    if c.qb_pos:
+        sdsrange(c.querybuf, c.qb_pos, -1)
+        c.qb_pos = 0
+    if c.argv_queue and not (c.flags & (REDIS_PENDING_READ|REDIS_BLOCKED|REDIS_PENDING_COMMAND)):
+        processPendingCommands(c)
+
+def processPendingCommands(c: 'RedisClient') -> None:
+    """按顺序执行 c.argv_queue 中已经解析好的命令, 最多执行 client_command_budget 个"""
+    from .redis import processCommand, lookupCommandByBytes
+    server = get_server()
+    server.current_client = c
+    queue = c.argv_queue
+    c.argv_queue = []
+    budget = server.client_command_budget
+    # 保存还没有解析完的命令的状态, 执行命令时 resetClient 会清空它
+    partial = c.argv, c.reqtype, c.multibulklen, c.bulklen
+    for i, argv in enumerate(queue):
+        if c.flags & REDIS_CLOSE_AFTER_REPLY:
+            # 例如 QUIT, 之后的命令不再执行
+            for argv in queue[i:]:
+                for o in argv:
+                    decrRefCount(o)
+            break
+        if c.flags & REDIS_BLOCKED:
+            # 剩下的命令在客户端解除阻塞后执行
+            c.argv_queue = queue[i:]
+            break
+        if budget and i == budget:
+            # 用完了这一轮的配额, 剩下的命令排队等下一轮, 避免一个客户端长时间占用事件循环
+            c.argv_queue = queue[i:]
+            deferClientCommands(c)
+            break
+        c.argv = argv
+        name = argv[0].ptr
+        cmd = lookupCommandByBytes(bytes(name.buf[:name.len]))
+        if processCommand(c, cmd) == REDIS_OK:
+            resetClient(c)
+        else:
+            freeClientArgv(c)
+    c.argv, c.reqtype, c.multibulklen, c.bulklen = partial
+    addReplyDeferredProtocolError(c)
+    server.current_client = None
 
+def addReplyDeferredProtocolError(c: 'RedisClient') -> None:
+    """前面的命令都执行完并且不再等待转发的回复之后, 回复解析时遇到的协议错误并关闭连接"""
+    if c.protoerr and not c.argv_queue and not (c.flags & REDIS_BLOCKED):
+        addReplyError(c, c.protoerr)
+        c.protoerr = ''
+        c.flags |= REDIS_CLOSE_AFTER_REPLY
 
-def readQueryFromClient(el: aeEventLoop, fd: int, privdata: 'RedisClient', mask: int) -> None:
-    from .redis import freeClient
+
+def deferClientCommands(c: 'RedisClient') -> None:
+    server = get_server()
+    if c.flags & REDIS_PENDING_COMMAND:
+        return
+    c.flags |= REDIS_PENDING_COMMAND
+    server.clients_pending_commands.append(c)
+    server.stat_client_budget_deferrals += 1
+
+def processClientsWithPendingCommands() -> int:
+    """排队的客户端轮流执行一轮配额的命令, 还有剩余的重新排到队尾, 返回处理的客户端数量"""
+    server = get_server()
+    pending = server.clients_pending_commands
+    processed = len(pending)
+    for _ in range(processed):
+        c = pending.popleft()
+        c.flags &= ~REDIS_PENDING_COMMAND
+        if c.argv_queue and not (c.flags & (REDIS_BLOCKED|REDIS_CLOSE_ASAP)):
+            processPendingCommands(c)
+    return processed
+
+def _getReadBuffer() -> sds:
+    try:
+        return readBufferPool.pop()
+    except IndexError:
+        return sdsMakeRoomFor(sdsempty(), REDIS_IOBUF_LEN)
+
+def releaseClientReadBuffer(c: 'RedisClient') -> None:
+    """处理完读取的数据之后调用, 数据都已经被消费时把借来的 querybuf 还回 readBufferPool"""
+    qb = c.pooled_querybuf
+    if qb is None:
+        return
+    c.pooled_querybuf = None
+    # 缓冲区被大参数直接使用了, 或者还有没处理完的数据, 这时缓冲区归客户端所有
+    if c.querybuf is not qb or sdslen(qb) > 0:
+        return
+    c.querybuf = sdsempty()
+    if len(readBufferPool) < READ_BUFFER_POOL_SIZE and sdsAllocSize(qb) <= 2*REDIS_IOBUF_LEN+1:
+        readBufferPool.append(qb)
+
+def readQueryFromSocket(c: 'RedisClient') -> int:
+    """从套接字读取数据到 c.querybuf, 出错或者连接关闭时返回 REDIS_ERR, 客户端需要释放
+
+    除了 readBufferPool 不会修改客户端以外的状态, 可以在 I/O 线程中调用
+    """
     server = get_server()
-    c = server.current_client = privdata
     readlen = REDIS_IOBUF_LEN
-    if (c.reqtype == REDIS_REQ_MULTIBULK and c.multibulklen != -1
-        and c.bulklen >= REDIS_MBULK_BIG_ARG):
+    big_arg = (c.reqtype == REDIS_REQ_MULTIBULK and c.multibulklen != -1
+               and c.bulklen >= REDIS_MBULK_BIG_ARG)
+    if big_arg:
         remaining = c.bulklen+2 - sdslen(c.querybuf)
         if remaining < readlen:
             readlen = remaining
@@ -391,74 +640,165 @@ def readQueryFromClient(el: aeEventLoop, fd: int, privdata: 'RedisClient', mask:
     qlen = sdslen(c.querybuf)
     if c.querybuf_peak < qlen:
         c.querybuf_peak = qlen
+    if qlen == 0 and not big_arg and c.pooled_querybuf is None:
+        c.querybuf = c.pooled_querybuf = _getReadBuffer()
     c.querybuf = sdsMakeRoomFor(c.querybuf, readlen)
-    sock = SocketCache.get(fd)
-    chunk = sock.recv(readlen)
-    nread = len(chunk)
+    sock = c.fd
+    try:
+        # 直接读到 querybuf 的空闲空间中, 不创建中间的 bytes 对象
+        nread = sock.recv_into(memoryview(c.querybuf.buf)[qlen:], readlen)   # type: ignore
+    except BlockingIOError:
+        return REDIS_OK
+    except OSError as e:
+        logger.info("Reading from client: %s", e)
+        return REDIS_ERR
     if nread:
-        c.querybuf[qlen:qlen+nread] = chunk
         sdsIncrLen(c.querybuf, nread)
         c.lastinteraction = server.unixtime
     else:
-        server.current_client = None
-        return
+        logger.info("Client closed connection")
+        return REDIS_ERR
     if sdslen(c.querybuf) > server.client_max_querybuf_len:
         logger.warning('Closing client that reached max query buffer length: %s', c)
+        return REDIS_ERR
+    return REDIS_OK
+
+def readQueryFromClient(el: aeEventLoop, fd: int, privdata: 'RedisClient', mask: int) -> None:
+    from .redis import freeClient
+    server = get_server()
+    c = privdata
+    # 上一次读取的命令还没有执行完, 先不读取新的数据
+    if c.flags & REDIS_PENDING_COMMAND:
+        return
+    if postponeClientRead(c):
+        return
+    server.current_client = c
+    if readQueryFromSocket(c) != REDIS_OK:
         freeClient(c)
+        return
     processInputBuffer(c)
+    releaseClientReadBuffer(c)
     server.current_client = None
 
-def sendReplyToClient(ae: aeEventLoop, fd: int, privdata: 'RedisClient', mask: int):
+def _writevToClient(c: 'RedisClient', sock: socket.socket) -> int:
+    """用一次 sendmsg 发送 c.buf 和尽可能多的回复链表节点, 返回写入的字节数"""
+    iov = []
+    iovbytes = 0
+    offset = c.sentlen
+    if c.bufpos > 0:
+        iov.append(memoryview(c.buf)[offset:c.bufpos])
+        iovbytes += c.bufpos - offset
+        offset = 0
+    ln = listFirst(c.reply)
+    while ln and len(iov) < IOV_MAX and iovbytes < ServerConfig.REDIS_MAX_WRITE_PER_EVENT:
+        o = listNodeValue(ln)
+        objlen = sdslen(o.ptr)
+        if objlen > offset:
+            iov.append(memoryview(o.ptr.buf)[offset:objlen])
+            iovbytes += objlen - offset
+        offset = 0
+        ln = ln.next
+    nwritten = sock.sendmsg(iov)
+    # 释放 memoryview, 之后回复缓冲区还可能被扩容
+    for v in iov:
+        v.release()
+
+    # sentlen 总是 c.buf 或者第一个节点中已经发送的字节数
+    remaining = nwritten
+    if c.bufpos > 0:
+        n = min(remaining, c.bufpos - c.sentlen)
+        c.sentlen += n
+        remaining -= n
+        if c.sentlen < c.bufpos:
+            return nwritten
+        c.bufpos = 0
+        c.sentlen = 0
+    while listLength(c.reply):
+        ln = listFirst(c.reply)
+        o = listNodeValue(ln)   # type: ignore
+        objlen = sdslen(o.ptr)
+        if remaining < objlen - c.sentlen:
+            c.sentlen += remaining
+            break
+        remaining -= objlen - c.sentlen
+        c.sentlen = 0
+        c.reply_bytes -= getStringObjectSdsUsedMemory(o)
+        listDelNode(c.reply, ln)   # type: ignore
+    return nwritten
+
+def writeToClient(c: 'RedisClient', handler_installed: int) -> int:
+    """把回复写入套接字, 写不完的部分留到下次, 客户端被释放时返回 REDIS_ERR"""
     from .redis import freeClient
-    c = privdata
     totwritten = 0
-    sock = SocketCache.get(fd)
+    sock: socket.socket = c.fd   # type: ignore
     server = get_server()
     err = None
-    while c.bufpos > 0 or listLength(c.reply):
-        if c.bufpos > 0:
-            try:
-                sock.sendall(memoryview(c.buf)[:c.bufpos])
-            except OSError as e:
-                err = e
-                break
-            totwritten += len(c.buf)
-            c.sentlen += len(c.buf)
-            c.bufpos = 0
-            c.sentlen = 0
-        else:
-            o = listNodeValue(listFirst(c.reply))  # type: ignore
-            objlen = sdslen(o.ptr)
-            objmem = getStringObjectSdsUsedMemory(o)
-            if objlen == 0:
-                listDelNode(c.reply, listFirst(c.reply))  # type: ignore
-                c.reply_bytes -= objmem
-                continue
-            try:
-                sock.sendall(o.ptr.content)
-            except OSError as e:
-                err = e
-                break
-            totwritten += objlen
-            c.sentlen += objlen
-            if c.sentlen == objlen:
-                listDelNode(c.reply, listFirst(c.reply))  # type: ignore
-                c.sentlen = 0
-                c.reply_bytes -= objmem
+    while clientHasPendingReplies(c):
+        # 非阻塞套接字可能只写入一部分, sentlen 记录已经写入的位置
+        try:
+            nwritten = _writevToClient(c, sock)
+        except OSError as e:
+            err = e
+            break
+        totwritten += nwritten
         if (totwritten > ServerConfig.REDIS_MAX_WRITE_PER_EVENT and
             (server.maxmemory == 0 or zmalloc_used_memory() < server.maxmemory)):
             break
     if err and err.errno != errno.EAGAIN:
         logger.info("Error writing to client: %s", err)
         freeClient(c)
+        return REDIS_ERR
     if totwritten > 0 and not (c.flags & REDIS_MASTER):
         c.lastinteraction = server.unixtime
-    if c.bufpos == 0 and listLength(c.reply) == 0:
+    if not clientHasPendingReplies(c):
         c.sentlen = 0
-        aeDeleteFileEvent(server.el, c.fd.fileno(), AE_WRITABLE)   # type: ignore
+        c.obuf_soft_limit_reached_time = 0
+        if handler_installed:
+            aeDeleteFileEvent(server.el, sock.fileno(), AE_WRITABLE)
         if c.flags & REDIS_CLOSE_AFTER_REPLY:
             freeClient(c)
+            return REDIS_ERR
+    updateClientReadPause(c)
+    return REDIS_OK
+
+def updateClientReadPause(c: 'RedisClient') -> None:
+    """客户端不读取回复时, 未发送的回复超过高水位就暂停读取它的命令, 降到低水位以下再恢复"""
+    server = get_server()
+    if c.flags & REDIS_READ_PAUSED:
+        if getClientOutputBufferMemoryUsage(c) > server.client_read_pause_low:
+            return
+        if aeCreateFileEvent(server.el, c.fd.fileno(), AE_READABLE, readQueryFromClient, c) == AE_ERR:   # type: ignore
+            freeClientAsync(c)
+            return
+        c.flags &= ~REDIS_READ_PAUSED
+        server.paused_reading_clients -= 1
+    elif (server.client_read_pause_high and not (c.flags & REDIS_MASTER)
+          and getClientOutputBufferMemoryUsage(c) > server.client_read_pause_high):
+        aeDeleteFileEvent(server.el, c.fd.fileno(), AE_READABLE)   # type: ignore
+        c.flags |= REDIS_READ_PAUSED
+        server.paused_reading_clients += 1
 
+def sendReplyToClient(ae: aeEventLoop, fd: int, privdata: 'RedisClient', mask: int):
+    writeToClient(privdata, 1)
+
+def handleClientsWithPendingWrites() -> int:
+    """在进入事件循环之前直接写入回复, 写不完时才注册写事件"""
+    server = get_server()
+    pending = server.clients_pending_write
+    if not pending:
+        return 0
+    server.clients_pending_write = []
+    for c in pending:
+        c.flags &= ~REDIS_PENDING_WRITE
+        # 即将被关闭的客户端不需要再写入
+        if c.flags & REDIS_CLOSE_ASAP:
+            continue
+        if writeToClient(c, 0) == REDIS_ERR:
+            continue
+        if (clientHasPendingReplies(c) and
+            aeCreateFileEvent(server.el, c.fd.fileno(), AE_WRITABLE, sendReplyToClient, c) == AE_ERR):
+            freeClientAsync(c)
+    return len(pending)
 
 def dupClientReplyValue(o: redisObject) -> redisObject:
     incrRefCount(o)
@@ -476,24 +816,23 @@ def acceptCommonHandler(fd: socket.socket, flags: int) -> None:
         fd.close()
         return
 
-    if len(server.clients) > server.maxclients:
+    if listLength(server.clients) > server.maxclients:
         err = b"-ERR max number of clients reached\r\n"
         fd.sendall(err)
         server.stat_rejected_conn += 1
         freeClient(c)
         return
-    server.stat_numcommands += 1
+    server.stat_numconnections += 1
     c.flags |= flags
     # fd.sendall(b'Hello world!\r\n')   # NOTE: test
 
-def acceptTcpHandler(el: aeEventLoop, fd: int, privdata, mask: int):
+def acceptTcpHandler(el: aeEventLoop, fd: int, privdata: socket.socket, mask: int):
     max_ = MAX_ACCEPTS_PER_CALL
 
     while max_:
         max_ -= 1
-        sfd = SocketCache.get(fd)
         try:
-            cfd, addr = anetTcpAccept(sfd)
+            cfd, addr = anetTcpAccept(privdata)
         except OSError as e:
             if e.errno == errno.EWOULDBLOCK:
                 logger.warning("Accepting client connection: %s", e)
@@ -501,5 +840,81 @@ def acceptTcpHandler(el: aeEventLoop, fd: int, privdata, mask: int):
         logger.info('Accepted %s:%s', *addr)
         acceptCommonHandler(cfd, 0)
 
-def acceptUnixHandler(*args):
-    pass
+def acceptUnixHandler(el: aeEventLoop, fd: int, privdata: socket.socket, mask: int):
+    max_ = MAX_ACCEPTS_PER_CALL
+
+    while max_:
+        max_ -= 1
+        try:
+            cfd, _ = anetUnixAccept(privdata)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.warning("Accepting client connection: %s", e)
+            return
+        logger.info('Accepted connection to %s', get_server().unixsocket)
+        acceptCommonHandler(cfd, REDIS_UNIX_SOCKET)
+
+
+### threaded I/O ###
+
+# I/O 线程池, 主线程也会处理一部分客户端, 所以只有 io_threads_num - 1 个线程
+io_threads: Opt[ThreadPoolExecutor] = None
+
+def initThreadedIO() -> None:
+    global io_threads
+    server = get_server()
+    if server.io_threads_num <= 1:
+        return
+    io_threads = ThreadPoolExecutor(server.io_threads_num - 1, thread_name_prefix='io_thd')
+
+def postponeClientRead(c: 'RedisClient') -> int:
+    """开启了线程读取时, 把客户端放入 clients_pending_read, 在 beforeSleep 中批量读取"""
+    server = get_server()
+    if (io_threads and server.io_threads_do_reads
+        and not (c.flags & (REDIS_MASTER|REDIS_SLAVE|REDIS_PENDING_READ))):
+        c.flags |= REDIS_PENDING_READ
+        server.clients_pending_read.append(c)
+        return 1
+    return 0
+
+def readQueryFromClientsIO(clients: List['RedisClient']) -> List['RedisClient']:
+    """读取并解析一组客户端的命令, 在 I/O 线程中执行, 返回需要释放的客户端"""
+    failed = []
+    for c in clients:
+        if readQueryFromSocket(c) != REDIS_OK:
+            failed.append(c)
+            continue
+        processInputBuffer(c)
+        releaseClientReadBuffer(c)
+    return failed
+
+def handleClientsWithPendingReadsUsingThreads() -> int:
+    from .redis import freeClient
+    server = get_server()
+    pending = server.clients_pending_read
+    if not pending:
+        return 0
+    server.clients_pending_read = []
+    # 按 I/O 线程的数量分组, 第一组由主线程自己处理
+    nthreads = server.io_threads_num
+    groups = [pending[i::nthreads] for i in range(nthreads)]
+    futures = [io_threads.submit(readQueryFromClientsIO, g) for g in groups[1:] if g]  # type: ignore
+    failed = readQueryFromClientsIO(groups[0])
+    for f in futures:
+        failed.extend(f.result())
+    for c in failed:
+        c.flags &= ~REDIS_PENDING_READ
+        freeClient(c)
+    for c in pending:
+        if not (c.flags & REDIS_PENDING_READ):
+            continue
+        c.flags &= ~REDIS_PENDING_READ
+        # 暂停结束时 clientsArePaused 把客户端放入 unblocked_clients, 再执行解析好的命令
+        if not (c.flags & REDIS_SLAVE) and clientsArePaused():
+            continue
+        processPendingCommands(c)
+        # 等待读取期间产生的回复还没有放入 clients_pending_write
+        if c.fd and clientHasPendingReplies(c):
+            clientInstallWriteHandler(c)
+    return len(pending)
@@ -1,6 +1,6 @@
 # -*- coding:utf-8 -*-
 
-import time
+from .clock import mstime
 import struct
 from typing import Any, Union, Callable, Optional as Opt, List
 from .csix import *
@@ -38,6 +38,7 @@ __all__ = [
     'dictDisableResize',
     'dictRehash',
     'dictRehashMilliseconds',
+    'dictIsRehashing',
     'dictSetHashFunctionSeed',
     'dictGetHashFunctionSeed',
     'dictScan',
@@ -272,16 +273,19 @@ def dictRehash(d: rDict, n: int) -> int:
 
 
 def timeInMilliseconds() -> int:
-    return int(time.time() * 1000)
+    return mstime()
 
 
 def dictRehashMilliseconds(d: rDict, ms: int) -> int:
+    from .latency import latencyAddSampleIfNeeded
     start = timeInMilliseconds()
     rehashes = 0
     while dictRehash(d, 100):
         rehashes += 100
         if timeInMilliseconds() - start > ms:
             break
+    # 一步 rehash 的桶里可能有很多键, 实际耗时可能远超 ms
+    latencyAddSampleIfNeeded("dict-rehash", timeInMilliseconds() - start)
     return rehashes
 
 def _dictRehashStep(d: rDict) -> None:
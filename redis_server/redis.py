@@ -10,36 +10,51 @@ import socket
 import sys
 import platform
 import argparse
-from typing import List, Callable, Optional as Opt, Tuple, BinaryIO, Dict
-from dataclasses import dataclass
+import asyncio
+import signal
+import copy
+import gc
+from typing import List, Callable, Optional as Opt, Tuple, BinaryIO, Dict, Coroutine, Deque, Union
+from dataclasses import dataclass, field
 from io import BufferedWriter
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from itertools import chain
 
-from .csix import timeval, int2cstr, zfree
+from .csix import int2cstr, zfree
+from .clock import ustime, mstime, getMonotonicUs
 from .ae import (
-    AE_WRITABLE, aeDeleteFileEvent, aeEventLoop, aeSetBeforeSleepProc, aeMain, aeDeleteEventLoop, aeCreateEventLoop,
-    aeCreateTimeEvent, aeCreateFileEvent, AE_ERR, AE_READABLE,
+    AE_WRITABLE, aeDeleteFileEvent, aeEventLoop, aeSetBeforeSleepProc, aeSetAfterSleepProc, aeMain, aeDeleteEventLoop, aeCreateEventLoop,
+    aeCreateTimeEvent, aeCreateFileEvent, AE_ERR, AE_READABLE, aeGetApiName, aeSetDontWait,
 )
+from .ae_api import aeApiBackends, aeApiHostedBackends
+from .ae_asyncio import aeAsyncioMain
 from .anet import anetTcp6Server, anetTcpServer, anetNonBlock, anetUnixServer, anetEnableTcpNoDelay, anetKeepAlive
 from .config import ServerConfig as Conf
 from .config import *
 from .adlist import (
     listDelNode, listRelease, listSearchKey, rList, listCreate, listSetFreeMethod, listSetDupMethod, listSetMatchMethod,
-    listLength,
+    listLength, listAddNodeTail, listLast, listFirst, listNodeValue, listRotate, listNode,
 )
 from .rdict import *
-from .sds import sds, sdsempty, sdsfree, sdsnew
+from .sds import sds, sdsempty, sdsfree, sdsnew, sdslen, sdsAllocSize, sdsavail, sdsRemoveFreeSpace
 from .robject import *
 from .db import RedisDB, dbDictType, keyptrDictType, keylistDictType, setDictType, evictionPoolAlloc
 from .pubsub import freePubsubPattern, listMatchPubsubPattern
 from .aof import aofRewriteBufferReset
 from .networking import (
     acceptTcpHandler, acceptUnixHandler, freeClientArgv, readQueryFromClient, dupClientReplyValue,
-    listMatchObjects,
+    initThreadedIO, handleClientsWithPendingReadsUsingThreads, processInputBuffer,
+    processPendingCommands, handleClientsWithPendingWrites, freeClientsInAsyncFreeQueue,
+    asyncCloseClientOnOutputBufferLimitReached, processClientsWithPendingCommands, addReplyDeferredProtocolError,
 )
-from .multi import initClientMultiState
-from .util import Singleton, ll2string, get_server
+from .slowlog import slowlogEntry, slowlogInit, slowlogPushEntryIfNeeded
+from .histogram import hdrCreate, hdrRecordValue
+from .latency import (
+    latencyTimeSeries, latencyMonitorInit, latencyAddSampleIfNeeded, latencyStartMonitor, latencyEndMonitor,
+    latencyGcCallback, latencyFlushGcPause,
+)
+from .shard import shardInit, shardForwardCommand, unblockClientWaitingShard
+from .util import Singleton, ll2string, get_server, memtoll, zmalloc_get_rss
 from .commands import *
 
 __version__ = '0.0.1'
@@ -71,15 +86,24 @@ class blockingState:
         self.numreplicas: int = 0
         # // 复制偏移量
         self.reploffset: int = 0
+        # 等待其他 worker 回复时使用的连接
+        self.link = None
 
 class clientBufferLimitsConfig:
-    def __init__(self):
+    def __init__(self, hard_limit_bytes: int = 0, soft_limit_bytes: int = 0, soft_limit_seconds: int = 0):
         # 硬限制
-        self.hard_limit_bytes: int = 0
+        self.hard_limit_bytes: int = hard_limit_bytes
         # 软限制
-        self.soft_limit_bytes: int = 0
+        self.soft_limit_bytes: int = soft_limit_bytes
         # 软限制时限
-        self.soft_limit_seconds: int = 0
+        self.soft_limit_seconds: int = soft_limit_seconds
+
+# 普通客户端, 从服务器, pubsub 客户端的默认限制
+clientBufferLimitsDefaults = [
+    clientBufferLimitsConfig(0, 0, 0),
+    clientBufferLimitsConfig(1024*1024*256, 1024*1024*64, 60),
+    clientBufferLimitsConfig(1024*1024*32, 1024*1024*8, 60),
+]
 
 @dataclass
 class redisOp:
@@ -93,7 +117,7 @@ class redisOp:
 
 @dataclass
 class redisOpArray:
-    ops: redisOp = redisOp()
+    ops: redisOp = field(default_factory=redisOp)
     numops: int = 0
 
 @dataclass
@@ -110,7 +134,25 @@ class RedisServer(Singleton):
         self.db: List[RedisDB] = []
         self.commands: dict = {}   # 命令表（受到 rename 配置选项的作用）
         self.orig_commands: dict = {}   # 命令表（无 rename 配置选项的作用）
+        # 以命令名的原始字节为键的命令表, 缓存客户端用过的大小写写法
+        self.command_lookup: Dict[bytes, redisCommand] = {}
         self.el: aeEventLoop = None   # 事件状态
+        # 多路复用后端的名字, 为空时自动选择最优的后端
+        self.ae_backend: str = ''
+        # I/O 线程的数量(包括主线程), 为 1 时不使用 I/O 线程
+        self.io_threads_num: int = 1
+        # 是否使用 I/O 线程读取和解析命令
+        self.io_threads_do_reads: int = 0
+        # worker 进程的数量, 大于 1 时每个 worker 负责一部分 hash slot
+        self.workers_num: int = 1
+        self.worker_id: int = 0
+        # 接收其他 worker 转发命令的 unix socket
+        self.shard_sofd: Opt[socket.socket] = None
+        # worker id -> 到这个 worker 的连接
+        self.shard_links: dict = {}
+        # 字符串对象缓存的 bulk 回复占用的内存和上限, 上限为 0 时不缓存
+        self.resp_cache_memory: int = 0
+        self.resp_cache_max_memory: int = Conf.REDIS_DEFAULT_RESP_CACHE_MAX_MEMORY
         self.lruclock: int = 0   # /* Clock for LRU eviction */
         # 关闭服务器的标识
         self.shutdown_asap: int = 0      # /* SHUTDOWN needed ASAP */
@@ -121,6 +163,7 @@ class RedisServer(Singleton):
         self.arch_bits: int = 0            # /* 32 or 64 depending on sizeof(long) */
         # serverCron() 函数的运行次数计数器
         self.cronloops: int = 0            # /* Number of times the cron function run */
+        self.rehash_db: int = 0            # databasesCron 下一个 rehash 的数据库
         # 本服务器的 RUN ID
         self.runid: str = ''    # /* ID always different at every exec. */
         # 服务器是否运行在 SENTINEL 模式
@@ -145,9 +188,21 @@ class RedisServer(Singleton):
         self.cfd: List[int] = []    # /* Cluster bus listening socket */
         self.cfd_count = 0                  # /* Used slots in cfd[] */
         # 一个链表，保存了所有客户端状态结构
-        self.clients: list = []                  # /* List of active clients */
+        self.clients: rList = listCreate()       # /* List of active clients */
         # 链表，保存了所有待关闭的客户端
         self.clients_to_close: list = []         # /* Clients to close asynchronously */
+        # 每个客户端每一轮事件循环最多执行的命令数量, 0 表示不限制
+        self.client_command_budget: int = Conf.REDIS_DEFAULT_CLIENT_COMMAND_BUDGET
+        # 用完了配额还有命令没有执行的客户端, 在 beforeSleep 中轮流执行
+        self.clients_pending_commands: Deque[RedisClient] = deque()
+        # 未发送的回复超过 high 时暂停读取客户端, 降到 low 以下时恢复, high 为 0 表示不暂停
+        self.client_read_pause_high: int = Conf.REDIS_DEFAULT_CLIENT_READ_PAUSE_HIGH
+        self.client_read_pause_low: int = Conf.REDIS_DEFAULT_CLIENT_READ_PAUSE_LOW
+        # 当前暂停读取的客户端数量
+        self.paused_reading_clients: int = 0
+        # 等待 I/O 线程读取的客户端
+        self.clients_pending_read: list = []     # /* Client has pending read socket buffers. */
+        self.clients_pending_write: list = []    # /* There is to write or install handler. */
         # 链表，保存了所有从服务器，以及所有监视器
         self.slaves: list = []
         self.monitors: list = []        # /* List of slaves and MONITORs */
@@ -223,11 +278,21 @@ class RedisServer(Singleton):
         # PSYNC 执行失败的次数
         #  Number of unaccepted PSYNC requests.
         self.stat_sync_partial_err: int = 0
+        # 直接使用缓存的 bulk 回复的次数
+        self.stat_resp_cache_hits: int = 0
+        # 因为超过输出缓冲区限制而关闭的客户端数量
+        self.stat_client_obuf_limit_disconnections: int = 0
+        # 客户端因为用完命令配额而推迟执行的次数
+        self.stat_client_budget_deferrals: int = 0
+        # 回复给客户端的错误数量
+        self.stat_total_error_replies: int = 0
+        # 是否为每个命令记录延迟直方图
+        self.latency_tracking: int = 0
 
         #  slowlog
         # 保存了所有慢查询日志的链表
         #  SLOWLOG list of commands
-        self.slowlog = None
+        self.slowlog: Deque[slowlogEntry] = deque()
         # 下一条慢查询日志的 ID
         #  SLOWLOG current entry ID
         self.slowlog_entry_id: int = 0
@@ -237,6 +302,9 @@ class RedisServer(Singleton):
         # 服务器配置 slowlog-max-len 选项的值
         #  SLOWLOG max number of items logged
         self.slowlog_max_len = 0
+        # 延迟监视器: 超过 latency-monitor-threshold 毫秒的事件按类别记录在这里
+        self.latency_events: Dict[str, latencyTimeSeries] = {}
+        self.latency_monitor_threshold: int = 0
         #  RSS sampled in serverCron().
         self.resident_set_size = 0
         #  The following two are used to track instantaneous "load" in terms* of operations per second.
@@ -412,6 +480,8 @@ class RedisServer(Singleton):
         self.unixtime: int = 0
         #  Like 'unixtime' but with milliseconds resolution.
         self.mstime: int = 0
+        #  Like 'unixtime' but with microseconds resolution.
+        self.ustime: int = 0
 
         #  Pubsub
         # 字典，键为频道，值为链表
@@ -451,6 +521,17 @@ class RedisServer(Singleton):
 
 
 class RedisClient(object):   # pylint: disable=all
+    # 连接很多并且频繁建立和断开, 用 __slots__ 减少每个客户端的内存和创建开销
+    __slots__ = (
+        'fd', 'db', 'dictid', 'name', 'querybuf', 'qb_pos', 'querybuf_peak', 'pooled_querybuf', 'argv',
+        'argv_queue', 'protoerr', 'cmd', 'lastcmd', 'reqtype', 'multibulklen', 'bulklen', 'reply',
+        'reply_bytes', 'sentlen', 'ctime', 'lastinteraction', 'obuf_soft_limit_reached_time', 'flags',
+        'authenticated', 'replstate', 'repldbfd', 'repldboff', 'repldbsize', 'replpreamble', 'reploff',
+        'repl_ack_off', 'repl_ack_time', 'replrunid', 'slave_listening_port', 'mstate', 'btype', 'bpop',
+        'woff', 'watched_keys', 'pubsub_channels', 'pubsub_patterns', 'peerid', 'bufpos', 'buf',
+        'client_list_node',
+    )
+
     def __init__(self):
         # // 套接字描述符
         self.fd: Opt[socket.socket] = None
@@ -462,12 +543,20 @@ class RedisClient(object):   # pylint: disable=all
         self.name: redisObject = None
         # // 查询缓冲区
         self.querybuf: sds = sdsempty()
+        # querybuf 中已经解析到的位置
+        self.qb_pos: int = 0
         # // 查询缓冲区长度峰值
         self.querybuf_peak: int = 0   # /* Recent (100ms or more) peak of querybuf size */
+        # 从 readBufferPool 借来的 querybuf, 处理完读取的数据之后归还
+        self.pooled_querybuf: Opt[sds] = None
         # // 参数数量
         # int argc;
         # // 参数对象数组
         self.argv: List[redisObject] = []
+        # 已经解析出的, 等待执行的命令参数
+        self.argv_queue: List[List[redisObject]] = []
+        # 解析 argv_queue 之后的命令时遇到的协议错误, 在 argv_queue 执行完之后回复
+        self.protoerr: str = ''
         # // 记录被客户端执行的命令
         self.cmd: Opt[redisCommand] = None
         self.lastcmd: Opt[redisCommand] = None
@@ -515,17 +604,17 @@ class RedisClient(object):   # pylint: disable=all
         self.replrunid: str = ''
         # // 从服务器的监听端口号
         self.slave_listening_port: int = 0
-        # // 事务状态
-        self.mstate: multiState = multiState()
+        # // 事务状态, 执行 MULTI 时才创建
+        self.mstate: multiState = None
         # // 阻塞类型
         self.btype: int = 0
-        # // 阻塞状态
-        self.bpop: blockingState = blockingState()
+        # // 阻塞状态, 第一次阻塞时才创建
+        self.bpop: blockingState = None
         # // 最后被写入的全局复制偏移量
         self.woff: int = 0
-        # // 被监视的键
+        # // 被监视的键, 执行 WATCH 时才创建
         self.watched_keys: rList = None
-        # // 这个字典记录了客户端所有订阅的频道
+        # // 这个字典记录了客户端所有订阅的频道, 订阅时才创建
         # // 键为频道名字，值为 NULL
         # // 也即是，一个频道的集合
         self.pubsub_channels: rDict = None
@@ -539,6 +628,8 @@ class RedisClient(object):   # pylint: disable=all
         self.bufpos: int = 0
         # // 回复缓冲区
         self.buf: bytearray = bytearray(REDIS_REPLY_CHUNK_BYTES)
+        # 在 server.clients 中的节点, 释放客户端时直接删除
+        self.client_list_node: Opt[listNode] = None
 
     @property
     def argc(self) -> int:
@@ -628,8 +719,20 @@ def queueMultiCommand(c: 'RedisClient'):
     pass
 
 def lookupCommand(s: sds) -> Opt[redisCommand]:
+    return lookupCommandByBytes(bytes(s.buf[:s.len]))
+
+def lookupCommandByBytes(name: bytes) -> Opt[redisCommand]:
+    """直接用参数的字节查找命令, 不需要每次都解码和转换成小写"""
     server = get_server()
-    return server.commands.get(s.text.lower())
+    cmd = server.command_lookup.get(name)
+    if cmd is not None:
+        return cmd
+    lower = name.lower()
+    cmd = server.command_lookup.get(lower)
+    # 不存在的命令不缓存, 避免缓存被随意的输入填满
+    if cmd is not None and len(server.command_lookup) < REDIS_COMMAND_LOOKUP_CACHE_SIZE:
+        server.command_lookup[name] = cmd
+    return cmd
 
 def freeMemoryIfNeeded() -> int:
     # TODO(rlj): something to do.
@@ -640,10 +743,27 @@ def call(c: RedisClient, flag: int):
     client_old_flags = c.flags
     c.flags &= ~(REDIS_FORCE_AOF|REDIS_FORCE_REPL)
     dirty = server.dirty
-    start = timeval.from_datetime().ustime
-    c.cmd.proc(c)
-    duration = timeval.from_datetime().ustime - start
+    errors = server.stat_total_error_replies
+    cmd = c.cmd
+    assert cmd
+    start = getMonotonicUs()
+    cmd.proc(c)
+    duration = getMonotonicUs() - start
     dirty = server.dirty - dirty
+    # 命令统计, 执行过程中回复了错误的命令计为失败
+    cmd.calls += 1
+    cmd.microseconds += duration
+    if server.stat_total_error_replies != errors:
+        cmd.failed_calls += 1
+    if server.latency_tracking:
+        if cmd.latency_histogram is None:
+            cmd.latency_histogram = hdrCreate()
+        hdrRecordValue(cmd.latency_histogram, duration)
+    # EXEC 执行的命令已经分别记录过了
+    if flag & REDIS_CALL_SLOWLOG and cmd.proc != execCommand:
+        if server.latency_monitor_threshold:
+            latencyAddSampleIfNeeded("fast-command" if cmd.flags & REDIS_CMD_FAST else "command", duration // 1000)
+        slowlogPushEntryIfNeeded(c, c.argv, duration)
     c.flags &= ~(REDIS_FORCE_AOF|REDIS_FORCE_REPL)
     c.flags |= client_old_flags & (REDIS_FORCE_AOF|REDIS_FORCE_REPL)
     server.stat_numcommands += 1
@@ -652,32 +772,47 @@ def handleClientsBlockedOnLists():
     # TODO(rlj): something to do.
     pass
 
-def processCommand(c: RedisClient) -> int:
-    from .networking import addReply, addReplyError
+def rejectCommand(c: RedisClient, err: Union[str, redisObject]) -> None:
+    """命令在执行之前被拒绝, 计入命令的 rejected_calls"""
+    from .networking import addReplyError, addReplyErrorObject
+    if c.cmd:
+        c.cmd.rejected_calls += 1
+    if isinstance(err, str):
+        addReplyError(c, err)
+    else:
+        addReplyErrorObject(c, err)
+
+def processCommand(c: RedisClient, cmd: Opt[redisCommand] = None) -> int:
+    """执行 c.argv 中的命令, cmd 不为 None 时表示调用者已经查找好了命令"""
+    from .networking import addReply
     server = get_server()
     shared = sharedObjects()
-    if c.argv[0].ptr.lowereq('quit'):
+    name = c.argv[0].ptr
+    if name.len == 4 and name.lowereq('quit'):
         addReply(c, shared.ok)
         c.flags |= REDIS_CLOSE_AFTER_REPLY
         return REDIS_ERR
 
-    c.cmd = c.lastcmd = lookupCommand(c.argv[0].ptr)
+    c.cmd = c.lastcmd = cmd or lookupCommand(c.argv[0].ptr)
     if not c.cmd:
-        addReplyError(c, "unknown command '%s'" % c.argv[0].ptr.text)
+        rejectCommand(c, "unknown command '%s'" % c.argv[0].ptr.text)
         return REDIS_OK
     elif (c.cmd.arity > 0 and (c.cmd.arity != c.argc)) or (c.argc < -c.cmd.arity):
-        addReplyError(c, "wrong number of arguments for '%s' command" % c.cmd.name)
+        rejectCommand(c, "wrong number of arguments for '%s' command" % c.cmd.name)
         return REDIS_OK
     if server.requirepass and (not c.authenticated) and c.cmd.proc != authCommand:
-        addReply(c, shared.noautherr)
+        rejectCommand(c, shared.noautherr)
+        return REDIS_OK
+    # 键属于其他 worker 时转发给它
+    if server.workers_num > 1 and shardForwardCommand(c):
         return REDIS_OK
     if server.maxmemory:
         retval = freeMemoryIfNeeded()
         if (c.cmd.flags & REDIS_CMD_DENYOOM) and retval == REDIS_ERR:
-            addReply(c, shared.oomerr)
+            rejectCommand(c, shared.oomerr)
             return REDIS_OK
     if server.loading and (not (c.cmd.flags & REDIS_CMD_LOADING)):
-        addReply(c, shared.loadingerr)
+        rejectCommand(c, shared.loadingerr)
         return REDIS_OK
     if ((c.flags & REDIS_MULTI) and
         c.cmd.proc not in [execCommand, discardCommand, multiCommand, watchCommand]):
@@ -701,9 +836,10 @@ def createClient(server: RedisServer, fd: Opt[socket.socket]) -> Opt[RedisClient
     c = RedisClient()
     if fd:
         anetNonBlock(fd)
-        anetEnableTcpNoDelay(fd)
-        if server.tcpkeepalive:
-            anetKeepAlive(fd, server.tcpkeepalive)
+        if fd.family != socket.AF_UNIX:
+            anetEnableTcpNoDelay(fd)
+            if server.tcpkeepalive:
+                anetKeepAlive(fd, server.tcpkeepalive)
         if (aeCreateFileEvent(server.el, fd.fileno(), AE_READABLE, readQueryFromClient, c) == AE_ERR):
             fd.close()
             return None
@@ -722,27 +858,54 @@ def createClient(server: RedisServer, fd: Opt[socket.socket]) -> Opt[RedisClient
     listSetDupMethod(c.reply, dupClientReplyValue)
     # // 阻塞类型
     c.btype = REDIS_BLOCKED_NONE
-    # // 造成客户端阻塞的列表键
-    c.bpop.keys = dictCreate(setDictType, None)
-    # // 在解除阻塞时将元素推入到 target 指定的键中
-    # // BRPOPLPUSH 命令时使用
-    # // 进行事务时监视的键
-    c.watched_keys = listCreate()
-    # // 订阅的频道和模式
-    c.pubsub_channels = dictCreate(setDictType, None)
-    c.pubsub_patterns = listCreate()
-    listSetFreeMethod(c.pubsub_patterns, decrRefCountVoid)
-    listSetMatchMethod(c.pubsub_patterns, listMatchObjects)
+    # 阻塞, 事务, 监视和订阅的状态在第一次使用时才创建, 短连接不需要为它们付出代价
     # // 如果不是伪客户端，那么添加到服务器的客户端链表中
     if fd:
-        server.clients.append(c)
-    # // 初始化客户端的事务状态
-    initClientMultiState(c)
+        listAddNodeTail(server.clients, c)
+        c.client_list_node = listLast(server.clients)
     return c
 
-def unblockClient(c: RedisClient):
-    # TODO(rlj): something to do.
-    pass
+def getClientBlockingState(c: RedisClient) -> blockingState:
+    """客户端第一次阻塞时才创建阻塞状态"""
+    if c.bpop is None:
+        c.bpop = blockingState()
+        # // 造成客户端阻塞的列表键
+        c.bpop.keys = dictCreate(setDictType, None)
+    return c.bpop
+
+def blockClient(c: RedisClient, btype: int) -> None:
+    server = get_server()
+    getClientBlockingState(c)
+    c.flags |= REDIS_BLOCKED
+    c.btype = btype
+    server.bpop_blocked_clients += 1
+
+def unblockClient(c: RedisClient) -> None:
+    server = get_server()
+    if c.btype == REDIS_BLOCKED_SHARD:
+        unblockClientWaitingShard(c)
+    # NOTE: 暂时不支持 BLPOP 和 WAIT
+    c.flags &= ~REDIS_BLOCKED
+    c.flags |= REDIS_UNBLOCKED
+    c.btype = REDIS_BLOCKED_NONE
+    server.bpop_blocked_clients -= 1
+    server.unblocked_clients.append(c)
+
+def processUnblockedClients() -> None:
+    # 继续处理解除阻塞的客户端已经收到的命令
+    server = get_server()
+    while server.unblocked_clients:
+        c = server.unblocked_clients.pop(0)
+        c.flags &= ~REDIS_UNBLOCKED
+        if c.argv_queue:
+            processPendingCommands(c)
+        else:
+            addReplyDeferredProtocolError(c)
+        # 阻塞期间收到的命令
+        if c.querybuf and sdslen(c.querybuf) > 0:
+            server.current_client = c
+            processInputBuffer(c)
+            server.current_client = None
 
 def freeClientMultiState(c: RedisClient):
     # TODO(rlj): something to do.
@@ -755,7 +918,8 @@ def freeClient(c: RedisClient):
     c.querybuf = None   # type: ignore
     if c.flags & REDIS_BLOCKED:
         unblockClient(c)
-    dictRelease(c.bpop.keys)
+    if c.bpop:
+        dictRelease(c.bpop.keys)
     if c.fd:
         aeDeleteFileEvent(server.el, c.fd.fileno(), AE_READABLE)
         aeDeleteFileEvent(server.el, c.fd.fileno(), AE_WRITABLE)
@@ -763,13 +927,22 @@ def freeClient(c: RedisClient):
     listRelease(c.reply)
     freeClientArgv(c)
 
-    if c.fd:
-        server.clients.remove(c)
+    if c.client_list_node:
+        listDelNode(server.clients, c.client_list_node)
+        c.client_list_node = None
 
     if c.flags & REDIS_UNBLOCKED:
         server.unblocked_clients.remove(c)
     if c.flags & REDIS_CLOSE_ASAP:
         server.clients_to_close.remove(c)
+    if c.flags & REDIS_PENDING_READ:
+        server.clients_pending_read.remove(c)
+    if c.flags & REDIS_PENDING_WRITE:
+        server.clients_pending_write.remove(c)
+    if c.flags & REDIS_PENDING_COMMAND:
+        server.clients_pending_commands.remove(c)
+    if c.flags & REDIS_READ_PAUSED:
+        server.paused_reading_clients -= 1
     if c.name:
         decrRefCount(c.name)
     c.argv = []
@@ -792,13 +965,17 @@ def populateCommandTable() -> None:
         't': REDIS_CMD_STALE,
         'M': REDIS_CMD_SKIP_MONITOR,
         'k': REDIS_CMD_ASKING,
+        'F': REDIS_CMD_FAST,
     }
     for c in redisCommandTable:
         for i in c.sflags:
             c.flags |= flags_map[i]
+        compileCommandOptions(c)
         server = get_server()
         server.commands[c.name] = c
         server.orig_commands[c.name] = c
+        server.command_lookup[c.name.encode('utf8')] = c
+        server.command_lookup[c.name.upper().encode('utf8')] = c
 
 def getClientLimitClassByName(name: str) -> int:
     mapping = {
@@ -845,13 +1022,14 @@ def checkForSentinelMode() -> int:
     return 0
 
 def getLRUClock() -> int:
-    return int(int(time.time() * 1000) / REDIS_LRU_CLOCK_RESOLUTION) & REDIS_LRU_CLOCK_MAX
+    return (mstime() // REDIS_LRU_CLOCK_RESOLUTION) & REDIS_LRU_CLOCK_MAX
 
 def LRUClock() -> int:
-    server = RedisServer()
-    if not server.loading:
-        return getLRUClock()
-    return (1000/server.hz <= REDIS_LRU_CLOCK_RESOLUTION) and server.lruclock or getLRUClock()
+    server = get_server()
+    # server.lruclock 每次事件循环都会更新, 精度足够时直接使用缓存的值
+    if 1000 <= server.hz * REDIS_LRU_CLOCK_RESOLUTION:
+        return server.lruclock
+    return getLRUClock()
 
 def initServerConfig(server: RedisServer):
     ## 服务器状态
@@ -876,6 +1054,14 @@ def initServerConfig(server: RedisServer):
     server.tcpkeepalive = Conf.REDIS_DEFAULT_TCP_KEEPALIVE
     server.active_expire_enabled = 1
     server.client_max_querybuf_len = REDIS_MAX_QUERYBUF_LEN
+    server.client_command_budget = Conf.REDIS_DEFAULT_CLIENT_COMMAND_BUDGET
+    server.client_read_pause_high = Conf.REDIS_DEFAULT_CLIENT_READ_PAUSE_HIGH
+    server.client_read_pause_low = Conf.REDIS_DEFAULT_CLIENT_READ_PAUSE_LOW
+    server.resp_cache_max_memory = Conf.REDIS_DEFAULT_RESP_CACHE_MAX_MEMORY
+    server.ae_backend = ''
+    server.io_threads_num = 1
+    server.io_threads_do_reads = 0
+    server.workers_num = 1
     server.saveparams = []
     server.loading = 0
     # server.logfile = "";
@@ -907,6 +1093,8 @@ def initServerConfig(server: RedisServer):
     server.notify_keyspace_events = 0
     server.maxclients = Conf.REDIS_MAX_CLIENTS
     server.bpop_blocked_clients = 0
+    for j in range(REDIS_CLIENT_LIMIT_NUM_CLASSES):
+        server.client_obuf_limits[j] = copy.copy(clientBufferLimitsDefaults[j])
     # server.maxmemory = Conf.REDIS_DEFAULT_MAXMEMORY
     # server.maxmemory_policy = REDIS_DEFAULT_MAXMEMORY_POLICY
     # server.maxmemory_samples = Conf.REDIS_DEFAULT_MAXMEMORY_SAMPLES
@@ -955,6 +1143,8 @@ def initServerConfig(server: RedisServer):
     # 初始化慢查询日志
     server.slowlog_log_slower_than = Conf.REDIS_SLOWLOG_LOG_SLOWER_THAN;
     server.slowlog_max_len = Conf.REDIS_SLOWLOG_MAX_LEN;
+    server.latency_monitor_threshold = Conf.REDIS_DEFAULT_LATENCY_MONITOR_THRESHOLD
+    server.latency_tracking = 1
 
     # /* Debugging */
     # 初始化调试项
@@ -968,21 +1158,23 @@ def initServerConfig(server: RedisServer):
 def listenToPort(server: RedisServer) -> int:
     port = server.port
     backlog = server.tcp_backlog
+    # 多个 worker 监听同一个端口
+    reuseport = int(server.workers_num > 1)
     if not server.bindaddr:
         try:
-            s = anetTcp6Server(port, None, backlog)
+            s = anetTcp6Server(port, None, backlog, reuseport)
             anetNonBlock(s)
             server.ipfd.append(s)
         except OSError:
             pass
-        s = anetTcpServer(port, None, backlog)
+        s = anetTcpServer(port, None, backlog, reuseport)
         anetNonBlock(s)
         server.ipfd.append(s)
     for addr in server.bindaddr:
         if ':' in addr:
-            s = anetTcp6Server(port, addr, backlog)
+            s = anetTcp6Server(port, addr, backlog, reuseport)
         else:
-            s = anetTcpServer(port, addr, backlog)
+            s = anetTcpServer(port, addr, backlog, reuseport)
         server.ipfd.append(s)
         anetNonBlock(s)
     return REDIS_OK
@@ -999,17 +1191,117 @@ def resetServerStats(server: RedisServer):
     server.stat_sync_full = 0
     server.stat_sync_partial_ok = 0
     server.stat_sync_partial_err = 0
+    server.stat_resp_cache_hits = 0
+    server.stat_client_obuf_limit_disconnections = 0
+    server.stat_client_budget_deferrals = 0
+    server.stat_total_error_replies = 0
     server.ops_sec_samples = [0 for _ in range(Conf.REDIS_OPS_SEC_SAMPLES)]
     server.ops_sec_idx = 0
-    server.ops_sec_last_sample_time = int(time.time() * 1000)
+    server.ops_sec_last_sample_time = mstime()
     server.ops_sec_last_sample_ops = 0
 
 def updateCachedTime(server: RedisServer):
-    server.unixtime = int(time.time())
-    server.mstime = int(time.time() * 1000)
+    # 每次事件循环只读取一次系统时间, 其他地方都使用这里缓存的值
+    server.ustime = ustime()
+    server.mstime = server.ustime // 1000
+    server.unixtime = server.mstime // 1000
+    server.lruclock = (server.mstime // REDIS_LRU_CLOCK_RESOLUTION) & REDIS_LRU_CLOCK_MAX
 
-def serverCron(*args):
-    pass
+def afterSleep(eventLoop: aeEventLoop) -> None:
+    server = get_server()
+    updateCachedTime(server)
+    # 上一轮事件循环连续执行的时间
+    latencyAddSampleIfNeeded("event-loop", eventLoop.last_busy_us // 1000)
+    latencyFlushGcPause()
+
+def clientsCronResizeQueryBuffer(c: RedisClient) -> int:
+    server = get_server()
+    querybuf_size = sdsAllocSize(c.querybuf)
+    idletime = server.unixtime - c.lastinteraction
+    # 两种情况下缩小查询缓冲区:
+    # 1) 缓冲区大于 REDIS_MBULK_BIG_ARG, 并且比最近的峰值大很多
+    # 2) 客户端空闲, 缓冲区大于 1k
+    if ((querybuf_size > REDIS_MBULK_BIG_ARG and querybuf_size // (c.querybuf_peak+1) > 2) or
+        (querybuf_size > 1024 and idletime > 2)):
+        # 只有确实浪费了空间时才缩小
+        if sdsavail(c.querybuf) > 1024:
+            c.querybuf = sdsRemoveFreeSpace(c.querybuf)
+    # 重新开始记录下一个周期的峰值
+    c.querybuf_peak = 0
+    return 0
+
+def clientsCron(server: RedisServer) -> None:
+    """每次只检查一部分客户端, 10 秒内至少把所有客户端检查一遍"""
+    numclients = listLength(server.clients)
+    iterations = numclients // (server.hz * 10)
+    if iterations < 50:
+        iterations = min(numclients, 50)
+    while listLength(server.clients) and iterations:
+        iterations -= 1
+        # 把表尾的客户端移到表头再处理, 每次处理不同的客户端
+        listRotate(server.clients)
+        ln = listFirst(server.clients)
+        assert ln
+        c = listNodeValue(ln)
+        if c.querybuf is not None:
+            clientsCronResizeQueryBuffer(c)
+        # 没有新的回复时也要检查软限制是否超时
+        if c.reply_bytes:
+            asyncCloseClientOnOutputBufferLimitReached(c)
+
+def runWithPeriod(server: RedisServer, ms: int) -> bool:
+    """serverCron 中每 ms 毫秒执行一次的操作"""
+    return ms <= 1000 // server.hz or not server.cronloops % (ms // (1000 // server.hz))
+
+def trackOperationsPerSecond(server: RedisServer) -> None:
+    """记录一次每秒执行命令数的抽样"""
+    t = server.mstime - server.ops_sec_last_sample_time
+    ops = server.stat_numcommands - server.ops_sec_last_sample_ops
+    server.ops_sec_samples[server.ops_sec_idx] = ops * 1000 // t if t > 0 else 0
+    server.ops_sec_idx = (server.ops_sec_idx + 1) % Conf.REDIS_OPS_SEC_SAMPLES
+    server.ops_sec_last_sample_time = server.mstime
+    server.ops_sec_last_sample_ops = server.stat_numcommands
+
+def getOperationsPerSecond(server: RedisServer) -> int:
+    """最近 REDIS_OPS_SEC_SAMPLES 次抽样的平均值"""
+    return sum(server.ops_sec_samples) // Conf.REDIS_OPS_SEC_SAMPLES
+
+def incrementallyRehash(db: RedisDB) -> int:
+    """用 1 毫秒对数据库的字典做渐进式 rehash, 返回是否做了 rehash"""
+    if dictIsRehashing(db.dict):
+        dictRehashMilliseconds(db.dict, 1)
+        return 1
+    if dictIsRehashing(db.expires):
+        dictRehashMilliseconds(db.expires, 1)
+        return 1
+    return 0
+
+def databasesCron(server: RedisServer) -> None:
+    if server.activerehashing:
+        # 每次最多处理一个正在 rehash 的数据库
+        for _ in range(min(server.dbnum, Conf.REDIS_DBCRON_DBS_PER_CALL)):
+            db = server.db[server.rehash_db % server.dbnum]
+            server.rehash_db += 1
+            if incrementallyRehash(db):
+                break
+
+def serverCron(eventLoop: aeEventLoop, ident: int, clientData) -> int:
+    server = get_server()
+    updateCachedTime(server)
+    latency = latencyStartMonitor()
+    if runWithPeriod(server, 100):
+        trackOperationsPerSecond(server)
+    # 读取 RSS 比较慢, 在这里采样, 其他地方使用采样的值
+    server.resident_set_size = zmalloc_get_rss()
+    if server.resident_set_size > server.stat_peak_memory:
+        server.stat_peak_memory = server.resident_set_size
+    clientsCron(server)
+    # 关闭需要异步关闭的客户端
+    freeClientsInAsyncFreeQueue()
+    databasesCron(server)
+    latencyAddSampleIfNeeded("server-cron", latencyEndMonitor(latency))
+    server.cronloops += 1
+    return 1000 // server.hz
 
 def initServer(server: RedisServer):
     # // 设置信号处理函数
@@ -1018,10 +1310,17 @@ def initServer(server: RedisServer):
     # setupSignalHandlers();
 
     logger.info(repr(server))
-    server.el = aeCreateEventLoop(server.maxclients+REDIS_EVENTLOOP_FDSET_INCR)
+    try:
+        server.el = aeCreateEventLoop(server.maxclients+REDIS_EVENTLOOP_FDSET_INCR, server.ae_backend)
+    except (RuntimeError, OSError) as e:
+        logger.error("Failed creating the event loop. Error message: %r", e)
+        exit(1)
+    logger.info("Using the %s multiplexing backend", aeGetApiName(server.el))
     server.db = [RedisDB() for _ in range(server.dbnum)]
+    initThreadedIO()
     listenToPort(server)
-    if server.unixsocket:
+    # unix socket 不能被多个进程同时绑定, 只由第一个 worker 监听
+    if server.unixsocket and server.worker_id == 0:
         try:
             os.unlink(server.unixsocket)
         except OSError:
@@ -1029,6 +1328,8 @@ def initServer(server: RedisServer):
         server.sofd = anetUnixServer(server.unixsocket, server.unixsocketperm, server.tcp_backlog)
         anetNonBlock(server.sofd)
     assert server.ipfd_count > 0 or server.sofd
+    if server.workers_num > 1:
+        shardInit(server)
     for i in range(server.dbnum):
         server.db[i].dict = dictCreate(dbDictType, None)
         server.db[i].expires = dictCreate(keyptrDictType, None)
@@ -1057,8 +1358,8 @@ def initServer(server: RedisServer):
     resetServerStats(server)
     # /* A few stats we don't want to reset: server startup time, and peak mem. */
     server.stat_starttime = int(time.time())
-    server.stat_peak_memory = 0
-    server.resident_set_size = 0
+    server.resident_set_size = zmalloc_get_rss()
+    server.stat_peak_memory = server.resident_set_size
     server.lastbgsave_status = REDIS_OK
     server.aof_last_write_status = REDIS_OK
     server.aof_last_write_errno = 0
@@ -1069,17 +1370,20 @@ def initServer(server: RedisServer):
         logger.error("Can't create the serverCron time event.")
         exit(1)
     for fd in server.ipfd:
-        if aeCreateFileEvent(server.el, fd.fileno(), AE_READABLE, acceptTcpHandler, None) == AE_ERR:
+        if aeCreateFileEvent(server.el, fd.fileno(), AE_READABLE, acceptTcpHandler, fd) == AE_ERR:
             logger.error("Unrecoverable error creating server.ipfd file event.")
             exit(1)
-    if server.sofd and aeCreateFileEvent(server.el, server.sofd.fileno(), AE_READABLE, acceptUnixHandler, None) == AE_ERR:
+    if server.sofd and aeCreateFileEvent(server.el, server.sofd.fileno(), AE_READABLE, acceptUnixHandler, server.sofd) == AE_ERR:
         logger.error("Unrecoverable error creating server.sofd file event.")
         exit(1)
     if server.aof_state == REDIS_AOF_ON:
         server.aof_fd = open(server.aof_filename, 'ab')
         os.chmod(server.aof_filename, 0o644)
     # NOTE: 暂时不对内存做限制
-    # NOTE: 暂时不支持slowlog
+    slowlogInit(server)
+    latencyMonitorInit(server)
+    if latencyGcCallback not in gc.callbacks:
+        gc.callbacks.append(latencyGcCallback)
     # NOTE: 暂时不支持bio
 
 def initSentinelConfig():
@@ -1088,6 +1392,13 @@ def initSentinelConfig():
 def initSentinel():
     pass
 
+def yesnotoi(val: str) -> int:
+    if val.lower() == 'yes':
+        return 1
+    elif val.lower() == 'no':
+        return 0
+    raise ValueError(val)
+
 def loadServerConfig(server: RedisServer, filename: str, options: dict) -> None:
     config_list = []
     if filename:
@@ -1118,7 +1429,7 @@ def loadServerConfig(server: RedisServer, filename: str, options: dict) -> None:
         elif key == 'unixsocket':
             server.unixsocket = val
         elif key == 'unixsocketperm':
-            server.unixsocketperm = int(val)
+            server.unixsocketperm = int(val, 8)
         elif key == 'save':
             if val == '':
                 server.saveparams = []
@@ -1143,8 +1454,8 @@ def loadServerConfig(server: RedisServer, filename: str, options: dict) -> None:
             server.daemonize = int(val)
         elif key == 'hz':
             server.hz = int(val)
-            server.hz = min(server.hz, Conf.REDIS_MIN_HZ)
-            server.hz = max(server.hz, Conf.REDIS_MAX_HZ)
+            server.hz = max(server.hz, Conf.REDIS_MIN_HZ)
+            server.hz = min(server.hz, Conf.REDIS_MAX_HZ)
         elif key == 'appendonly':
             server.aof_state = int(val) and REDIS_AOF_ON or REDIS_AOF_OFF
         elif key == 'appendfilename':
@@ -1196,16 +1507,61 @@ def loadServerConfig(server: RedisServer, filename: str, options: dict) -> None:
             server.slowlog_log_slower_than = int(val)
         elif key == 'slowlog-max-len':
             server.slowlog_max_len = int(val)
+            if server.slowlog_max_len < 0:
+                raise ValueError(val)
+        elif key == 'latency-monitor-threshold':
+            server.latency_monitor_threshold = int(val)
+            if server.latency_monitor_threshold < 0:
+                raise ValueError(val)
+        elif key == 'latency-tracking':
+            server.latency_tracking = yesnotoi(val)
         elif key == 'client-output-buffer-limit':
             args = val.split()
-            assert len(args) == 4
+            if len(args) != 4:
+                raise ValueError(val)
             c = getClientLimitClassByName(args[0])
-            hard, soft, seconds = [int(i) for i in args[1:4]]
+            if c == -1:
+                raise ValueError(val)
+            hard, soft = memtoll(args[1]), memtoll(args[2])
+            seconds = int(args[3])
+            if hard < 0 or soft < 0 or seconds < 0:
+                raise ValueError(val)
             server.client_obuf_limits[c].hard_limit_bytes = hard
             server.client_obuf_limits[c].soft_limit_bytes = soft
             server.client_obuf_limits[c].soft_limit_seconds = seconds
         elif key == 'stop-writes-on-bgsave-error':
             server.stop_writes_on_bgsave_err = int(val)
+        elif key == 'io-threads':
+            server.io_threads_num = int(val)
+            if not 1 <= server.io_threads_num <= Conf.REDIS_IO_THREADS_MAX_NUM:
+                raise ValueError(val)
+        elif key == 'workers':
+            server.workers_num = int(val)
+            if not 1 <= server.workers_num <= Conf.REDIS_WORKERS_MAX_NUM:
+                raise ValueError(val)
+        elif key == 'resp-cache-max-memory':
+            server.resp_cache_max_memory = memtoll(val)
+            if server.resp_cache_max_memory < 0:
+                raise ValueError(val)
+        elif key == 'client-command-budget':
+            server.client_command_budget = int(val)
+            if server.client_command_budget < 0:
+                raise ValueError(val)
+        elif key == 'client-read-pause-limit':
+            args = val.split()
+            if len(args) != 2:
+                raise ValueError(val)
+            high, low = memtoll(args[0]), memtoll(args[1])
+            if high < 0 or low < 0 or (high and low > high):
+                raise ValueError(val)
+            server.client_read_pause_high = high
+            server.client_read_pause_low = low
+        elif key == 'io-threads-do-reads':
+            server.io_threads_do_reads = yesnotoi(val)
+        elif key == 'ae-backend':
+            if val != 'auto' and val not in aeApiBackends and val not in aeApiHostedBackends:
+                raise ValueError(val)
+            server.ae_backend = '' if val == 'auto' else val
         elif key == 'notify-keyspace-events':
             server.notify_keyspace_events = keyspaceEventsStringToFlags(val)
             assert server.notify_keyspace_events != -1
@@ -1232,7 +1588,7 @@ def parse_server_args(server: RedisServer) -> Tuple[str, dict]:
         exit()
 
     for key in options:
-        options[key] = getattr(args, key, '')
+        options[key] = getattr(args, key.replace('-', '_'), '')
     loadServerConfig(server, args.conf, options)
     if args.conf:
         server.configfile = os.path.abspath(args.conf)
@@ -1251,6 +1607,29 @@ def daemonize():
     if fd > 2:
         os.close(fd)
 
+def startWorkers(server: RedisServer) -> None:
+    """fork 出 workers_num 个 worker 进程, 只在 worker 中返回, 父进程等待所有 worker 退出"""
+    pids = []
+    for i in range(server.workers_num):
+        pid = os.fork()
+        if pid == 0:
+            server.worker_id = i
+            return
+        pids.append(pid)
+    logger.info("Started %d workers: %s", len(pids), pids)
+
+    def forwardSignal(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+    signal.signal(signal.SIGINT, forwardSignal)
+    signal.signal(signal.SIGTERM, forwardSignal)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    exit(0)
+
 def redisAsciiArt(server: RedisServer) -> None:
     art = r'''
                         _._
@@ -1289,29 +1668,33 @@ def loadDataFromDisk():
     pass
 
 def beforeSleep(eventLoop: aeEventLoop) -> None:
-    # TODO(ruan.lj@foxmail.com): something to do.
-    pass
-
-def main():
-    server = RedisServer()
-    locale.setlocale(locale.LC_COLLATE, '')
+    server = get_server()
+    # 处理刚刚解除阻塞的客户端
+    if server.unblocked_clients:
+        processUnblockedClients()
+    # 读取并执行 I/O 线程处理的客户端
+    handleClientsWithPendingReadsUsingThreads()
+    # 用完了配额的客户端, 每个再执行一轮
+    if server.clients_pending_commands:
+        processClientsWithPendingCommands()
+    # 发送这一轮产生的回复
+    handleClientsWithPendingWrites()
+    # 关闭超过输出缓冲区限制的客户端, 不用等到下一次 serverCron
+    if server.clients_to_close:
+        freeClientsInAsyncFreeQueue()
+    # 还有客户端在排队时, poll 不阻塞, 处理完就绪的事件马上回来继续执行
+    aeSetDontWait(eventLoop, len(server.clients_pending_commands))
+
+def initMain(server: RedisServer) -> None:
     random.seed(int(time.time()) ^ os.getpid())
-    tv = timeval.from_datetime()
-    dictSetHashFunctionSeed(tv.tv_sec ^ tv.tv_usec ^ os.getpid())
+    now = ustime()
+    dictSetHashFunctionSeed((now // 1000000) ^ (now % 1000000) ^ os.getpid())
     # 检查服务器是否以 Sentinel 模式启动
     server.sentinel_mode = checkForSentinelMode();
     # 初始化服务器
     initServerConfig(server);
-    parse_server_args(server)
-    # 如果服务器以 Sentinel 模式启动，那么进行 Sentinel 功能相关的初始化
-    # 并为要监视的主服务器创建一些相应的数据结构
-    # NOTE: not support now
-    if (server.sentinel_mode):
-        initSentinelConfig()
-        initSentinel()
-    if (server.daemonize):
-        daemonize()
 
+def startServer(server: RedisServer) -> None:
     initServer(server)
     # 为服务器进程设置名字
     # NOTE: not support now
@@ -1329,6 +1712,61 @@ def main():
     else:
         raise NotImplementedError('Not support sentinel_mode yet')
     aeSetBeforeSleepProc(server.el, beforeSleep)
+    aeSetAfterSleepProc(server.el, afterSleep)
+
+def main():
+    server = RedisServer()
+    locale.setlocale(locale.LC_COLLATE, '')
+    initMain(server)
+    parse_server_args(server)
+    # 如果服务器以 Sentinel 模式启动，那么进行 Sentinel 功能相关的初始化
+    # 并为要监视的主服务器创建一些相应的数据结构
+    # NOTE: not support now
+    if (server.sentinel_mode):
+        initSentinelConfig()
+        initSentinel()
+    if (server.daemonize):
+        daemonize()
+    if server.workers_num > 1:
+        startWorkers(server)
+
+    if server.ae_backend == 'asyncio':
+        runAsyncio(asyncServe(server))
+        return
+    startServer(server)
     aeMain(server.el)
     aeDeleteEventLoop(server.el)
-    return 0
+
+async def asyncServe(server: RedisServer) -> None:
+    # 事件循环要在 asyncio 事件循环中创建
+    server.ae_backend = 'asyncio'
+    startServer(server)
+    try:
+        await aeAsyncioMain(server.el)
+    finally:
+        aeDeleteEventLoop(server.el)
+
+async def asyncMain(conf: str = '', options: Opt[dict] = None) -> None:
+    """在当前的 asyncio 事件循环中运行服务器, 用于嵌入到 asyncio 程序中
+
+    conf 和 options 的含义与命令行参数相同, 例如 options={'port': '6380'}.
+    取消运行它的任务即可关闭服务器.
+    """
+    server = RedisServer()
+    initMain(server)
+    loadServerConfig(server, conf, options or {})
+    if conf:
+        server.configfile = os.path.abspath(conf)
+    # 嵌入模式下不能 fork worker
+    server.workers_num = 1
+    await asyncServe(server)
+
+def runAsyncio(coro: Coroutine) -> None:
+    # 安装了 uvloop 时使用 uvloop 的事件循环
+    try:
+        import uvloop  # type: ignore
+    except ImportError:
+        pass
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(coro)
@@ -35,6 +35,8 @@ class redisObject:
         self.lru: int = REDIS_LRU_BITS
         self.refcount: int = 0
         self.ptr = None
+        # 缓存的 bulk 回复 $<len>\r\n<value>\r\n, 只用于数据库中的字符串值, 修改值之前必须清除
+        self.resp: Opt[bytes] = None
 
     @property
     def int_value(self) -> int:
@@ -55,16 +57,16 @@ def createObject(obj_type: int, ptr, encoding: int = REDIS_ENCODING_RAW) -> robj
     return o
 
 
-def createRawStringObject(ptr: cstr, length: int) -> robj:
+def createRawStringObject(ptr: Union[cstr, memoryview], length: int) -> robj:
     return createObject(REDIS_STRING, sdsnewlen(ptr, length))
 
-def createEmbeddedStringObject(ptr: cstr, length: int) -> robj:
+def createEmbeddedStringObject(ptr: Union[cstr, memoryview], length: int) -> robj:
     o = createRawStringObject(ptr, length)
     o.encoding = REDIS_ENCODING_EMBSTR
     return o
 
 REDIS_ENCODING_EMBSTR_SIZE_LIMIT = 39
-def createStringObject(ptr: Union[cstr, str], length: int) -> robj:
+def createStringObject(ptr: Union[cstr, memoryview, str], length: int) -> robj:
     if isinstance(ptr, str):
         ptr = ptr.encode('utf8')
     if (length <= REDIS_ENCODING_EMBSTR_SIZE_LIMIT):
@@ -77,6 +79,8 @@ def decrRefCount(o: redisObject) -> None:
     assert o.refcount > 0
     if o.refcount == 1:
         # NOTE: collect object
+        if o.resp is not None:
+            dropObjectRespCache(o)
         o.refcount = 0
         del o
     else:
@@ -89,6 +93,12 @@ def incrRefCount(o: redisObject) -> None:
 def decrRefCountVoid(o: redisObject) -> None:
     decrRefCount(o)
 
+def dropObjectRespCache(o: redisObject) -> None:
+    if o.resp is not None:
+        server = get_server()
+        server.resp_cache_memory -= len(o.resp)
+        o.resp = None
+
 REDIS_COMPARE_BINARY = (1<<0)
 REDIS_COMPARE_COLL = (1<<1)
 
@@ -48,7 +48,7 @@ class Sdshdr(object):
 
 sds = Sdshdr
 
-def sdsnewlen(init: cstr, initlen: int) -> sds:
+def sdsnewlen(init: Union[cstr, memoryview], initlen: int) -> sds:
     buf = bytearray(init[:initlen])
     buf.append(NUL)
     sh = sds(initlen, 0, buf)
@@ -90,7 +90,8 @@ def sdsMakeRoomFor(s: sds, addlen: int) -> sds:
         newlen *= 2
     else:
         newlen += SDS_MAX_PREALLOC
-    s.buf.extend((NUL for _ in range(newlen - lenght)))  # NOTE 默认填错NUL, 和c实现有所不同
+    # NOTE 默认填充NUL, 和c实现有所不同. buf 的长度总是 len + free + 1
+    s.buf.extend(bytes(newlen + 1 - len(s.buf)))
     s.free = newlen - lenght
     return s
 
@@ -99,9 +100,9 @@ def sdsRemoveFreeSpace(s: sds) -> sds:
     s.free = 0
     return s
 
-def sdsAllocSize(s: sds):
-    # NOTE not malloc in python
-    raise NotImplementedError
+def sdsAllocSize(s: sds) -> int:
+    # NOTE not malloc in python, 返回 buf 的长度
+    return len(s.buf)
 
 def sdsIncrLen(s: sds, incr: int) -> None:
     assert s.free >= incr
@@ -117,7 +118,7 @@ sdsgrowzero = sdsMakeRoomFor
 def sdscatlen(s: sds, t: Union[cstr, sds], lenght: int):
     curlen = sdslen(s)
     s = sdsMakeRoomFor(s, lenght)
-    s[curlen:lenght] = t[:lenght]
+    s[curlen:curlen+lenght] = t[:lenght]
     s.len = curlen + lenght
     s.free = s.free - lenght
     s[curlen+lenght] = NUL
@@ -218,11 +219,7 @@ def sdscmp(s1: sds, s2: sds) -> int:
     return cmp
 
 def sdssplitargs(line: sds) -> List[sds]:
-    parts = line.buf.split()
-    if not parts:
-        return []
-    assert parts[-1][0] == NUL
-    parts.pop()
+    parts = line.buf[:sdslen(line)].split()
     res = []
     for i in parts:
         s = Sdshdr(len(i), 0, i)
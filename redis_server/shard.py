@@ -0,0 +1,251 @@
+import os
+import socket
+import tempfile
+import typing
+from collections import deque
+from logging import getLogger
+from typing import Deque, List, Optional as Opt, Union
+
+from .ae import aeEventLoop, aeCreateFileEvent, aeDeleteFileEvent, AE_READABLE, AE_WRITABLE, AE_ERR
+from .anet import anetUnixServer, anetUnixAccept, anetUnixConnect, anetNonBlock
+from .config import *
+from .crc16 import crc16
+from .db import getKeysFromCommand
+from .robject import redisObject, sdsEncodedObject
+from .networking import acceptCommonHandler, addReplyString, addReplyError, MAX_ACCEPTS_PER_CALL
+from .util import get_server
+
+if typing.TYPE_CHECKING:
+    from .redis import RedisClient, RedisServer
+
+logger = getLogger(__name__)
+
+# 多进程 worker 模式
+# 每个 worker 是一个独立的进程, 通过 SO_REUSEPORT 监听同一个端口, 由内核分配连接.
+# 键空间按照 hash slot 分给各个 worker, worker i 拥有 [i*16384/N, (i+1)*16384/N) 的 slot.
+# 键不属于当前 worker 的命令通过 unix socket 转发给它的所有者, 客户端在等待回复时处于阻塞状态,
+# 这样同一个客户端的命令仍然按顺序执行和回复.
+
+REDIS_CLUSTER_SLOTS = 16384
+
+def keyHashSlot(key: Union[bytes, bytearray]) -> int:
+    """和 Redis Cluster 相同: 如果键包含 {tag}, 只对 tag 计算 hash"""
+    s = key.find(b'{')
+    if s != -1:
+        e = key.find(b'}', s+1)
+        if e != -1 and e != s+1:
+            return crc16(key[s+1:e]) & 0x3FFF
+    return crc16(key) & 0x3FFF
+
+def shardOwner(slot: int, workers: int) -> int:
+    return slot * workers // REDIS_CLUSTER_SLOTS
+
+def shardSocketPath(port: int, worker_id: int) -> str:
+    return os.path.join(tempfile.gettempdir(), 'redis-%d-worker-%d.sock' % (port, worker_id))
+
+class shardLink:
+    """到另一个 worker 的连接"""
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.fd: Opt[socket.socket] = None
+        # 还没有发送的命令
+        self.obuf = bytearray()
+        # 还没有解析完的回复
+        self.inbuf = bytearray()
+        # 按发送顺序等待回复的客户端, 已经释放的客户端和不需要回复的广播命令用 None 占位
+        self.clients: Deque[Opt['RedisClient']] = deque()
+
+def shardEncodeCommand(argv: List[redisObject]) -> bytes:
+    parts = [b'*%d\r\n' % len(argv)]
+    for o in argv:
+        s = o.ptr.content if sdsEncodedObject(o) else b'%d' % o.ptr
+        parts.append(b'$%d\r\n' % len(s))
+        parts.append(s)
+        parts.append(b'\r\n')
+    return b''.join(parts)
+
+def shardReplyEnd(buf: bytearray, pos: int) -> int:
+    """返回从 pos 开始的一个完整回复的结束位置, 数据不完整时返回 -1"""
+    idx = buf.find(b'\r\n', pos)
+    if idx == -1:
+        return -1
+    t = buf[pos]
+    if t in b'+-:':
+        return idx+2
+    ll = int(buf[pos+1:idx])
+    if t == ord('$'):
+        if ll < 0:
+            return idx+2
+        end = idx+2+ll+2
+        return end if len(buf) >= end else -1
+    if t == ord('*'):
+        pos = idx+2
+        for _ in range(ll):
+            pos = shardReplyEnd(buf, pos)
+            if pos == -1:
+                return -1
+        return pos
+    raise ValueError('Unknown reply type: %r' % chr(t))
+
+### public api ###
+
+def shardInit(server: 'RedisServer') -> None:
+    """监听当前 worker 的 unix socket, 接收其他 worker 转发的命令"""
+    path = shardSocketPath(server.port, server.worker_id)
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    server.shard_sofd = anetUnixServer(path, 0o700, server.tcp_backlog)
+    anetNonBlock(server.shard_sofd)
+    if aeCreateFileEvent(server.el, server.shard_sofd.fileno(), AE_READABLE, acceptShardHandler, server.shard_sofd) == AE_ERR:
+        logger.error("Unrecoverable error creating server.shard_sofd file event.")
+        exit(1)
+
+def shardForwardCommand(c: 'RedisClient') -> int:
+    """键属于其他 worker 时转发命令并阻塞客户端, 返回 1; 需要在本地执行时返回 0"""
+    from .redis import blockClient, rejectCommand
+    server = get_server()
+    owner = -1
+    for j in getKeysFromCommand(c.cmd, c.argv, c.argc):   # type: ignore
+        key = c.argv[j]
+        slot = keyHashSlot(key.ptr.content if sdsEncodedObject(key) else b'%d' % key.ptr)
+        n = shardOwner(slot, server.workers_num)
+        if owner != -1 and n != owner:
+            rejectCommand(c, "-CROSSSLOT Keys in request don't hash to the same slot")
+            return 1
+        owner = n
+    if owner == -1 or owner == server.worker_id:
+        return 0
+    link = shardGetLink(server, owner)
+    if not link:
+        rejectCommand(c, "worker %d is not available" % owner)
+        return 1
+    shardLinkSend(server, link, c.argv, c)
+    # blockClient 会创建客户端的阻塞状态
+    blockClient(c, REDIS_BLOCKED_SHARD)
+    c.bpop.link = link
+    return 1
+
+def shardBroadcastCommand(c: 'RedisClient') -> List[int]:
+    """把命令发给其他所有 worker, 不等待它们的回复, 返回连接不上的 worker
+
+    同一个 worker 之后转发的命令走同一个连接, 所以一定在广播的命令之后执行.
+    """
+    server = get_server()
+    failed = []
+    for worker_id in range(server.workers_num):
+        if worker_id == server.worker_id:
+            continue
+        link = shardGetLink(server, worker_id)
+        if link:
+            shardLinkSend(server, link, c.argv, None)
+        else:
+            failed.append(worker_id)
+    return failed
+
+def unblockClientWaitingShard(c: 'RedisClient') -> None:
+    # 客户端在收到回复前被释放, 回复到达时直接丢弃
+    link: Opt[shardLink] = c.bpop.link
+    if link:
+        link.clients[link.clients.index(c)] = None
+    c.bpop.link = None
+
+def acceptShardHandler(el: aeEventLoop, fd: int, privdata: socket.socket, mask: int) -> None:
+    max_ = MAX_ACCEPTS_PER_CALL
+    while max_:
+        max_ -= 1
+        try:
+            cfd, _ = anetUnixAccept(privdata)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.warning("Accepting worker connection: %s", e)
+            return
+        acceptCommonHandler(cfd, REDIS_UNIX_SOCKET|REDIS_SHARD_CLIENT)
+
+### private functions ###
+
+def shardGetLink(server: 'RedisServer', worker_id: int) -> Opt[shardLink]:
+    link = server.shard_links.get(worker_id)
+    if link is None:
+        link = server.shard_links[worker_id] = shardLink(worker_id)
+    if link.fd is None:
+        # 本机的 unix socket, 阻塞连接不会等待太久
+        try:
+            fd = anetUnixConnect(shardSocketPath(server.port, worker_id), 0)
+            anetNonBlock(fd)
+        except OSError as e:
+            logger.warning("Connecting to worker %d: %s", worker_id, e)
+            return None
+        if aeCreateFileEvent(server.el, fd.fileno(), AE_READABLE, shardReadHandler, link) == AE_ERR:   # type: ignore
+            fd.close()
+            return None
+        link.fd = fd
+    return link
+
+def shardLinkSend(server: 'RedisServer', link: shardLink, argv: List[redisObject], c: Opt['RedisClient']) -> None:
+    if not link.obuf:
+        aeCreateFileEvent(server.el, link.fd.fileno(), AE_WRITABLE, shardWriteHandler, link)   # type: ignore
+    link.obuf += shardEncodeCommand(argv)
+    link.clients.append(c)
+
+def shardLinkError(link: shardLink, err: object) -> None:
+    from .redis import unblockClient
+    server = get_server()
+    logger.warning("Lost connection to worker %d: %s", link.worker_id, err)
+    if link.fd:
+        aeDeleteFileEvent(server.el, link.fd.fileno(), AE_READABLE|AE_WRITABLE)
+        link.fd.close()
+        link.fd = None
+    link.obuf.clear()
+    link.inbuf.clear()
+    clients, link.clients = link.clients, deque()
+    for c in clients:
+        if c:
+            c.bpop.link = None
+            addReplyError(c, "connection to worker %d lost" % link.worker_id)
+            unblockClient(c)
+
+def shardWriteHandler(el: aeEventLoop, fd: int, privdata: shardLink, mask: int) -> None:
+    link = privdata
+    try:
+        nwritten = link.fd.send(link.obuf)   # type: ignore
+    except BlockingIOError:
+        return
+    except OSError as e:
+        shardLinkError(link, e)
+        return
+    del link.obuf[:nwritten]
+    if not link.obuf:
+        aeDeleteFileEvent(el, fd, AE_WRITABLE)
+
+def shardReadHandler(el: aeEventLoop, fd: int, privdata: shardLink, mask: int) -> None:
+    from .redis import unblockClient
+    link = privdata
+    try:
+        chunk = link.fd.recv(REDIS_IOBUF_LEN)   # type: ignore
+    except BlockingIOError:
+        return
+    except OSError as e:
+        shardLinkError(link, e)
+        return
+    if not chunk:
+        shardLinkError(link, "connection closed")
+        return
+    link.inbuf += chunk
+    pos = 0
+    while link.clients:
+        end = shardReplyEnd(link.inbuf, pos)
+        if end == -1:
+            break
+        c = link.clients.popleft()
+        if c:
+            c.bpop.link = None
+            addReplyString(c, link.inbuf[pos:end], end-pos)
+            unblockClient(c)
+        pos = end
+    del link.inbuf[:pos]
+
+### end private functions ###
@@ -0,0 +1,111 @@
+import typing
+from collections import deque
+from itertools import islice
+from typing import List
+from .robject import redisObject, sdsEncodedObject, getLongLongFromObjectOrReply
+from .config import REDIS_OK
+from .util import get_server, get_shared
+from .networking import (
+    addReply, addReplyError, addReplyLongLong, addReplyMultiBulkLen, addReplyBulkCBuffer, addReplyBulkCString,
+    getClientPeerId,
+)
+
+if typing.TYPE_CHECKING:
+    from .redis import RedisClient, RedisServer
+
+__all__ = [
+    'slowlogEntry',
+    'slowlogInit',
+    'slowlogPushEntryIfNeeded',
+    'slowlogReset',
+    'slowlogCommand',
+]
+
+# 每条日志最多记录的参数数量和每个参数最多记录的字节数
+SLOWLOG_ENTRY_MAX_ARGC = 32
+SLOWLOG_ENTRY_MAX_STRING = 128
+
+
+class slowlogEntry:
+    __slots__ = ('id', 'time', 'duration', 'argv', 'peerid', 'cname')
+
+    def __init__(self, c: 'RedisClient', argv: List[redisObject], duration: int):
+        server = get_server()
+        # 日志的唯一 ID
+        self.id: int = server.slowlog_entry_id
+        server.slowlog_entry_id += 1
+        # 命令执行时的 UNIX 时间
+        self.time: int = server.unixtime
+        # 执行命令消耗的时间, 以微秒为单位
+        self.duration: int = duration
+        # 命令参数, 太多的参数和太长的参数会被截断
+        self.argv: List[bytes] = slowlogTrimArgv(argv)
+        # 客户端的地址和名字
+        self.peerid: str = getClientPeerId(c)
+        self.cname: bytes = bytes(c.name.ptr.content) if c.name else b''
+
+
+def slowlogTrimArgv(argv: List[redisObject]) -> List[bytes]:
+    argc = len(argv)
+    slargc = min(argc, SLOWLOG_ENTRY_MAX_ARGC)
+    res = []
+    for j in range(slargc):
+        if slargc != argc and j == slargc-1:
+            res.append(b'... (%d more arguments)' % (argc-slargc+1))
+            break
+        o = argv[j]
+        arg = bytes(o.ptr.content) if sdsEncodedObject(o) else str(o.ptr).encode()
+        if len(arg) > SLOWLOG_ENTRY_MAX_STRING:
+            arg = arg[:SLOWLOG_ENTRY_MAX_STRING] + b'... (%d more bytes)' % (len(arg)-SLOWLOG_ENTRY_MAX_STRING)
+        res.append(arg)
+    return res
+
+def slowlogInit(server: 'RedisServer') -> None:
+    # 最新的日志在表头, 超过 slowlog_max_len 时表尾最旧的日志被丢弃
+    server.slowlog = deque(maxlen=server.slowlog_max_len)
+    server.slowlog_entry_id = 0
+
+def slowlogPushEntryIfNeeded(c: 'RedisClient', argv: List[redisObject], duration: int) -> None:
+    server = get_server()
+    # 负数关闭慢查询日志
+    if server.slowlog_log_slower_than < 0:
+        return
+    if duration >= server.slowlog_log_slower_than:
+        # slowlog-max-len 在运行时被修改过
+        if server.slowlog.maxlen != server.slowlog_max_len:
+            server.slowlog = deque(server.slowlog, maxlen=server.slowlog_max_len)
+        server.slowlog.appendleft(slowlogEntry(c, argv, duration))
+
+def slowlogReset(server: 'RedisServer') -> None:
+    server.slowlog.clear()
+
+def slowlogCommand(c: 'RedisClient') -> None:
+    """SLOWLOG GET [count] / SLOWLOG LEN / SLOWLOG RESET"""
+    server = get_server()
+    sub = c.argv[1].ptr
+    if c.argc == 2 and sub.lowereq('reset'):
+        slowlogReset(server)
+        addReply(c, get_shared().ok)
+    elif c.argc == 2 and sub.lowereq('len'):
+        addReplyLongLong(c, len(server.slowlog))
+    elif (c.argc == 2 or c.argc == 3) and sub.lowereq('get'):
+        count = 10
+        if c.argc == 3:
+            status, count = getLongLongFromObjectOrReply(c, c.argv[2], None)
+            if status != REDIS_OK:
+                return
+        # 负数表示返回全部日志
+        entries = list(islice(server.slowlog, count) if count >= 0 else server.slowlog)
+        addReplyMultiBulkLen(c, len(entries))
+        for se in entries:
+            addReplyMultiBulkLen(c, 6)
+            addReplyLongLong(c, se.id)
+            addReplyLongLong(c, se.time)
+            addReplyLongLong(c, se.duration)
+            addReplyMultiBulkLen(c, len(se.argv))
+            for arg in se.argv:
+                addReplyBulkCBuffer(c, arg, len(arg))
+            addReplyBulkCString(c, se.peerid)
+            addReplyBulkCBuffer(c, se.cname, len(se.cname))
+    else:
+        addReplyError(c, "Unknown SLOWLOG subcommand or wrong # of args. Try GET, RESET, LEN.")
@@ -1,7 +1,9 @@
+import os
+import sys
 import socket
 import typing
 from .csix import cstr, memcpy, NUL, LONG_MIN, LONG_MAX
-from typing import Dict, Any, Union, ByteString, Tuple
+from typing import Dict, Any, Union, ByteString, Tuple, Optional
 
 if typing.TYPE_CHECKING:
     from .redis import RedisServer, sharedObjects
@@ -50,6 +52,19 @@ def string2l(s: cstr, slen: int) -> Tuple[int, int]:
 
 string2ll = string2l
 
+def memtoll(p: str) -> int:
+    """把 1gb, 100mb, 4k 这样的内存大小转换成字节数, 单位不区分大小写"""
+    units = {'': 1, 'b': 1, 'k': 1000, 'kb': 1024, 'm': 1000*1000, 'mb': 1024*1024,
+             'g': 1000*1000*1000, 'gb': 1024*1024*1024}
+    p = p.lower()
+    i = len(p)
+    while i and not p[i-1].isdigit():
+        i -= 1
+    mul = units.get(p[i:])
+    if mul is None:
+        raise ValueError(p)
+    return int(p[:i]) * mul
+
 
 class _SingletonMeta(type):
     _instances: Dict[Any, Any]  = {}
@@ -61,28 +76,40 @@ class _SingletonMeta(type):
 class Singleton(metaclass=_SingletonMeta):
     pass
 
-class SocketCache:
-    """socket cache, convert socket fileno to socket object"""
-
-    _cache: Dict[int, socket.socket] = {}
-
-    @classmethod
-    def get(cls, fileno: int):
-        return cls._cache[fileno]
-
-    @classmethod
-    def set(cls, sock: socket.socket):
-        assert sock.fileno() not in cls._cache
-        cls._cache[sock.fileno()] = sock
+def zmalloc_get_rss() -> int:
+    """进程的常驻内存 (RSS), 以字节为单位"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    # 没有 /proc 的系统上只能取得 RSS 的峰值
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
 
 def zmalloc_used_memory() -> int:
-    # TODO(rlj): something to do.
-    return 0
+    # Python 的分配器没有提供已分配字节数的统计, 用 serverCron 采样的 RSS 代替,
+    # 写回复的热路径上也会调用, 不能每次都读取 /proc
+    return get_server().resident_set_size
+
+# 两者都是单例, 缓存起来, 热路径上不需要每次都 import 和调用元类
+_server: 'Optional[RedisServer]' = None
+_shared: 'Optional[sharedObjects]' = None
 
 def get_server() -> 'RedisServer':
-    from .redis import RedisServer
-    return RedisServer()
+    global _server
+    if _server is None:
+        from .redis import RedisServer
+        _server = RedisServer()
+    return _server
 
 def get_shared() -> 'sharedObjects':
-    from .redis import sharedObjects
-    return sharedObjects()
+    global _shared
+    if _shared is None:
+        from .redis import sharedObjects
+        _shared = sharedObjects()
+    return _shared
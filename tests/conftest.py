@@ -0,0 +1,33 @@
+import socket
+import pytest
+from redis_server.ae import aeCreateEventLoop, aeDeleteEventLoop
+from redis_server.redis import RedisServer, initServerConfig, createClient, freeClient, resetServerStats
+from redis_server.db import RedisDB, dbDictType, keyptrDictType
+from redis_server.rdict import dictCreate
+from redis_server.adlist import listFirst, listNodeValue, listLength
+
+@pytest.fixture
+def server():
+    server = RedisServer()
+    initServerConfig(server)
+    resetServerStats(server)
+    server.el = aeCreateEventLoop(1024)
+    server.db = [RedisDB()]
+    server.db[0].dict = dictCreate(dbDictType, None)
+    server.db[0].expires = dictCreate(keyptrDictType, None)
+    # 新的数据库中没有缓存回复的值
+    server.resp_cache_memory = 0
+    # 单个 worker, 没有到其他 worker 的连接
+    server.worker_id = 0
+    server.shard_links = {}
+    yield server
+    while listLength(server.clients):
+        freeClient(listNodeValue(listFirst(server.clients)))
+    aeDeleteEventLoop(server.el)
+
+@pytest.fixture
+def client(server):
+    a, b = socket.socketpair()
+    c = createClient(server, a)
+    yield c, b
+    b.close()
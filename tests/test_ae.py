@@ -0,0 +1,210 @@
+import asyncio
+import socket
+from redis_server.ae import *
+from redis_server.ae_api import aeApiBackends
+from redis_server.csix import timeval
+
+def zero_timeval() -> timeval:
+    return timeval()
+
+def poll_fired(el: aeEventLoop) -> dict:
+    numevents = el.api.aeApiPoll(el, zero_timeval())
+    assert numevents == len(el.fired)
+    return dict(el.fired)
+
+def test_aeApiBackends():
+    assert aeApiBackends[-1] == 'select'
+    el = aeCreateEventLoop(64)
+    assert aeGetApiName(el) == aeApiBackends[0]
+    for name in aeApiBackends:
+        el = aeCreateEventLoop(64, name)
+        assert aeGetApiName(el) == name
+        aeDeleteEventLoop(el)
+
+def test_aeApiPoll():
+    for name in aeApiBackends:
+        el = aeCreateEventLoop(64, name)
+        a, b = socket.socketpair()
+        rfd = a.fileno()
+        noop = lambda *args: None
+        assert aeCreateFileEvent(el, rfd, AE_READABLE, noop, None) == AE_OK
+        assert poll_fired(el) == {}
+
+        b.sendall(b'ping')
+        assert poll_fired(el)[rfd] & AE_READABLE
+
+        assert aeCreateFileEvent(el, rfd, AE_WRITABLE, noop, None) == AE_OK
+        assert poll_fired(el)[rfd] == AE_READABLE|AE_WRITABLE
+
+        aeDeleteFileEvent(el, rfd, AE_READABLE)
+        assert poll_fired(el)[rfd] == AE_WRITABLE
+
+        aeDeleteFileEvent(el, rfd, AE_WRITABLE)
+        assert rfd not in poll_fired(el)
+        aeDeleteEventLoop(el)
+        a.close()
+        b.close()
+
+def test_aeApiPollOnlyReady():
+    for name in aeApiBackends:
+        el = aeCreateEventLoop(64, name)
+        pairs = [socket.socketpair() for _ in range(8)]
+        noop = lambda *args: None
+        for a, _ in pairs:
+            aeCreateFileEvent(el, a.fileno(), AE_READABLE, noop, None)
+        assert poll_fired(el) == {}
+
+        pairs[3][1].sendall(b'ping')
+        assert poll_fired(el) == {pairs[3][0].fileno(): AE_READABLE}
+        aeDeleteEventLoop(el)
+        for a, b in pairs:
+            a.close()
+            b.close()
+
+def test_aeProcessEventsDontWait():
+    for name in aeApiBackends:
+        el = aeCreateEventLoop(64, name)
+        # 没有任何事件时也不能阻塞
+        assert aeProcessEvents(el, AE_ALL_EVENTS|AE_DONT_WAIT) == 0
+        aeDeleteEventLoop(el)
+
+def test_aeSetDontWait():
+    import time
+    el = aeCreateEventLoop(64)
+    aeCreateTimeEvent(el, 1000, lambda el, ident, clientData: AE_NOMORE, None, None)
+    aeSetDontWait(el, 1)
+    start = time.time()
+    # 有定时事件时通常会阻塞到它到期, 设置了 DONT_WAIT 后立即返回
+    assert aeProcessEvents(el, AE_ALL_EVENTS) == 0
+    assert time.time() - start < 0.5
+    aeSetDontWait(el, 0)
+    assert not el.flags & AE_DONT_WAIT
+    aeDeleteEventLoop(el)
+
+def test_aeEventLoopUtilization():
+    import time
+    el = aeCreateEventLoop(64)
+    a, b = socket.socketpair()
+    aeCreateFileEvent(el, a.fileno(), AE_READABLE, lambda *args: time.sleep(0.02), None)
+    b.send(b'x')
+    aeProcessEvents(el, AE_ALL_EVENTS|AE_DONT_WAIT)
+    assert el.cycles == 1 and el.busy_us == 0
+    # 第二次 poll 时才知道上一轮执行事件用了多少时间
+    aeProcessEvents(el, AE_ALL_EVENTS|AE_DONT_WAIT)
+    assert el.cycles == 2
+    assert el.last_busy_us >= 20000 and el.busy_us == el.last_busy_us
+    assert el.poll_us >= 0
+    aeDeleteEventLoop(el)
+    a.close()
+    b.close()
+
+def test_aeTimeEvents():
+    el = aeCreateEventLoop(64)
+    calls = []
+    def proc(el, ident, clientData):
+        calls.append(clientData)
+        return AE_NOMORE
+    finalized = []
+    def finalizer(el, clientData):
+        finalized.append(clientData)
+
+    late = aeCreateTimeEvent(el, 10000, proc, 'late', finalizer)
+    aeCreateTimeEvent(el, 0, proc, 'b', finalizer)
+    aeCreateTimeEvent(el, -1000, proc, 'a', finalizer)
+    assert aeSearchNearestTimer(el).clientData == 'a'
+    assert aeProcessEvents(el, AE_TIME_EVENTS|AE_DONT_WAIT) == 2
+    assert calls == ['a', 'b']
+    assert finalized == ['a', 'b']
+    assert list(el.timeEvents) == [late]
+
+    assert aeDeleteTimeEvent(el, late) == AE_OK
+    assert aeDeleteTimeEvent(el, late) == AE_ERR
+    assert finalized == ['a', 'b', 'late']
+    assert aeSearchNearestTimer(el) is None
+    assert el.timeEventHeap == []
+    aeDeleteEventLoop(el)
+
+def test_aeTimeEventsReschedule():
+    el = aeCreateEventLoop(64)
+    calls = []
+    def proc(el, ident, clientData):
+        calls.append(ident)
+        # 在处理器中新建的事件要到下一轮才会执行
+        aeCreateTimeEvent(el, 0, lambda *args: AE_NOMORE, None, None)
+        return 0
+    ident = aeCreateTimeEvent(el, 0, proc, None, None)
+    assert processTimeEvents(el) == 1
+    assert calls == [ident]
+    assert len(el.timeEvents) == 2
+    assert processTimeEvents(el) == 2
+    aeDeleteEventLoop(el)
+
+def test_aeTimeEventsLazyDelete():
+    el = aeCreateEventLoop(64)
+    noop = lambda *args: AE_NOMORE
+    ids = [aeCreateTimeEvent(el, 1000 + i, noop, None, None) for i in range(1000)]
+    for ident in ids[:900]:
+        aeDeleteTimeEvent(el, ident)
+    # 删除过半后堆会被压缩
+    assert len(el.timeEventHeap) < 1000
+    assert aeSearchNearestTimer(el).id == ids[900]
+    assert el.timeEventDeleted == len(el.timeEventHeap) - len(el.timeEvents)
+    aeDeleteEventLoop(el)
+
+def test_aeTimeEventsDeleteWhileProcessing():
+    el = aeCreateEventLoop(64)
+    noop = lambda *args: AE_NOMORE
+    far = [aeCreateTimeEvent(el, 100000, noop, None, None) for _ in range(200)]
+    victim = aeCreateTimeEvent(el, -10, lambda *args: 0, None, None)
+    def killer(el, ident, clientData):
+        # 删除已经执行过、正等待重新放回堆中的事件, 并触发堆的压缩
+        aeDeleteTimeEvent(el, victim)
+        for ident in far:
+            aeDeleteTimeEvent(el, ident)
+        return AE_NOMORE
+    aeCreateTimeEvent(el, -5, killer, None, None)
+    assert processTimeEvents(el) == 2
+    assert el.timeEventDeleted == len(el.timeEventHeap) - len(el.timeEvents)
+    assert aeSearchNearestTimer(el) is None
+    assert el.timeEventDeleted == 0
+    aeDeleteEventLoop(el)
+
+def test_aeSetAfterSleepProc():
+    el = aeCreateEventLoop(64)
+    a, b = socket.socketpair()
+    aeCreateFileEvent(el, a.fileno(), AE_READABLE, lambda *args: None, None)
+    calls = []
+    aeSetAfterSleepProc(el, calls.append)
+    aeProcessEvents(el, AE_ALL_EVENTS|AE_DONT_WAIT)
+    assert calls == [el]
+    aeDeleteEventLoop(el)
+    a.close()
+    b.close()
+
+def test_aeAsyncio():
+    from redis_server.ae_asyncio import aeAsyncioMain
+
+    async def run():
+        el = aeCreateEventLoop(64, 'asyncio')
+        assert aeGetApiName(el) == 'asyncio'
+        a, b = socket.socketpair()
+        a.setblocking(False)
+        calls = []
+        def readProc(el, fd, clientData, mask):
+            calls.append(a.recv(16))
+            aeDeleteFileEvent(el, fd, AE_READABLE)
+            aeStop(el)
+        def timeProc(el, ident, clientData):
+            calls.append('timer')
+            b.sendall(b'ping')
+            return AE_NOMORE
+        aeCreateFileEvent(el, a.fileno(), AE_READABLE, readProc, None)
+        aeCreateTimeEvent(el, 50, timeProc, None, None)
+        aeSetBeforeSleepProc(el, lambda el: calls.append('beforesleep'))
+        await asyncio.wait_for(aeAsyncioMain(el), 5)
+        assert calls == ['beforesleep', 'timer', 'beforesleep', b'ping']
+        aeDeleteEventLoop(el)
+        a.close()
+        b.close()
+
+    asyncio.run(run())
@@ -0,0 +1,239 @@
+from redis_server.redis import lookupCommandByBytes, trackOperationsPerSecond, getOperationsPerSecond
+from redis_server.rdict import dictSize
+from redis_server.sds import sdscatlen
+from redis_server.networking import processInputBuffer, handleClientsWithPendingWrites, getClientPeerId
+from redis_server.slowlog import slowlogInit, SLOWLOG_ENTRY_MAX_ARGC
+from redis_server.latency import (
+    latencyMonitorInit, latencyAddSampleIfNeeded, latencyGcCallback, latencyFlushGcPause, latencyTimeSeriesSamples,
+    LATENCY_TS_LEN,
+)
+
+def run(c, peer, data):
+    sdscatlen(c.querybuf, data, len(data))
+    processInputBuffer(c)
+    handleClientsWithPendingWrites()
+    return peer.recv(1000)
+
+def test_lookupCommandByBytes(server):
+    get = server.commands['get']
+    assert lookupCommandByBytes(b'get') is get
+    assert lookupCommandByBytes(b'GET') is get
+    # 其他大小写写法第一次查找后被缓存
+    server.command_lookup.pop(b'gEt', None)
+    assert lookupCommandByBytes(b'gEt') is get
+    assert server.command_lookup[b'gEt'] is get
+    # 不存在的命令不缓存
+    assert lookupCommandByBytes(b'nope') is None
+    assert b'nope' not in server.command_lookup
+
+def test_setCommandOptions(server, client):
+    c, peer = client
+    db = server.db[0]
+    assert run(c, peer, b'SET a 1 NX\r\nset a 2 nx\r\n') == b'+OK\r\n$-1\r\n'
+    assert run(c, peer, b'SET b 1 Xx\r\nSET a 3 xx\r\nGET a\r\n') == b'$-1\r\n+OK\r\n$1\r\n3\r\n'
+    assert dictSize(db.expires) == 0
+    assert run(c, peer, b'SET a 1 EX 100\r\nSET b 1 px 100000 NX\r\n') == b'+OK\r\n+OK\r\n'
+    assert dictSize(db.expires) == 2
+
+def test_setCommandOptionsSyntaxError(server, client):
+    c, peer = client
+    err = b'-ERR syntax error\r\n'
+    assert run(c, peer, b'SET a 1 EX\r\n') == err
+    assert run(c, peer, b'SET a 1 NX XX\r\n') == err
+    assert run(c, peer, b'SET a 1 EX 10 PX 10\r\n') == err
+    assert run(c, peer, b'SET a 1 KEEPTTL\r\n') == err
+    assert dictSize(server.db[0].dict) == 0
+
+def test_slowlog(server, client):
+    c, peer = client
+    slowlogInit(server)
+    assert run(c, peer, b'CONFIG SET slowlog-log-slower-than 0\r\n') == b'+OK\r\n'
+    run(c, peer, b'SET a 1\r\nGET a\r\n')
+    # CONFIG SET 本身也被记录了
+    assert run(c, peer, b'SLOWLOG LEN\r\n') == b':3\r\n'
+    reply = run(c, peer, b'SLOWLOG GET 1\r\n')
+    # 最新的日志在前面, 命令执行完之后才记录
+    assert [e.argv for e in server.slowlog] == [
+        [b'SLOWLOG', b'GET', b'1'], [b'SLOWLOG', b'LEN'], [b'GET', b'a'], [b'SET', b'a', b'1'],
+        [b'CONFIG', b'SET', b'slowlog-log-slower-than', b'0']]
+    entry = server.slowlog[1]
+    assert entry.peerid == getClientPeerId(c)
+    assert reply == (b'*1\r\n*6\r\n:%d\r\n:%d\r\n:%d\r\n*2\r\n$7\r\nSLOWLOG\r\n$3\r\nLEN\r\n$%d\r\n%s\r\n$0\r\n\r\n' % (
+        entry.id, entry.time, entry.duration, len(entry.peerid), entry.peerid.encode()))
+    assert run(c, peer, b'SLOWLOG RESET\r\nSLOWLOG LEN\r\n') == b'+OK\r\n:1\r\n'
+    assert run(c, peer, b'SLOWLOG FOO\r\n').startswith(b'-ERR Unknown SLOWLOG subcommand')
+
+def test_slowlogTrimArgv(server, client):
+    c, peer = client
+    slowlogInit(server)
+    server.slowlog_log_slower_than = 0
+    args = [b'SET', b'x' * 200] + [b'y'] * 40
+    run(c, peer, b''.join([b'*%d\r\n' % len(args)] + [b'$%d\r\n%s\r\n' % (len(a), a) for a in args]))
+    argv = server.slowlog[0].argv
+    assert len(argv) == SLOWLOG_ENTRY_MAX_ARGC
+    assert argv[1] == b'x' * 128 + b'... (72 more bytes)'
+    assert argv[-1] == b'... (11 more arguments)'
+
+def test_slowlogMaxLen(server, client):
+    c, peer = client
+    slowlogInit(server)
+    server.slowlog_log_slower_than = 0
+    run(c, peer, b'GET a\r\n' * 10)
+    assert run(c, peer, b'CONFIG SET slowlog-max-len 3\r\n') == b'+OK\r\n'
+    # 下一条日志写入时丢弃最旧的日志
+    run(c, peer, b'GET b\r\n')
+    assert len(server.slowlog) == 3
+    assert server.slowlog[0].argv == [b'GET', b'b']
+    assert run(c, peer, b'CONFIG GET slowlog-*\r\n') == (
+        b'*4\r\n$23\r\nslowlog-log-slower-than\r\n$1\r\n0\r\n$15\r\nslowlog-max-len\r\n$1\r\n3\r\n')
+    assert run(c, peer, b'CONFIG SET slowlog-max-len -1\r\n').startswith(b'-ERR Invalid argument')
+    # 负数关闭慢查询日志
+    assert run(c, peer, b'CONFIG SET slowlog-log-slower-than -1\r\n') == b'+OK\r\n'
+    run(c, peer, b'GET c\r\n')
+    assert server.slowlog[0].argv[0] == b'CONFIG'
+
+def test_commandstats(server, client):
+    c, peer = client
+    get = server.commands['get']
+    get.calls = get.microseconds = get.rejected_calls = get.failed_calls = 0
+    get.latency_histogram = None
+    run(c, peer, b'SET a 1\r\nGET a\r\nGET b\r\nGET\r\n')
+    assert (get.calls, get.rejected_calls, get.failed_calls) == (2, 1, 0)
+    assert get.latency_histogram.total_count == 2
+    # 执行时回复了错误的命令计为失败
+    set_ = server.commands['set']
+    failed = set_.failed_calls
+    assert run(c, peer, b'SET a 1 NX XX\r\n') == b'-ERR syntax error\r\n'
+    assert set_.failed_calls == failed + 1
+    reply = run(c, peer, b'INFO commandstats\r\n')
+    assert b'\r\ncmdstat_get:calls=2,usec=%d,' % get.microseconds in reply
+    assert b',rejected_calls=1,failed_calls=0\r\n' in reply
+    reply = run(c, peer, b'INFO latencystats\r\n')
+    assert reply.startswith(b'$')
+    assert b'# Latencystats\r\n' in reply
+    assert b'latency_percentiles_usec_get:p50=' in reply
+    assert b',p99=' in reply and b',p99.9=' in reply
+
+def test_latencyTrackingDisabled(server, client):
+    c, peer = client
+    get = server.commands['get']
+    get.latency_histogram = None
+    server.latency_tracking = 0
+    run(c, peer, b'GET a\r\n')
+    assert get.latency_histogram is None
+    assert run(c, peer, b'LATENCY HISTOGRAM get\r\n') == b'*0\r\n'
+
+def test_latencyHistogram(server, client):
+    c, peer = client
+    get = server.commands['get']
+    get.latency_histogram = None
+    run(c, peer, b'GET a\r\nGET a\r\n')
+    reply = run(c, peer, b'LATENCY HISTOGRAM GET nope get\r\n')
+    assert reply.startswith(b'*2\r\n$3\r\nget\r\n*4\r\n$5\r\ncalls\r\n:2\r\n$14\r\nhistogram_usec\r\n*')
+    # 累计计数, 最后一个分段包括所有调用
+    assert reply.endswith(b':2\r\n')
+    assert run(c, peer, b'LATENCY FOO\r\n').startswith(b'-ERR Unknown LATENCY subcommand')
+
+def info(c, peer, section=b''):
+    reply = run(c, peer, b'INFO %s\r\n' % section)
+    header, _, body = reply.partition(b'\r\n')
+    while len(body) < int(header[1:]) + 2:
+        body += peer.recv(1000)
+    assert int(header[1:]) == len(body) - 2
+    return dict(line.split(':', 1) for line in body.decode().split('\r\n') if line and not line.startswith('#'))
+
+def test_infoDefaultSections(server, client):
+    c, peer = client
+    server.stat_starttime = server.unixtime
+    run(c, peer, b'SET a 1\r\nSET b 2 EX 100\r\nGET b\r\nGET c\r\n')
+    fields = info(c, peer)
+    assert fields['multiplexing_api'] == server.el.api.aeApiName()
+    assert fields['connected_clients'] == '1'
+    assert fields['blocked_clients'] == '0'
+    assert fields['keyspace_hits'] == '1' and fields['keyspace_misses'] == '1'
+    assert fields['total_commands_processed'] == '4'
+    assert fields['db0'] == 'keys=2,expires=1,avg_ttl=0'
+    assert int(fields['used_memory']) >= 0
+    # commandstats 和 latencystats 只在指定或者 all 时返回
+    assert 'cmdstat_get' not in fields
+    fields = info(c, peer, b'all')
+    assert 'cmdstat_get' in fields and 'redis_version' in fields
+    assert set(info(c, peer, b'keyspace')) == {'db0'}
+    assert info(c, peer, b'nope') == {}
+    assert run(c, peer, b'INFO a b\r\n') == b'-ERR syntax error\r\n'
+
+def test_instantaneousOpsPerSec(server):
+    server.mstime = server.ops_sec_last_sample_time + 100
+    server.stat_numcommands = 50
+    trackOperationsPerSecond(server)
+    assert server.ops_sec_samples[0] == 500
+    assert getOperationsPerSecond(server) == 500 // len(server.ops_sec_samples)
+
+def test_latencyMonitor(server, client):
+    c, peer = client
+    latencyMonitorInit(server)
+    # 阈值为 0 时不记录
+    latencyAddSampleIfNeeded("command", 100)
+    assert server.latency_events == {}
+    assert run(c, peer, b'LATENCY DOCTOR\r\n').startswith(b"$")
+    assert run(c, peer, b'CONFIG SET latency-monitor-threshold 10\r\n') == b'+OK\r\n'
+    latencyAddSampleIfNeeded("command", 5)
+    assert server.latency_events == {}
+    server.unixtime = 1000
+    latencyAddSampleIfNeeded("command", 20)
+    # 同一秒内的样本合并, 保留最大的
+    latencyAddSampleIfNeeded("command", 30)
+    latencyAddSampleIfNeeded("command", 15)
+    server.unixtime = 1001
+    latencyAddSampleIfNeeded("command", 12)
+    latencyAddSampleIfNeeded("gc", 50)
+    assert run(c, peer, b'LATENCY HISTORY command\r\n') == b'*2\r\n*2\r\n:1000\r\n:30\r\n*2\r\n:1001\r\n:12\r\n'
+    assert run(c, peer, b'LATENCY LATEST\r\n') == (
+        b'*2\r\n*4\r\n$7\r\ncommand\r\n:1001\r\n:12\r\n:30\r\n*4\r\n$2\r\ngc\r\n:1001\r\n:50\r\n:50\r\n')
+    report = run(c, peer, b'LATENCY DOCTOR\r\n')
+    assert b'1. command: 2 latency spikes (average 21ms, mean deviation 9ms, period 0.50 sec)' in report
+    assert b'garbage collector' in report
+    assert run(c, peer, b'LATENCY RESET gc nope\r\n') == b':1\r\n'
+    assert run(c, peer, b'LATENCY RESET\r\n') == b':1\r\n'
+    assert run(c, peer, b'LATENCY HISTORY command\r\n') == b'*0\r\n'
+    assert run(c, peer, b'LATENCY HISTORY\r\n').startswith(b'-ERR Unknown LATENCY subcommand')
+
+def test_latencyTimeSeriesWraps(server):
+    latencyMonitorInit(server)
+    server.latency_monitor_threshold = 1
+    for t in range(1, LATENCY_TS_LEN + 11):
+        server.unixtime = t
+        latencyAddSampleIfNeeded("event-loop", t)
+    ts = server.latency_events["event-loop"]
+    assert len(ts.samples) == LATENCY_TS_LEN
+    assert ts.max == LATENCY_TS_LEN + 10
+    # 最旧的样本被覆盖
+    assert min(s.time for s in ts.samples) == 11
+
+def test_latencyGcDuringReply(server, client, monkeypatch):
+    import gc
+    from redis_server import latency
+    c, peer = client
+    latencyMonitorInit(server)
+    server.latency_monitor_threshold = 1
+    latencyAddSampleIfNeeded("command", 5)
+    clock = [10**9]
+    monkeypatch.setattr(latency, 'getMonotonicUs', lambda: clock[0])
+    addReplyLongLong = latency.addReplyLongLong
+    def collectingAddReplyLongLong(c, ll):
+        # 回复的过程中发生一次 50 毫秒的垃圾回收
+        latencyGcCallback('start', {})
+        gc.collect()
+        clock[0] += 50000
+        latencyGcCallback('stop', {})
+        addReplyLongLong(c, ll)
+    monkeypatch.setattr(latency, 'addReplyLongLong', collectingAddReplyLongLong)
+    assert gc.callbacks.count(latencyGcCallback) <= 1
+    reply = run(c, peer, b'LATENCY LATEST\r\n')
+    assert reply.startswith(b'*1\r\n*4\r\n$7\r\ncommand\r\n')
+    # 停顿在事件循环中才记录
+    assert 'gc' not in server.latency_events
+    latencyFlushGcPause()
+    assert server.latency_events['gc'].max == 50
+    latencyFlushGcPause()
+    assert len(latencyTimeSeriesSamples(server.latency_events['gc'])) == 1
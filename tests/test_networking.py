@@ -0,0 +1,453 @@
+import os
+import socket
+from redis_server.ae import aeGetFileEvents, AE_WRITABLE, AE_READABLE
+from redis_server.redis import (
+    RedisClient, createClient, freeClient, clientsCron, clientsCronResizeQueryBuffer, processUnblockedClients,
+)
+from redis_server.db import setKey
+from redis_server.sds import sdsnew, sdslen, sdscatlen, sdsAllocSize, sdsMakeRoomFor
+from redis_server.config import (
+    REDIS_PENDING_WRITE, REDIS_PENDING_READ, REDIS_CLOSE_AFTER_REPLY, REDIS_OK, REDIS_ERR, REDIS_REPLY_CHUNK_BYTES,
+    REDIS_REPLY_ZEROCOPY_BYTES, REDIS_CLOSE_ASAP, REDIS_CLIENT_LIMIT_CLASS_NORMAL, REDIS_PENDING_COMMAND,
+    REDIS_READ_PAUSED, REDIS_UNIX_SOCKET,
+)
+from redis_server.robject import createStringObject
+from redis_server.anet import anetUnixServer, anetNonBlock
+from redis_server.adlist import listFirst, listNextNode, listNodeValue, listLength
+from redis_server.util import get_shared
+from redis_server.networking import (
+    addReplyString, addReplyBulk, handleClientsWithPendingWrites, writeToClient, processMultibulkBuffer, processInlineBuffer,
+    processInputBuffer, resetClient, freeClientsInAsyncFreeQueue, readQueryFromClient, readBufferPool,
+    processClientsWithPendingCommands, getClientOutputBufferMemoryUsage, acceptUnixHandler,
+    readQueryFromClientsIO, handleClientsWithPendingReadsUsingThreads, clientsArePaused,
+)
+
+def test_createAndFreeClients(server):
+    pairs = [socket.socketpair() for _ in range(3)]
+    clients = [createClient(server, a) for a, _ in pairs]
+    # 阻塞, 事务和订阅的状态在使用时才创建
+    assert clients[0].bpop is None
+    assert clients[0].mstate is None
+    assert clients[0].pubsub_channels is None
+    freeClient(clients[1])
+    assert listLength(server.clients) == 2
+    assert listNodeValue(listFirst(server.clients)) is clients[0]
+    assert listNodeValue(listNextNode(listFirst(server.clients))) is clients[2]
+    for _, b in pairs:
+        b.close()
+
+def test_handleClientsWithPendingWrites(server, client):
+    c, peer = client
+    addReplyString(c, b'+OK\r\n', 5)
+    addReplyString(c, b'+OK\r\n', 5)
+    # 不注册写事件, 等待 beforeSleep 写入
+    assert server.clients_pending_write == [c]
+    assert c.flags & REDIS_PENDING_WRITE
+    assert server.el.events[c.fd.fileno()].mask == AE_READABLE
+    assert handleClientsWithPendingWrites() == 1
+    assert peer.recv(100) == b'+OK\r\n+OK\r\n'
+    assert not c.flags & REDIS_PENDING_WRITE
+    assert server.clients_pending_write == []
+    assert server.el.events[c.fd.fileno()].mask == AE_READABLE
+
+def test_handleClientsWithPendingWritesPartial(server, client, monkeypatch):
+    c, peer = client
+    # 只检查写事件, 不暂停读取
+    monkeypatch.setattr(server, 'client_read_pause_high', 0)
+    data = b'x' * (1024 * 1024)
+    addReplyString(c, data, len(data))
+    handleClientsWithPendingWrites()
+    # 套接字写不下, 注册写事件
+    assert server.el.events[c.fd.fileno()].mask == AE_READABLE|AE_WRITABLE
+    received = b''
+    peer.setblocking(False)
+    while c.bufpos or c.reply.len:
+        try:
+            received += peer.recv(1024 * 1024)
+        except BlockingIOError:
+            pass
+        server.el.events[c.fd.fileno()].wfileProc(server.el, c.fd.fileno(), c, AE_WRITABLE)
+    peer.setblocking(True)
+    while len(received) < len(data):
+        received += peer.recv(1024 * 1024)
+    assert received == data
+    assert server.el.events[c.fd.fileno()].mask == AE_READABLE
+
+def test_writeToClientPartial(server, client):
+    c, peer = client
+    peer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    c.fd.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    # c.buf 和多个回复链表节点
+    replies = [b'%d' % i * (i * 37 % 5000 + 1) for i in range(300)]
+    for r in replies:
+        addReplyString(c, r, len(r))
+    assert c.reply.len > 10
+    expected = b''.join(replies)
+    received = b''
+    peer.setblocking(False)
+    while c.bufpos or c.reply.len:
+        writeToClient(c, 0)
+        try:
+            received += peer.recv(1024 * 1024)
+        except BlockingIOError:
+            pass
+    peer.setblocking(True)
+    while len(received) < len(expected):
+        received += peer.recv(1024 * 1024)
+    assert received == expected
+    assert c.sentlen == 0
+    assert c.reply_bytes == 0
+
+def test_addReplyBulkShared(server, client):
+    c, peer = client
+    shared = get_shared()
+    value = createStringObject(b'x' * (REDIS_REPLY_CHUNK_BYTES + 1), REDIS_REPLY_CHUNK_BYTES + 1)
+    addReplyBulk(c, value)
+    addReplyBulk(c, value)
+    # 追加到共享的链表尾节点之前要先复制, 不能修改 shared.crlf
+    assert shared.crlf.ptr.content == b'\r\n'
+    expected = b'$%d\r\n%s\r\n' % (sdslen(value.ptr), value.ptr.content) * 2
+    received = b''
+    while c.bufpos or c.reply.len:
+        writeToClient(c, 0)
+        received += peer.recv(1024 * 1024)
+    assert received == expected
+
+def test_addReplyBulkZeroCopy(server, client):
+    c, peer = client
+    value = createStringObject(b'v' * REDIS_REPLY_ZEROCOPY_BYTES, REDIS_REPLY_ZEROCOPY_BYTES)
+    addReplyBulk(c, value)
+    addReplyBulk(c, value)
+    # 头部写入 c.buf, 值对象本身放入链表, 后面的回复不能追加到它上面
+    assert c.bufpos == len(b'$4096\r\n')
+    nodes = []
+    ln = listFirst(c.reply)
+    while ln:
+        nodes.append(listNodeValue(ln))
+        ln = listNextNode(ln)
+    assert nodes[0] is value and nodes[2] is value
+    assert value.refcount == 3
+    assert sdslen(value.ptr) == REDIS_REPLY_ZEROCOPY_BYTES
+    received = b''
+    while c.bufpos or c.reply.len:
+        writeToClient(c, 0)
+        received += peer.recv(1024 * 1024)
+    assert received == b'$4096\r\n%s\r\n' % value.ptr.content * 2
+    assert value.refcount == 1
+    assert c.reply_bytes == 0
+
+def test_addReplyBulkRespCache(server, client, monkeypatch):
+    c, peer = client
+    key = createStringObject(b'k', 1)
+    val = createStringObject(b'hello', 5)
+    setKey(c.db, key, val)
+    addReplyBulk(c, val)
+    addReplyBulk(c, val)
+    assert val.resp == b'$5\r\nhello\r\n'
+    assert server.resp_cache_memory == len(val.resp)
+    assert server.stat_resp_cache_hits == 1
+    # 覆盖之后释放旧值的缓存
+    setKey(c.db, key, createStringObject(b'world', 5))
+    assert val.resp is None
+    assert server.resp_cache_memory == 0
+    # 超过上限时不缓存
+    monkeypatch.setattr(server, 'resp_cache_max_memory', 10)
+    addReplyBulk(c, val)
+    assert val.resp is None
+    handleClientsWithPendingWrites()
+    assert peer.recv(100) == b'$5\r\nhello\r\n' * 3
+
+def test_outputBufferHardLimit(server, client):
+    c, peer = client
+    server.client_obuf_limits[REDIS_CLIENT_LIMIT_CLASS_NORMAL].hard_limit_bytes = 64 * 1024
+    data = b'x' * 1000
+    for _ in range(100):
+        addReplyString(c, data, len(data))
+    assert c.flags & REDIS_CLOSE_ASAP
+    assert server.clients_to_close == [c]
+    assert server.stat_client_obuf_limit_disconnections == 1
+    # 关闭之前不再接收回复
+    reply_bytes = c.reply_bytes
+    assert reply_bytes < 70 * 1024
+    addReplyString(c, data, len(data))
+    assert c.reply_bytes == reply_bytes
+    freeClientsInAsyncFreeQueue()
+    assert listLength(server.clients) == 0
+    assert c.client_list_node is None
+
+def test_outputBufferSoftLimit(server, client):
+    c, peer = client
+    limits = server.client_obuf_limits[REDIS_CLIENT_LIMIT_CLASS_NORMAL]
+    limits.soft_limit_bytes = 32 * 1024
+    limits.soft_limit_seconds = 10
+    server.unixtime = 1000
+    data = b'x' * 1000
+    for _ in range(60):
+        addReplyString(c, data, len(data))
+    assert c.obuf_soft_limit_reached_time == 1000
+    server.unixtime = 1010
+    addReplyString(c, data, len(data))
+    assert not c.flags & REDIS_CLOSE_ASAP
+    # 连续超过软限制 soft_limit_seconds 秒之后关闭
+    server.unixtime = 1011
+    addReplyString(c, data, len(data))
+    assert c.flags & REDIS_CLOSE_ASAP
+    assert server.stat_client_obuf_limit_disconnections == 1
+
+def test_outputBufferSoftLimitCron(server, client):
+    c, peer = client
+    limits = server.client_obuf_limits[REDIS_CLIENT_LIMIT_CLASS_NORMAL]
+    limits.soft_limit_bytes = 32 * 1024
+    limits.soft_limit_seconds = 10
+    server.unixtime = 1000
+    data = b'x' * 1000
+    for _ in range(60):
+        addReplyString(c, data, len(data))
+    # 没有新的回复, 由 clientsCron 检查软限制是否超时
+    server.unixtime = 1011
+    clientsCron(server)
+    assert c.flags & REDIS_CLOSE_ASAP
+    assert server.stat_client_obuf_limit_disconnections == 1
+
+def test_outputBufferSoftLimitReset(server, client):
+    c, peer = client
+    limits = server.client_obuf_limits[REDIS_CLIENT_LIMIT_CLASS_NORMAL]
+    limits.soft_limit_bytes = 32 * 1024
+    limits.soft_limit_seconds = 10
+    server.unixtime = 1000
+    data = b'x' * 40000
+    addReplyString(c, data, len(data))
+    addReplyString(c, data, len(data))
+    assert c.obuf_soft_limit_reached_time == 1000
+    # 回复发送完之后重新计时
+    while c.reply.len:
+        writeToClient(c, 0)
+        peer.recv(1024 * 1024)
+    assert c.obuf_soft_limit_reached_time == 0
+    server.unixtime = 1020
+    addReplyString(c, data, len(data))
+    addReplyString(c, data, len(data))
+    assert c.obuf_soft_limit_reached_time == 1020
+    assert not c.flags & REDIS_CLOSE_ASAP
+
+def test_readPauseOnPendingReplies(server, client, monkeypatch):
+    c, peer = client
+    monkeypatch.setattr(server, 'client_read_pause_high', 64 * 1024)
+    monkeypatch.setattr(server, 'client_read_pause_low', 16 * 1024)
+    fd = c.fd.fileno()
+    data = b'x' * 1024
+    for _ in range(2048):
+        addReplyString(c, data, len(data))
+    # 对端不读取, 写不完的回复超过了高水位
+    handleClientsWithPendingWrites()
+    assert c.flags & REDIS_READ_PAUSED
+    assert server.paused_reading_clients == 1
+    assert aeGetFileEvents(server.el, fd) == AE_WRITABLE
+    received = 0
+    while c.flags & REDIS_READ_PAUSED:
+        received += len(peer.recv(1024 * 1024))
+        writeToClient(c, 1)
+    assert getClientOutputBufferMemoryUsage(c) <= server.client_read_pause_low
+    assert server.paused_reading_clients == 0
+    assert aeGetFileEvents(server.el, fd) & AE_READABLE
+    while c.reply.len or c.bufpos:
+        received += len(peer.recv(1024 * 1024))
+        writeToClient(c, 1)
+    received += len(peer.recv(1024 * 1024))
+    assert received == 2048 * 1024
+
+def test_readQueryFromClientPooledBuffer(server, client):
+    c, peer = client
+    readBufferPool.clear()
+    peer.sendall(b'SET a 1\r\n')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    # 数据处理完之后缓冲区还回池中, 客户端只持有空的 querybuf
+    assert len(readBufferPool) == 1
+    assert c.pooled_querybuf is None
+    assert sdsAllocSize(c.querybuf) == 1
+    pooled = readBufferPool[0]
+    # 没有处理完的数据留在借来的缓冲区中, 缓冲区归客户端所有
+    peer.sendall(b'GET')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    assert c.querybuf is pooled
+    assert readBufferPool == []
+    peer.sendall(b' a\r\n')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    assert c.querybuf is pooled
+    handleClientsWithPendingWrites()
+    assert peer.recv(100) == b'+OK\r\n$1\r\n1\r\n'
+
+def test_acceptUnixHandler(server, tmp_path):
+    path = str(tmp_path / 'redis.sock')
+    server.unixsocket = path
+    server.sofd = anetUnixServer(path, 0o700, 16)
+    anetNonBlock(server.sofd)
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o700)
+    peer = socket.socket(socket.AF_UNIX)
+    peer.connect(path)
+    acceptUnixHandler(server.el, server.sofd.fileno(), server.sofd, AE_READABLE)
+    # 没有等待的连接时直接返回
+    acceptUnixHandler(server.el, server.sofd.fileno(), server.sofd, AE_READABLE)
+    assert listLength(server.clients) == 1
+    c = listNodeValue(listFirst(server.clients))
+    assert c.flags & REDIS_UNIX_SOCKET
+    assert aeGetFileEvents(server.el, c.fd.fileno()) == AE_READABLE
+    peer.sendall(b'SET a 1\r\nGET a\r\n')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    handleClientsWithPendingWrites()
+    assert peer.recv(100) == b'+OK\r\n$1\r\n1\r\n'
+    peer.close()
+    server.sofd.close()
+
+def test_clientsCronResizeQueryBuffer(server, client):
+    c, peer = client
+    data = b'x' * 100
+    c.querybuf = sdsMakeRoomFor(sdsnew(data), 64 * 1024)
+    c.querybuf_peak = 100
+    server.unixtime = c.lastinteraction
+    clientsCronResizeQueryBuffer(c)
+    assert sdsAllocSize(c.querybuf) == len(data) + 1
+    assert c.querybuf.buf[:100] == data
+    assert c.querybuf_peak == 0
+    # 空闲的客户端
+    c.querybuf = sdsMakeRoomFor(sdsnew(data), 4096)
+    clientsCronResizeQueryBuffer(c)
+    assert sdsAllocSize(c.querybuf) > 4096
+    server.unixtime = c.lastinteraction + 3
+    clientsCronResizeQueryBuffer(c)
+    assert sdsAllocSize(c.querybuf) == len(data) + 1
+
+
+def parser_client(data: bytes) -> RedisClient:
+    # 只解析不执行, 命令保存在 argv_queue 中
+    c = RedisClient()
+    c.bulklen = -1
+    c.flags |= REDIS_PENDING_READ
+    c.querybuf = sdsnew(data)
+    return c
+
+def queued_args(c: RedisClient) -> list:
+    return [[bytes(o.ptr.content) for o in argv] for argv in c.argv_queue]
+
+def test_processMultibulkBuffer():
+    first = b'*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$2\r\nvv\r\n'
+    c = parser_client(first + b'*2\r\n$3\r\nGET\r\n$1\r')
+    assert processMultibulkBuffer(c) == REDIS_OK
+    assert [bytes(o.ptr.content) for o in c.argv] == [b'SET', b'k', b'vv']
+    # 只移动 qb_pos, 不移动 querybuf
+    assert c.qb_pos == len(first)
+    assert sdslen(c.querybuf) == len(first) + 16
+    resetClient(c)
+    assert processMultibulkBuffer(c) == REDIS_ERR
+    assert [bytes(o.ptr.content) for o in c.argv] == [b'GET']
+    assert c.multibulklen == 1
+    assert c.qb_pos == len(first) + 13
+
+def test_processInlineBuffer():
+    c = parser_client(b'set k  v\r\nget k\nping')
+    assert processInlineBuffer(c) == REDIS_OK
+    assert [bytes(o.ptr.content) for o in c.argv] == [b'set', b'k', b'v']
+    resetClient(c)
+    assert processInlineBuffer(c) == REDIS_OK
+    assert [bytes(o.ptr.content) for o in c.argv] == [b'get', b'k']
+    resetClient(c)
+    assert processInlineBuffer(c) == REDIS_ERR
+    assert c.qb_pos == 16
+
+def test_processInputBuffer():
+    cmds = [[b'SET', b'key:%d' % i, b'x' * i] for i in range(100)]
+    data = b''.join(b'*%d\r\n' % len(argv) + b''.join(b'$%d\r\n%s\r\n' % (len(a), a) for a in argv) for argv in cmds)
+    data += b'PING\r\n'
+    c = parser_client(b'')
+    # 分多次到达的数据
+    for i in range(0, len(data), 7):
+        chunk = data[i:i+7]
+        sdscatlen(c.querybuf, chunk, len(chunk))
+        processInputBuffer(c)
+        assert c.qb_pos == 0
+    assert queued_args(c) == cmds + [[b'PING']]
+    assert sdslen(c.querybuf) == 0
+
+def test_processInputBufferProtocolError():
+    c = parser_client(b'*1\r\n$3\r\nGET\r\n*1\r\n!3\r\n')
+    processInputBuffer(c)
+    assert queued_args(c) == [[b'GET']]
+    # 等 GET 执行之后再回复错误
+    assert c.protoerr == "Protocol error: expected '$', got '!'"
+    assert not c.flags & REDIS_CLOSE_AFTER_REPLY
+
+def test_readQueryFromClientsIOProtocolError(server, client):
+    c, peer = client
+    c.flags |= REDIS_PENDING_READ
+    server.clients_pending_read.append(c)
+    peer.sendall(b'*1\r\n!3\r\n')
+    assert readQueryFromClientsIO([c]) == []
+    # I/O 线程中不回复错误, 也不修改服务器的统计数据
+    assert c.protoerr and not c.bufpos
+    assert server.stat_total_error_replies == 0
+    # 由主线程回复
+    assert handleClientsWithPendingReadsUsingThreads() == 1
+    handleClientsWithPendingWrites()
+    assert peer.recv(100) == b"-ERR Protocol error: expected '$', got '!'\r\n"
+    assert server.stat_total_error_replies == 1
+    assert c.flags & REDIS_CLOSE_AFTER_REPLY
+
+def test_readQueryFromClientsIOPaused(server, client, monkeypatch):
+    c, peer = client
+    monkeypatch.setattr(server, 'clients_paused', 1)
+    monkeypatch.setattr(server, 'clients_pause_end_time', server.unixtime + 10)
+    c.flags |= REDIS_PENDING_READ
+    server.clients_pending_read.append(c)
+    peer.sendall(b'SET a 1\r\n')
+    # I/O 线程中只解析, 暂停期间主线程不执行
+    assert handleClientsWithPendingReadsUsingThreads() == 1
+    assert len(c.argv_queue) == 1
+    # 暂停结束之后执行解析好的命令
+    server.clients_pause_end_time = server.unixtime - 1
+    assert not clientsArePaused()
+    processUnblockedClients()
+    handleClientsWithPendingWrites()
+    assert peer.recv(100) == b'+OK\r\n'
+
+def test_processInputBufferPipeline(server, client):
+    c, peer = client
+    data = b'SET a 1\r\n*2\r\n$3\r\nGET\r\n$1\r\na\r\nget b\r\nget a\r\nNOPE\r\n*1\r\n!1\r\n'
+    sdscatlen(c.querybuf, data, len(data))
+    processInputBuffer(c)
+    handleClientsWithPendingWrites()
+    assert peer.recv(1000) == (b"+OK\r\n$1\r\n1\r\n$-1\r\n$1\r\n1\r\n-ERR unknown command 'NOPE'\r\n"
+                               b"-ERR Protocol error: expected '$', got '!'\r\n")
+    assert c.flags & REDIS_CLOSE_AFTER_REPLY
+
+def test_processInputBufferCommandBudget(server, client, monkeypatch):
+    c, peer = client
+    a, b = socket.socketpair()
+    c2 = createClient(server, a)
+    monkeypatch.setattr(server, 'client_command_budget', 2)
+    data = b'SET a 1\r\nGET a\r\nGET a\r\nGET a\r\nGET a\r\n'
+    sdscatlen(c.querybuf, data, len(data))
+    processInputBuffer(c)
+    assert c.flags & REDIS_PENDING_COMMAND
+    assert len(c.argv_queue) == 3
+    assert list(server.clients_pending_commands) == [c]
+    assert server.stat_client_budget_deferrals == 1
+    # 排队期间不读取新的数据
+    peer.sendall(b'GET a\r\n')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    assert len(c.argv_queue) == 3
+    # 其他客户端的命令和排队的客户端轮流执行
+    data = b'GET a\r\nGET a\r\nGET a\r\n'
+    sdscatlen(c2.querybuf, data, len(data))
+    processInputBuffer(c2)
+    assert list(server.clients_pending_commands) == [c, c2]
+    assert processClientsWithPendingCommands() == 2
+    assert list(server.clients_pending_commands) == [c]
+    assert not c2.flags & REDIS_PENDING_COMMAND
+    assert processClientsWithPendingCommands() == 1
+    assert not server.clients_pending_commands
+    assert not c.flags & REDIS_PENDING_COMMAND
+    assert server.stat_client_budget_deferrals == 3
+    handleClientsWithPendingWrites()
+    assert peer.recv(1000) == b'+OK\r\n' + b'$1\r\n1\r\n' * 4
+    assert b.recv(1000) == b'$1\r\n1\r\n' * 3
+    b.close()
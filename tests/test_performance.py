@@ -1,3 +1,6 @@
+import os
+import sys
+import socket
 import subprocess
 import time
 from redis import Redis
@@ -8,3 +11,69 @@ def test_set():
     for i in range(10000):
         conn.set('test{}'.format(i), i)
     print(time.time() - now)
+
+def test_parse_pipeline():
+    # 只测试解析: 10000 个 pipeline 命令一次到达
+    from redis_server.redis import RedisClient
+    from redis_server.sds import sdsnew
+    from redis_server.config import REDIS_PENDING_READ
+    from redis_server.networking import processInputBuffer
+    n = 10000
+    c = RedisClient()
+    c.bulklen = -1
+    c.flags |= REDIS_PENDING_READ
+    c.querybuf = sdsnew(b''.join(b'*3\r\n$3\r\nSET\r\n$%d\r\ntest%d\r\n$1\r\nv\r\n' % (len(str(i))+4, i) for i in range(n)))
+    now = time.time()
+    processInputBuffer(c)
+    print(time.time() - now)
+    assert len(c.argv_queue) == n
+
+def _bench_set(sock, n):
+    now = time.time()
+    for i in range(n):
+        sock.sendall(b'SET test%d %d\r\n' % (i, i))
+        assert sock.recv(16) == b'+OK\r\n'
+    return time.time() - now
+
+def test_set_tcp_vs_unix(tmp_path):
+    # 同一个服务器分别通过 TCP 和 unix socket 执行 10000 次 SET
+    path = str(tmp_path / 'redis.sock')
+    proc = subprocess.Popen([sys.executable, '-m', 'redis_server', '--port', '5679', '--unixsocket', path],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        tcp = socket.create_connection(('127.0.0.1', 5679))
+        unix = socket.socket(socket.AF_UNIX)
+        unix.connect(path)
+        print('tcp', _bench_set(tcp, 10000))
+        print('unix', _bench_set(unix, 10000))
+        tcp.close()
+        unix.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def test_connection_churn():
+    # 短连接: 每次请求都建立连接, 执行一个命令, 然后断开
+    proc = subprocess.Popen([sys.executable, '-m', 'redis_server', '--port', '5680'],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', 5680)).close()
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+        now = time.time()
+        for _ in range(2000):
+            sock = socket.create_connection(('127.0.0.1', 5680))
+            sock.sendall(b'GET test\r\n')
+            assert sock.recv(16) == b'$-1\r\n'
+            sock.close()
+        print(time.time() - now)
+    finally:
+        proc.terminate()
+        proc.wait()
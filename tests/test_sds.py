@@ -1,5 +1,5 @@
 from redis_server.sds import (
-    strlen, sdstrim, sdsnew, sdsrange, memcmp,
+    strlen, sdstrim, sdsnew, sdsrange, memcmp, sdsMakeRoomFor, sdscatlen,
 )
 
 def test_strlen():
@@ -23,6 +23,20 @@ def test_sdsrange():
     assert s.len == 10
     assert s.free == 1
 
+def test_sdsMakeRoomFor():
+    s = sdsnew(b"Hello")
+    sdsMakeRoomFor(s, 10)
+    assert s.len == 5
+    assert s.free == 25
+    assert len(s.buf) == 31
+    # 已经有空闲空间时, 只补足缺少的部分
+    sdscatlen(s, b"x" * 20, 20)
+    assert s.free == 5
+    sdsMakeRoomFor(s, 10)
+    assert s.free == 45
+    assert len(s.buf) == 71
+    assert s.buf[:s.len] == b"Hello" + b"x" * 20
+
 def test_memcmp():
     assert memcmp(b'123', b'12', 1) == 0
     assert memcmp(b'a23', b'b2', 1) == -1
@@ -0,0 +1,131 @@
+import socket
+from redis_server.ae import AE_READABLE
+from redis_server.crc16 import crc16
+from redis_server.shard import (
+    keyHashSlot, shardOwner, shardReplyEnd, shardEncodeCommand, shardLink, shardReadHandler, REDIS_CLUSTER_SLOTS,
+)
+from redis_server.networking import readQueryFromClient, handleClientsWithPendingWrites
+from redis_server.redis import processUnblockedClients, REDIS_BLOCKED, REDIS_SHARD_CLIENT
+from redis_server.robject import createStringObject
+from redis_server.commands import redisCommand
+from redis_server.db import getKeysUsingCommandTable
+
+def test_crc16():
+    assert crc16(b'123456789') == 0x31C3
+    assert crc16(b'') == 0
+
+def test_keyHashSlot():
+    assert keyHashSlot(b'foo') == 12182
+    assert keyHashSlot(b'{user1000}.following') == keyHashSlot(b'{user1000}.followers')
+    assert keyHashSlot(b'{user1000}.following') == keyHashSlot(b'user1000')
+    # 空的 tag 和不完整的 tag 使用整个键
+    assert keyHashSlot(b'foo{}{bar}') == crc16(b'foo{}{bar}') & 0x3FFF
+    assert keyHashSlot(b'foo{bar') == crc16(b'foo{bar') & 0x3FFF
+    assert keyHashSlot(b'foo{{bar}}zap') == keyHashSlot(b'{bar')
+
+def test_shardOwner():
+    assert shardOwner(0, 4) == 0
+    assert shardOwner(REDIS_CLUSTER_SLOTS-1, 4) == 3
+    owners = [shardOwner(i, 3) for i in range(REDIS_CLUSTER_SLOTS)]
+    assert owners == sorted(owners)
+    assert set(owners) == {0, 1, 2}
+
+def test_getKeysUsingCommandTable():
+    get = redisCommand("get", None, 2, "r", 0, None, 1, 1, 1, 0, 0)
+    mget = redisCommand("mget", None, -2, "r", 0, None, 1, -1, 1, 0, 0)
+    mset = redisCommand("mset", None, -3, "wm", 0, None, 1, -1, 2, 0, 0)
+    ping = redisCommand("ping", None, -1, "rt", 0, None, 0, 0, 0, 0, 0)
+    assert getKeysUsingCommandTable(get, [], 2) == [1]
+    assert getKeysUsingCommandTable(mget, [], 4) == [1, 2, 3]
+    assert getKeysUsingCommandTable(mset, [], 5) == [1, 3]
+    assert getKeysUsingCommandTable(ping, [], 1) == []
+
+def test_shardReplyEnd():
+    buf = bytearray(b'+OK\r\n$3\r\nbar\r\n$-1\r\n*2\r\n:1\r\n$1\r\nx\r\n*2\r\n:1')
+    assert shardReplyEnd(buf, 0) == 5
+    assert shardReplyEnd(buf, 5) == 14
+    assert shardReplyEnd(buf, 14) == 19
+    assert shardReplyEnd(buf, 19) == 34
+    assert shardReplyEnd(buf, 34) == -1
+    assert shardReplyEnd(bytearray(b'$3\r\nba'), 0) == -1
+
+def test_protocolErrorAfterForwardedReplies(server, client, monkeypatch):
+    c, peer = client
+    monkeypatch.setattr(server, 'workers_num', 3)
+    monkeypatch.setattr(server, 'worker_id', 0)
+    monkeypatch.setattr(server, 'shard_links', {})
+    # k0 和 k4 都属于 worker 1, 用 socketpair 代替到 worker 1 的连接
+    assert shardOwner(keyHashSlot(b'k0'), 3) == shardOwner(keyHashSlot(b'k4'), 3) == 1
+    link = server.shard_links[1] = shardLink(1)
+    link.fd, worker = socket.socketpair()
+    link.fd.setblocking(False)
+    peer.setblocking(False)
+    peer.sendall(b'SET k0 a\r\nSET k4 b\r\n*abc\r\n')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    assert c.flags & REDIS_BLOCKED
+    # 两个命令的回复到达之前不能回复协议错误
+    for replied in (0, 1):
+        handleClientsWithPendingWrites()
+        if replied:
+            assert peer.recv(100) == b'+OK\r\n'
+        assert c.bufpos == 0 and c.protoerr
+        worker.sendall(b'+OK\r\n')
+        shardReadHandler(server.el, link.fd.fileno(), link, AE_READABLE)
+        processUnblockedClients()
+    assert not c.flags & REDIS_BLOCKED
+    handleClientsWithPendingWrites()
+    assert peer.recv(100) == b'+OK\r\n-ERR Protocol error: invalid multibulk length\r\n'
+    link.fd.close()
+    worker.close()
+
+def test_configSetBroadcast(server, client, monkeypatch):
+    c, peer = client
+    monkeypatch.setattr(server, 'workers_num', 3)
+    monkeypatch.setattr(server, 'worker_id', 0)
+    monkeypatch.setattr(server, 'shard_links', {})
+    workers = []
+    for worker_id in (1, 2):
+        link = server.shard_links[worker_id] = shardLink(worker_id)
+        link.fd, worker = socket.socketpair()
+        link.fd.setblocking(False)
+        workers.append((link, worker))
+    peer.sendall(b'CONFIG SET slowlog-max-len 5\r\n')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    handleClientsWithPendingWrites()
+    # 本地立即生效, 不等待其他 worker 的回复
+    assert peer.recv(100) == b'+OK\r\n'
+    assert server.slowlog_max_len == 5
+    argv = [createStringObject(s, len(s)) for s in (b'CONFIG', b'SET', b'slowlog-max-len', b'5')]
+    for link, worker in workers:
+        assert link.obuf == shardEncodeCommand(argv)
+        assert list(link.clients) == [None]
+        # 回复被丢弃
+        worker.sendall(b'+OK\r\n')
+        shardReadHandler(server.el, link.fd.fileno(), link, AE_READABLE)
+        assert not link.clients and not link.inbuf
+        link.obuf.clear()
+    # 其他 worker 转发来的 CONFIG SET 不再广播
+    c.flags |= REDIS_SHARD_CLIENT
+    peer.sendall(b'CONFIG SET slowlog-max-len 6\r\n')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    handleClientsWithPendingWrites()
+    assert peer.recv(100) == b'+OK\r\n'
+    assert server.slowlog_max_len == 6
+    for link, worker in workers:
+        assert not link.obuf
+        link.fd.close()
+        worker.close()
+
+def test_crossSlotCountedAsError(server, client, monkeypatch):
+    c, peer = client
+    monkeypatch.setattr(server, 'workers_num', 3)
+    monkeypatch.setattr(server, 'worker_id', 0)
+    # k0 属于 worker 1, k1 属于 worker 2
+    mget = redisCommand("mget", None, -2, "r", 0, None, 1, -1, 1, 0, 0)
+    monkeypatch.setitem(server.command_lookup, b'MGET', mget)
+    peer.sendall(b'MGET k0 k1\r\n')
+    readQueryFromClient(server.el, c.fd.fileno(), c, AE_READABLE)
+    handleClientsWithPendingWrites()
+    assert peer.recv(100) == b"-CROSSSLOT Keys in request don't hash to the same slot\r\n"
+    assert server.stat_total_error_replies == 1
+    assert mget.rejected_calls == 1